@@ -7,11 +7,23 @@ UMAP_PROJ = "umap"
 RANDOM_STATE = 42
 BATCH_SIZE = 32
 DEVICE = "cpu"
-NUM_WORKERS = 0
+NUM_WORKERS = 4
+PREFETCH_FACTOR = 4
 MAX_IMAGE_PIXELS = 110000000
 DATASETS_JSON_NAME = "image-viz/backend/datasets.json"
 NGINX_CONF_JSON_NAME = "image-viz/nginx/nginx.conf.json"
 DOCKER_COMPOSE_YML_NAME = "image-viz/docker-compose.yaml"
+DATA_DIR_NAME = "image-viz/backend/data"
+EMBEDDINGS_FILE_NAME = "embeddings.npy"
+ATTRIBUTES_FILE_NAME = "attributes.json"
+CHECKPOINT_FILE_NAME = "checkpoint.json"
+SKIPPED_FILE_NAME = "skipped.json"
+KNN_INDEXES_FILE_NAME = "knn_indexes.npy"
+KNN_SCORES_FILE_NAME = "knn_scores.npy"
+IMAGE_TO_TILE_FILE_NAME = "image_to_tile.npy"
+# Number of neighbors stored for each image, and number of images multiplied together when computing them
+KNN_GRAPH_K = 50
+KNN_BLOCK_SIZE = 2048
 
 # Database constants
 INSERT_SIZE = 500
@@ -22,6 +34,21 @@ DEFAULT_DATABASE_NAME = "aiplusart"
 COSINE_METRIC = "COSINE"
 L2_METRIC = "L2"
 INDEX_TYPE = "FLAT"
+# Default build and search parameters of the index types supported for the embeddings collections. The index of a
+# dataset is chosen with the "index" entry of the dataset in datasets.json, for example
+# "index": {"type": "HNSW", "params": {"M": 16, "efConstruction": 200}, "search_params": {"ef": 64}}.
+INDEX_PARAMS = {
+    "FLAT": {},
+    "HNSW": {"M": 16, "efConstruction": 200},
+    "IVF_FLAT": {"nlist": 1024},
+    "IVF_SQ8": {"nlist": 1024}
+}
+SEARCH_PARAMS = {
+    "FLAT": {},
+    "HNSW": {"ef": 64},
+    "IVF_FLAT": {"nprobe": 16},
+    "IVF_SQ8": {"nprobe": 16}
+}
 
 # Environment variables names
 MILVUS_IP = "MILVUS_IP"
@@ -1,2 +1,36 @@
-COUNTER_MAX_VALUE = 1000
 DATASETS_JSON_PATH = "/datasets.json"
+# Maximum number of texts encoded together, and maximum time in milliseconds that a text waits for other texts
+EMBEDDING_MAX_BATCH_SIZE = 32
+EMBEDDING_MAX_WAIT_MS = 5
+# Maximum number of entries and time to live in seconds of the caches of text embeddings and text search results
+TEXT_EMBEDDING_CACHE_SIZE = 4096
+TEXT_EMBEDDING_CACHE_TTL = 86400
+TEXT_SEARCH_CACHE_SIZE = 4096
+TEXT_SEARCH_CACHE_TTL = 3600
+# If True, the CLIP model used for serving has int8 dynamically quantized linear layers
+QUANTIZE_CLIP = False
+# Number of threads for CLIP inference and for Milvus calls
+INFERENCE_POOL_SIZE = 4
+MILVUS_POOL_SIZE = 16
+# Collections that have not been used for COLLECTION_IDLE_TIMEOUT seconds are released. The check runs every
+# RESIDENCY_CHECK_INTERVAL seconds.
+COLLECTION_IDLE_TIMEOUT = 600
+RESIDENCY_CHECK_INTERVAL = 30
+# Memory in bytes that loaded collections can use. When it is exceeded, collections are evicted with the policy, "lru"
+# or "lfu". Collections used in the last COLLECTION_EVICTION_MIN_IDLE seconds are not evicted.
+COLLECTION_MEMORY_BUDGET = 8 * 1024 ** 3
+RESIDENCY_POLICY = "lru"
+COLLECTION_EVICTION_MIN_IDLE = 10
+# Number of load and release events reported in the metrics
+RESIDENCY_EVENTS_SIZE = 100
+# Maximum size in bytes and number of shards of the cache of tiles
+TILE_CACHE_SIZE_BYTES = 512 * 1024 ** 2
+TILE_CACHE_SHARDS = 16
+# Directory with the data generated for each dataset, mounted in the container, and maximum number of images in a
+# request for neighbors
+DATA_DIR_PATH = "/data"
+NEIGHBORS_MAX_BATCH_SIZE = 100
+# Search backend of the datasets without a "search_backend" entry in datasets.json, "milvus" or "local"
+DEFAULT_SEARCH_BACKEND = "milvus"
+# Maximum number of images in a request for the tiles of images
+IMAGE_TO_TILE_MAX_BATCH_SIZE = 10000
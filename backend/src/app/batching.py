@@ -0,0 +1,102 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+
+import torch
+
+from .CONSTANTS import *
+from ..embeddings_model.EmbeddingsModel import EmbeddingsModel
+
+
+class TextEmbeddingBatcher:
+    """
+    Micro-batching queue for text embeddings. Callers put their text in a queue and wait for the result. A single
+    worker thread takes the first text in the queue, waits at most max_wait_ms for more texts, up to max_batch_size,
+    and encodes them in one forward pass. Texts are padded to the longest text of the batch, and each caller gets back
+    its own row of the result.
+    """
+
+    def __init__(self, embeddings: EmbeddingsModel, max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE,
+                 max_wait_ms: float = EMBEDDING_MAX_WAIT_MS):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        # Define metrics. They are only updated by the worker thread, except for the number of requests.
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.max_queue_depth = 0
+        self.batch_sizes = {}
+        self.total_wait = 0.0
+        # Start worker thread. The thread is a daemon, so that it does not prevent the application from exiting.
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, text: str) -> Future:
+        """
+        Queue a text for embedding, together with the texts of concurrent callers.
+        @param text: text to embed.
+        @return: future for a tensor with shape (1, embedding dimension).
+        """
+        future = Future()
+        with self.lock:
+            self.requests += 1
+        self.queue.put((text, time.monotonic(), future))
+        return future
+
+    def embed(self, text: str) -> torch.Tensor:
+        return self.submit(text).result()
+
+    def _get_batch(self) -> List[tuple]:
+        # Block until there is at least one request, then collect more requests until the batch is full or the
+        # maximum wait time has passed
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._get_batch()
+            texts = [text for text, _, _ in batch]
+            start = time.monotonic()
+            try:
+                with torch.no_grad():
+                    embeddings = self.embeddings.getTextEmbeddings(texts)
+                if embeddings is None:
+                    raise RuntimeError("Text embeddings could not be computed.")
+                for i, (_, _, future) in enumerate(batch):
+                    future.set_result(embeddings[i:i + 1].detach())
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+
+            # Update metrics
+            with self.lock:
+                self.batches += 1
+                self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+                self.max_queue_depth = max(self.max_queue_depth, len(batch) + self.queue.qsize())
+                self.total_wait += sum(start - enqueued for _, enqueued, _ in batch)
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            processed = sum(size * count for size, count in self.batch_sizes.items())
+            return {
+                "queue_depth": self.queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "requests": self.requests,
+                "batches": self.batches,
+                "mean_batch_size": processed / self.batches if self.batches > 0 else 0.0,
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+                "mean_wait_ms": 1000 * self.total_wait / processed if processed > 0 else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000
+            }
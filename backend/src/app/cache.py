@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable
+
+import orjson
+
+
+class LRUCache:
+    """
+    Thread-safe cache with a bounded number of entries and, optionally, a bounded size in bytes. When the cache is full,
+    the least recently used entries are evicted. Entries older than ttl seconds are treated as missing.
+    """
+
+    def __init__(self, max_size: int | None, ttl: float | None = None, max_bytes: int | None = None,
+                 sizeof: Callable[[object], int] | None = None):
+        """
+        @param max_size: maximum number of entries. If None, the number of entries is not bounded.
+        @param ttl: time to live of an entry in seconds. If None, entries do not expire.
+        @param max_bytes: maximum size of the values in bytes. If None, the size is not bounded.
+        @param sizeof: function returning the size of a value in bytes. It is required if max_bytes is not None.
+        """
+        if max_bytes is not None and sizeof is None:
+            raise ValueError("sizeof is required when max_bytes is set.")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        # Each entry is a tuple (value, insertion time, size in bytes)
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable):
+        """
+        Get the value for a key, and mark the entry as the most recently used.
+        @param key: the key.
+        @return: the value, or None if the key is not in the cache or the entry has expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+                # Remove expired entry
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value):
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, time.monotonic(), size)
+            self.bytes += size
+            while ((self.max_size is not None and len(self.entries) > self.max_size) or
+                   (self.max_bytes is not None and self.bytes > self.max_bytes)):
+                self.bytes -= self.entries.popitem(last=False)[1][2]
+
+    def _remove(self, key: Hashable):
+        self.bytes -= self.entries.pop(key)[2]
+
+    def invalidate(self, predicate: Callable[[Hashable], bool] | None = None):
+        """
+        Remove the entries whose key satisfies the predicate, or all the entries if predicate is None.
+        @param predicate: function of the key.
+        """
+        with self.lock:
+            if predicate is None:
+                self.entries.clear()
+                self.bytes = 0
+            else:
+                for key in [key for key in self.entries.keys() if predicate(key)]:
+                    self._remove(key)
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / (self.hits + self.misses) if self.hits + self.misses > 0 else 0.0
+            }
+
+
+def get_json_size(value) -> int:
+    # Size in bytes of the compact JSON serialization of a value
+    return len(orjson.dumps(value, default=str, option=orjson.OPT_SERIALIZE_NUMPY))
+
+
+class ShardedLRUCache:
+    """
+    Cache split into shards, each of them an LRUCache with its own lock, so that concurrent requests for different keys
+    rarely wait for each other. A key is always stored in the same shard, chosen from the hash of the key. The size in
+    bytes is bounded per shard, to max_bytes / num_shards.
+    """
+
+    def __init__(self, num_shards: int, max_bytes: int, sizeof: Callable[[object], int], ttl: float | None = None):
+        self.shards = [LRUCache(None, ttl, max_bytes // num_shards, sizeof) for _ in range(num_shards)]
+
+    def _get_shard(self, key: Hashable) -> LRUCache:
+        return self.shards[hash(key) % len(self.shards)]
+
+    def get(self, key: Hashable):
+        return self._get_shard(key).get(key)
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict:
+        """
+        Get the values of several keys.
+        @param keys: the keys.
+        @return: dictionary with the keys that are in the cache and their values.
+        """
+        values = {}
+        for key in keys:
+            value = self._get_shard(key).get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def put(self, key: Hashable, value):
+        self._get_shard(key).put(key, value)
+
+    def invalidate(self, predicate: Callable[[Hashable], bool] | None = None):
+        for shard in self.shards:
+            shard.invalidate(predicate)
+
+    def get_metrics(self) -> dict:
+        metrics = [shard.get_metrics() for shard in self.shards]
+        hits = sum(shard["hits"] for shard in metrics)
+        misses = sum(shard["misses"] for shard in metrics)
+        return {
+            "shards": len(self.shards),
+            "size": sum(shard["size"] for shard in metrics),
+            "bytes": sum(shard["bytes"] for shard in metrics),
+            "max_bytes": sum(shard["max_bytes"] for shard in metrics),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses > 0 else 0.0
+        }
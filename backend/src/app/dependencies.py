@@ -1,14 +1,21 @@
+import asyncio
+import itertools
 import json
 import threading
-from typing import List
+import time
+from contextlib import contextmanager
+from typing import Callable, List
 
 import torch
 from fastapi import Query
-from pymilvus import Collection
+from pymilvus import Collection, MilvusException
 from pymilvus.orm import utility
 
 from .CONSTANTS import *
+from .batching import TextEmbeddingBatcher
+from .cache import LRUCache
 from ..CONSTANTS import UMAP_COLLECTION_NAME
+from ..db_utilities.collections import get_index_config
 from ..embeddings_model.EmbeddingsModel import EmbeddingsModel
 
 
@@ -17,102 +24,181 @@ class HelperCollection:
     def __init__(self, name: str):
         self.name = name
         self.collection = Collection(name)
-        self.load = self.collection.load
-        self.release = self.collection.release
-        # Define counter. The counter is initialized to 0. When the collection is queried for the first time,
-        # it is loaded, and the counter is set to a value greater than 0. Every time the collection is not used by an
-        # app1 method that accesses the database, the counter is decremented by 1. Once the counter becomes 0,
-        # the collection is released. Every time the collection is queried, the counter is set to the value. It the
-        # collection had been released, it is loaded again once queried.
-        self.counter = 0
-        # Create lock to ensure that the counter is not accessed by multiple threads at the same time.
+        # Store the id of the collection. The id changes when the collection is dropped and created again.
+        self.collection_id = self.collection.describe()["collection_id"]
+        # Whether the collection has been loaded by the app, time of the last request that used it, and number of
+        # requests since the last residency check. Requests update the time and the number of requests without locks. A
+        # lost update only affects the choice of the collection to release. The residency manager uses them to decide
+        # when the collection is released.
+        self.loaded = False
+        self.last_access = time.monotonic()
+        self.accesses = 0
+        self.loads = 0
+        # Number of times requests have started and finished using the collection. The collection is not released while
+        # it is in use, since a request can wait in the queue of an executor for a long time after it has got the
+        # collection. next() on a counter is atomic, so requests update them without locks.
+        self.acquired = itertools.count()
+        self.released = itertools.count()
+        # Memory in bytes used by the collection the last time it was loaded
+        self.size = 0
+        # Create lock to ensure that the collection is not loaded and released at the same time. Requests only take it
+        # when the collection has to be loaded.
         self.lock = threading.Lock()
 
+    def _load(self) -> float:
+        # Load the collection. The lock must be held.
+        start = time.monotonic()
+        self.collection.load()
+        self.loaded = True
+        self.loads += 1
+        duration = time.monotonic() - start
+        self.size = get_loaded_size(self.name)
+        return duration
+
+    def load(self) -> float | None:
+        """
+        Load the collection if it is not loaded.
+        @return: time in seconds taken by the load, or None if the collection was already loaded.
+        """
+        with self.lock:
+            return self._load() if not self.loaded else None
+
+    def _get_in_use(self) -> int:
+        # Number of requests that are using the collection. The lock must be held, since reading the counters advances
+        # them. Both counters advance by one, so their difference does not change. Releases are read first, so that a
+        # request that finishes in between is counted in both counters, and the result is never too low.
+        released = next(self.released)
+        return next(self.acquired) - released
+
+    @property
+    def in_use(self) -> int:
+        with self.lock:
+            return self._get_in_use()
+
+    def acquire(self) -> float | None:
+        """
+        Mark the collection as in use by a request, and load it if it is not loaded. If the collection is loaded, no
+        lock is taken. Every call must be followed by a call to release_use.
+        @return: time in seconds taken by the load, or None if the collection was already loaded.
+        """
+        # The collection is marked as in use before the state is checked. A release that is running at the same time
+        # either sees the request and keeps the collection, or has already marked the collection as not loaded, and
+        # the request waits for the lock and loads the collection again.
+        next(self.acquired)
+        self.last_access = time.monotonic()
+        self.accesses += 1
+        if self.loaded:
+            return None
+        try:
+            return self.load()
+        except Exception:
+            next(self.released)
+            raise
+
+    def release_use(self):
+        # The request has finished using the collection
+        self.last_access = time.monotonic()
+        next(self.released)
+
+    def release_if_idle(self, idle_timeout: float) -> bool:
+        """
+        Release the collection if it is not in use and has not been used for more than idle_timeout seconds.
+        @param idle_timeout: time in seconds.
+        @return: True if the collection has been released, False otherwise.
+        """
+        with self.lock:
+            if not self.loaded or time.monotonic() - self.last_access <= idle_timeout or self._get_in_use() > 0:
+                return False
+            # From now on, requests take the lock and wait for the release. Check again for requests that got the
+            # collection before they could see the change.
+            self.loaded = False
+            if self._get_in_use() > 0:
+                self.loaded = True
+                return False
+            self.collection.release()
+            return True
+
+
+def get_loaded_size(name: str) -> int:
+    # Memory used by the segments of a loaded collection in the query nodes. If the information is not available, the
+    # collection is not counted in the memory budget.
+    try:
+        return sum(segment.mem_size for segment in utility.get_query_segment_info(name))
+    except MilvusException:
+        return 0
+
 
 class CollectionNameGetter:
     def __init__(self, datasets: List, suffix: str = ""):
-        # Define lock for the collection name getter
+        # Define lock for the collection name getter. The lock is only taken by writers. Requests read the dictionary of
+        # collections without locks, so writers never modify it in place, but replace it with an updated copy.
         self.lock = threading.Lock()
-        self.collections = {}
+        collections = {}
         # Get collections from DatasetOptions
         for dataset in datasets:
             name = dataset["name"] + suffix
             if name in utility.list_collections():
-                self.collections[name] = HelperCollection(name)
+                collections[name] = HelperCollection(name)
+        self.collections = collections
+        # Define list of functions called with a collection and the duration of the load, when a request has to wait
+        # for the collection to be loaded
+        self.listeners = []
 
     def __call__(self, collection: str = Query(...)) -> Collection | None:
-        self.lock.acquire()
+        # Get a collection without holding it. The collection can be released as soon as it has not been used for
+        # COLLECTION_EVICTION_MIN_IDLE seconds, so requests use the use dependency instead.
+        with self.using(collection) as result:
+            return result
+
+    @contextmanager
+    def using(self, collection: str):
+        """
+        Get a collection and hold it until the end of the block, so that it is not released while it is in use. The
+        collection is loaded if it has been released.
+        @param collection: name of the collection.
+        @return: the collection, or None if it does not exist.
+        """
+        helper = self.collections.get(collection)
+        if helper is None:
+            yield None
+            return
+        duration = helper.acquire()
         try:
-            value = self._call(collection)
+            if duration is not None:
+                for listener in self.listeners:
+                    listener(helper, duration)
+            yield helper.collection
         finally:
-            self.lock.release()
-        return value
-
-    def _call(self, collection: str = Query(...)) -> Collection | None:
-        pass
-
-    def update_counters(self, collection_name: str):
-        # Log all counters before updating them
-        # print(f"Before update. Counters: {[(key, self.collections[key].counter) for key in self.collections.keys()]}")
-        # Loop over collections. If the collection is not the one that was queried, decrement its counter. Else, if
-        # the collection is the one that was queried, set its counter to COUNTER_MAX_VALUE.
-        for key in self.collections.keys():
-            self.collections[key].lock.acquire()
-            if key != collection_name:
-                if self.collections[key].counter == 1:
-                    self.collections[key].release()
-                self.collections[key].counter = max(0, self.collections[key].counter - 1)
-            else:
-                if self.collections[key].counter == 0:
-                    self.collections[key].load()
-                self.collections[key].counter = COUNTER_MAX_VALUE
-            self.collections[key].lock.release()
+            helper.release_use()
+
+    def use(self, collection: str = Query(...)):
+        # Dependency that holds the collection until the request has finished, including the time spent waiting for
+        # an executor
+        with self.using(collection) as result:
+            yield result
 
-        # Log all counters after updating them
-        # print(f"After update. Counters: {[(key, self.collections[key].counter) for key in self.collections.keys()]}")
+    def add_listener(self, listener: Callable[[HelperCollection, float], None]):
+        self.listeners.append(listener)
+
+    def add(self, helper: HelperCollection):
+        # Add a collection, or replace a collection with the same name
+        with self.lock:
+            self.collections = {**self.collections, helper.name: helper}
+
+    def remove(self, name: str):
+        with self.lock:
+            self.collections = {key: value for key, value in self.collections.items() if key != name}
 
 
 class DatasetCollectionNameGetter(CollectionNameGetter):
     def __init__(self, datasets: List):
         super().__init__(datasets)
 
-    def _call(self, collection: str = Query(...)) -> Collection | None:
-        if collection in self.collections.keys():
-            # Update counter for all collections
-            self.update_counters(collection)
-            # Return the requested collection
-            return self.collections[collection].collection
-        else:
-            return None
-
 
 class ClustersCollectionNameGetter(CollectionNameGetter):
     def __init__(self, datasets: List):
         super().__init__(datasets, "_zoom_levels_clusters")
 
-    def _call(self, collection: str = Query(...)) -> Collection | None:
-        if collection in self.collections.keys():
-            # Update counter for all collections
-            self.update_counters(collection)
-            # Return the requested collection
-            return self.collections[collection].collection
-        else:
-            return None
-
-
-class ImageToTileCollectionNameGetter(CollectionNameGetter):
-    def __init__(self, datasets: List):
-        super().__init__(datasets, "_image_to_tile")
-
-    def _call(self, collection: str = Query(...)) -> Collection | None:
-        if collection in self.collections.keys():
-            # Update counter for all collections
-            self.update_counters(collection)
-            # Return the requested collection
-            return self.collections[collection].collection
-        else:
-            return None
-
 
 class UMAPCollectionGetter:
     def __init__(self):
@@ -148,23 +234,78 @@ class DatasetCollectionInfoGetter:
         else:
             return None
 
+    def invalidate(self, collection: str):
+        # Update the number of entities of a collection that has been rebuilt
+        if collection in self.collections.keys():
+            self.collections[collection]["number_of_entities"] = Collection(collection).num_entities
+
+
+class SearchParamsGetter:
+    """
+    Search parameters of the index of the embeddings collection of each dataset, from the "index" entry of the dataset
+    in datasets.json. The parameters of a dataset are read again when its collection is rebuilt, since the index may
+    have changed.
+    """
+
+    def __init__(self, datasets: List):
+        self.search_params = {}
+        for dataset in datasets:
+            self._update(dataset)
+
+    def _update(self, dataset: dict):
+        try:
+            self.search_params[dataset["name"]] = get_index_config(dataset)["search_params"]
+        except ValueError as e:
+            # Search with the default parameters of Milvus
+            print(e)
+            self.search_params[dataset["name"]] = {}
+
+    def __call__(self, collection: str) -> dict:
+        return self.search_params.get(collection, {})
+
+    def invalidate(self, collection: str):
+        with open(DATASETS_JSON_PATH, "r") as f:
+            datasets = json.load(f)["datasets"]
+        for dataset in datasets:
+            if dataset["name"] == collection:
+                self._update(dataset)
+                break
+
 
 class Updater:
     """
     Class for updating the collections. When the client requests the list of collections, it could become necessary to
-    update the list of collections if a new collection has been created.
+    update the list of collections if a new collection has been created. If a collection has been dropped or rebuilt,
+    the registered listeners are called with the name of the collection, so that they can invalidate cached data.
     """
 
     def __init__(self, dataset_collection_name_getter: DatasetCollectionNameGetter,
-                 clusters_collection_name_getter: ClustersCollectionNameGetter,
-                 image_to_tile_collection_name_getter: ImageToTileCollectionNameGetter):
+                 clusters_collection_name_getter: ClustersCollectionNameGetter):
         self.dataset_collection_name_getter = dataset_collection_name_getter
         self.clusters_collection_name_getter = clusters_collection_name_getter
-        self.image_to_tile_collection_name_getter = image_to_tile_collection_name_getter
         # Define variable to store the list of datasets
         self.datasets = None
         # Define lock for the updater
         self.lock = threading.Lock()
+        # Define list of functions called with the name of a collection that changed
+        self.listeners = []
+
+    def add_listener(self, listener: Callable[[str], None]):
+        self.listeners.append(listener)
+
+    def _check_for_changes(self, collection_name_getter: CollectionNameGetter, collections: List[str]):
+        # Compare the id of each known collection with the id in the database
+        for name in list(collection_name_getter.collections.keys()):
+            if name not in collections:
+                # The collection has been dropped
+                collection_name_getter.remove(name)
+            elif Collection(name).describe()["collection_id"] != collection_name_getter.collections[name].collection_id:
+                # The collection has been dropped and created again
+                collection_name_getter.add(HelperCollection(name))
+            else:
+                continue
+            for listener in self.listeners:
+                listener(name)
 
     def __call__(self):
         with open(DATASETS_JSON_PATH, "r") as f:
@@ -173,13 +314,17 @@ class Updater:
         # Acquire lock
         self.lock.acquire()
         try:
+            # Detect collections that have been dropped or rebuilt
+            collections = utility.list_collections()
+            self._check_for_changes(self.dataset_collection_name_getter, collections)
+            self._check_for_changes(self.clusters_collection_name_getter, collections)
             # First, update the list of collections if necessary
             for dataset in self.datasets:
                 name = dataset["name"]
                 if (name in utility.list_collections() and
                         name not in self.dataset_collection_name_getter.collections.keys()):
                     # The collection is in the database, but not in the list of collections. Add it to the list.
-                    self.dataset_collection_name_getter.collections[name] = HelperCollection(name)
+                    self.dataset_collection_name_getter.add(HelperCollection(name))
             # Second, update the list of zoom level collections if necessary
             for dataset in self.datasets:
                 name = dataset["name"] + "_zoom_levels_clusters"
@@ -187,14 +332,7 @@ class Updater:
                 if (name in utility.list_collections() and
                         name not in self.clusters_collection_name_getter.collections.keys()):
                     # The collection is in the database, but not in the list of collections. Add it to the list.
-                    self.clusters_collection_name_getter.collections[name] = HelperCollection(name)
-
-                name = dataset["name"] + "_image_to_tile"
-                # Check if name is the suffix of one of the elements of the list of collections
-                if (name in utility.list_collections() and
-                        name not in self.image_to_tile_collection_name_getter.collections.keys()):
-                    # The collection is in the database, but not in the list of collections. Add it to the list.
-                    self.image_to_tile_collection_name_getter.collections[name] = HelperCollection(name)
+                    self.clusters_collection_name_getter.add(HelperCollection(name))
 
             # Now, return the list of collections
             return [{"name": dataset["name"], "website_name": dataset["website_name"]} for dataset in self.datasets
@@ -207,9 +345,32 @@ class Updater:
 class Embedder:
     def __init__(self, embeddings: EmbeddingsModel):
         self.embeddings = embeddings
+        # Concurrent requests are encoded together
+        self.batcher = TextEmbeddingBatcher(embeddings)
+        # Cache embeddings of recent texts
+        self.cache = LRUCache(TEXT_EMBEDDING_CACHE_SIZE, TEXT_EMBEDDING_CACHE_TTL)
 
     def __call__(self, text: str = Query(...)) -> torch.Tensor:
-        return self.embeddings.getTextEmbeddings(text)
+        text = normalize_text(text)
+        embedding = self.cache.get(text)
+        if embedding is None:
+            embedding = self.batcher.embed(text)
+            self.cache.put(text, embedding)
+        return embedding
+
+    async def embed(self, text: str) -> torch.Tensor:
+        # Same as __call__, but the event loop is not blocked while the text waits for its batch
+        text = normalize_text(text)
+        embedding = self.cache.get(text)
+        if embedding is None:
+            embedding = await asyncio.wrap_future(self.batcher.submit(text))
+            self.cache.put(text, embedding)
+        return embedding
+
+
+def normalize_text(text: str) -> str:
+    # The CLIP tokenizer ignores case and repeated whitespace, so texts that differ only in those are equivalent
+    return " ".join(text.lower().split())
 
 
 def parse_comma_separated(indexes: str) -> List[int]:
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+
+class BoundedExecutor:
+    """
+    Thread pool for running blocking work from async request handlers without blocking the event loop. At most
+    max_workers calls run at the same time. Further calls wait on a semaphore in the event loop, and the time between
+    the submission of a call and the start of its execution is recorded as queue time.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.semaphore = asyncio.Semaphore(max_workers)
+        # Define metrics
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.active = 0
+        self.total_queue_time = 0.0
+        self.max_queue_time = 0.0
+        self.total_run_time = 0.0
+
+    async def run(self, function: Callable, *args, **kwargs):
+        """
+        Run a blocking function in the pool and wait for its result.
+        @param function: the function.
+        @param args: positional arguments of the function.
+        @param kwargs: keyword arguments of the function.
+        @return: the value returned by the function. Exceptions raised by the function are propagated.
+        """
+        submitted = time.monotonic()
+        state = {"started": False}
+        with self.lock:
+            self.submitted += 1
+            self.waiting += 1
+        try:
+            async with self.semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, self._call, submitted, state, function, args, kwargs)
+        finally:
+            with self.lock:
+                # The call was cancelled before it started
+                if not state["started"]:
+                    self.waiting -= 1
+
+    def _call(self, submitted: float, state: dict, function: Callable, args: tuple, kwargs: dict):
+        start = time.monotonic()
+        with self.lock:
+            state["started"] = True
+            self.waiting -= 1
+            self.active += 1
+            self.total_queue_time += start - submitted
+            self.max_queue_time = max(self.max_queue_time, start - submitted)
+        failed = False
+        try:
+            return function(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.completed += 1
+                self.failed += int(failed)
+                self.total_run_time += time.monotonic() - start
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            return {
+                "max_workers": self.max_workers,
+                "active": self.active,
+                "pending": self.waiting,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "mean_queue_time_ms": 1000 * self.total_queue_time / self.completed if self.completed > 0 else 0.0,
+                "max_queue_time_ms": 1000 * self.max_queue_time,
+                "mean_run_time_ms": 1000 * self.total_run_time / self.completed if self.completed > 0 else 0.0
+            }
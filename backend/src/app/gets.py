@@ -3,32 +3,25 @@ from typing import List
 import torch
 from pymilvus import Collection
 
+from .search import SearchBackend, MilvusSearchBackend
 from ..CONSTANTS import *
-from ..db_utilities.collections import EMBEDDING_VECTOR_FIELD_NAME, ZOOM_LEVEL_VECTOR_FIELD_NAME
+from ..db_utilities.collections import EMBEDDING_VECTOR_FIELD_NAME
 
 
-def get_image_info_from_text_embedding(collection: Collection, text_embeddings: torch.Tensor) -> str:
+def get_image_info_from_text_embedding(collection: Collection, text_embeddings: torch.Tensor,
+                                       backend: SearchBackend | None = None) -> str:
     """
     Get the image embedding from the collection for a given text.
     @param collection:
     @param text_embeddings:
+    @param backend: search backend of the dataset. If None, the collection is searched in Milvus.
     @return:
     """
-    # Define search parameters
-    search_params = {
-        "metric_type": COSINE_METRIC,
-        "offset": 0
-    }
+    backend = backend if backend is not None else MilvusSearchBackend()
     # Search image
-    results = collection.search(
-        data=text_embeddings.tolist(),
-        anns_field=EMBEDDING_VECTOR_FIELD_NAME,
-        param=search_params,
-        limit=1,
-        output_fields=["index", "author", "path", "width", "height", "genre", "date", "title", "caption", "x", "y"]
-    )
+    results = backend.search(collection, text_embeddings.tolist(), 1)
     # Return image path
-    return results[0][0].to_dict()["entity"]
+    return results[0][0]
 
 
 def get_tiles(indexes: List[int], collection: Collection) -> dict:
@@ -48,31 +41,6 @@ def get_tiles(indexes: List[int], collection: Collection) -> dict:
     return result
 
 
-def get_tile_from_image(index: int, collection: Collection) -> dict:
-    """
-    Get the tile data from the collection for a given image.
-    @param index:
-    @param collection:
-    @return:
-    """
-    # Search image
-    results = collection.query(
-        expr=f"index in [{index}]",
-        output_fields=["*"]
-    )
-    # The returned data point has the following format:
-    # {
-    #     "index": image_index,
-    #     "zoom_plus_tile": [zoom_level, tile_x, tile_y]
-    # }
-    # Transform results[0][ZOOM_LEVEL_VECTOR_FIELD_NAME] to a list of integers
-    if len(results) > 0:
-        results[0][ZOOM_LEVEL_VECTOR_FIELD_NAME] = [int(x) for x in results[0][ZOOM_LEVEL_VECTOR_FIELD_NAME]]
-        return results[0]
-    else:
-        return {}
-
-
 def get_paths_from_indexes(indexes: List[int], collection: Collection) -> dict:
     """
     Get images from their indexes.
@@ -90,34 +58,62 @@ def get_paths_from_indexes(indexes: List[int], collection: Collection) -> dict:
     return results
 
 
-def get_neighbors(index: int, collection: Collection, top_k: int) -> List[dict]:
+def get_embeddings(indexes: List[int], collection: Collection) -> dict:
     """
-    Get the neighbors of a given image.
-    @param index:
+    Get the embeddings of images from their indexes.
+    @param indexes:
     @param collection:
-    @param top_k:
-    @return:
+    @return: dictionary with the indexes of the images found in the collection and their embeddings.
     """
-    # First, query the index to find the embedding vector
     results = collection.query(
-        expr=f"index in [{index}]",
+        expr=f"index in {indexes}",
         output_fields=[EMBEDDING_VECTOR_FIELD_NAME]
     )
+    return {result["index"]: result[EMBEDDING_VECTOR_FIELD_NAME] for result in results}
+
+
+def get_images(indexes: List[int], collection: Collection, backend: SearchBackend | None = None) -> dict:
+    """
+    Get the attributes of images from their indexes.
+    @param indexes:
+    @param collection:
+    @param backend: search backend of the dataset. If None, the attributes are queried from Milvus.
+    @return: dictionary with the indexes of the images found in the collection and their attributes.
+    """
+    backend = backend if backend is not None else MilvusSearchBackend()
+    return backend.get_images(collection, indexes)
+
+
+def get_neighbors(indexes: List[int], embeddings: List[List[float]], collection: Collection, top_k: int,
+                  backend: SearchBackend | None = None) -> List[dict]:
+    """
+    Get the neighbors of several images with a single search.
+    @param indexes: indexes of the images.
+    @param embeddings: embeddings of the images.
+    @param collection:
+    @param top_k: number of neighbors of each image.
+    @param backend: search backend of the dataset. If None, the collection is searched in Milvus.
+    @return: for each image, a dictionary with the attributes of the image in "image", and the attributes of its top_k
+    neighbors in "neighbors". The image itself is not among its neighbors.
+    """
+    backend = backend if backend is not None else MilvusSearchBackend()
+    # Search images. Each image is usually its own nearest neighbor, so one more neighbor is requested.
+    results = backend.search(collection, embeddings, top_k + 1)
+    neighbors = []
+    for index, entities in zip(indexes, results):
+        neighbors.append({"image": next((entity for entity in entities if entity["index"] == index), None),
+                          "neighbors": [entity for entity in entities if entity["index"] != index][:top_k]})
+
+    # Query the images that are not among their own neighbors, because of images with the same embedding
+    missing = [index for index, result in zip(indexes, neighbors) if result["image"] is None]
+    if len(missing) > 0:
+        images = get_images(missing, collection, backend)
+        for index, result in zip(indexes, neighbors):
+            if result["image"] is None:
+                result["image"] = images.get(index)
 
-    # Define search parameters
-    search_params = {
-        "metric_type": COSINE_METRIC
-    }
-    # Search image
-    results = collection.search(
-        data=[results[0][EMBEDDING_VECTOR_FIELD_NAME]],
-        anns_field=EMBEDDING_VECTOR_FIELD_NAME,
-        param=search_params,
-        limit=top_k + 1,
-        output_fields=["index", "author", "path", "width", "height", "genre", "date", "title", "caption", "x", "y"]
-    )
     # Return results
-    return [hit.to_dict()["entity"] for hit in results[0]]
+    return neighbors
 
 
 def get_first_tiles(collection: Collection) -> List[dict]:
@@ -191,25 +187,17 @@ def get_random_image(num: float, collection: Collection) -> dict:
     return results[0]
 
 
-def get_image_info_from_image_embedding(collection: Collection, image_embeddings: torch.Tensor) -> dict:
+def get_image_info_from_image_embedding(collection: Collection, image_embeddings: torch.Tensor,
+                                        backend: SearchBackend | None = None) -> dict:
     """
     Get the image from the collection for a given image embedding.
     @param collection:
     @param image_embeddings:
+    @param backend: search backend of the dataset. If None, the collection is searched in Milvus.
     @return:
     """
-    # Define search parameters
-    search_params = {
-        "metric_type": COSINE_METRIC,
-        "offset": 0
-    }
+    backend = backend if backend is not None else MilvusSearchBackend()
     # Search image
-    results = collection.search(
-        data=image_embeddings.tolist(),
-        anns_field=EMBEDDING_VECTOR_FIELD_NAME,
-        param=search_params,
-        limit=1,
-        output_fields=["index", "author", "path", "width", "height", "genre", "date", "title", "caption", "x", "y"]
-    )
+    results = backend.search(collection, image_embeddings.tolist(), 1)
     # Return image path
-    return results[0][0].to_dict()["entity"]
+    return results[0][0]
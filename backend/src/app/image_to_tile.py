@@ -0,0 +1,56 @@
+import os
+import threading
+from typing import List
+
+import numpy as np
+
+from .CONSTANTS import *
+from ..CONSTANTS import IMAGE_TO_TILE_FILE_NAME
+
+
+class ImageToTileLookup:
+    """
+    Find the tile (zoom_level, tile_x, tile_y) where images appear for the first time. The tiles are read from the
+    matrix written by create_and_populate_clusters_collection, where row i contains the tile of the image with index i,
+    or -1 if there is no such image. The matrix is memory-mapped, so that a lookup only reads the rows of the images.
+    The file is replaced when the clusters of a dataset are created again, so its modification time is checked at every
+    lookup, and the file is opened again if it has changed.
+    """
+
+    def __init__(self, data_dir: str = DATA_DIR_PATH):
+        self.data_dir = data_dir
+        # Map the name of a dataset to the modification time of its file and the memory-mapped matrix
+        self.matrices = {}
+        self.lock = threading.Lock()
+
+    def get_matrix(self, name: str) -> np.ndarray | None:
+        path = os.path.join(self.data_dir, name, IMAGE_TO_TILE_FILE_NAME)
+        try:
+            modification_time = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        entry = self.matrices.get(name)
+        if entry is None or entry[0] != modification_time:
+            with self.lock:
+                entry = self.matrices.get(name)
+                if entry is None or entry[0] != modification_time:
+                    entry = (modification_time, np.load(path, mmap_mode="r"))
+                    self.matrices[name] = entry
+        return entry[1]
+
+    def get_tiles(self, indexes: List[int], name: str) -> List[list | None] | None:
+        """
+        Get the tiles of images.
+        @param indexes: indexes of the images.
+        @param name: name of the dataset.
+        @return: for each image, its tile as [zoom_level, tile_x, tile_y], or None if the image is not in the dataset.
+        None if the file of the dataset does not exist.
+        """
+        matrix = self.get_matrix(name)
+        if matrix is None:
+            return None
+        indexes = np.asarray(indexes, dtype=np.int64)
+        found = (indexes >= 0) & (indexes < matrix.shape[0])
+        tiles = np.full((len(indexes), 3), -1, dtype=np.int32)
+        tiles[found] = matrix[indexes[found]]
+        return [tile if tile[0] >= 0 else None for tile in tiles.tolist()]
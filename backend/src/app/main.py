@@ -1,12 +1,25 @@
+import gzip
+import threading
 from io import BytesIO
 
 from PIL import Image
-from fastapi import FastAPI, Depends, HTTPException, Request, File, UploadFile
+
+from fastapi import FastAPI, Depends, HTTPException, Request, File, UploadFile, Response
 from pymilvus import db, MilvusException
 
 from . import gets
+from .cache import ShardedLRUCache, get_json_size
 from .dependencies import *
+from .executors import BoundedExecutor
+from .image_to_tile import ImageToTileLookup
+from .neighbors import NeighborEngine
+from .payloads import FirstTilesPayloads, etag_matches
+from .residency import CollectionResidencyManager
+from .responses import ORJSONResponse
+from .search import SearchBackendGetter
+from .tile_format import BINARY_TILES_MEDIA_TYPE, encode_tiles
 from ..CONSTANTS import *
+from ..db_utilities.collections import ZOOM_LEVEL_VECTOR_FIELD_NAME
 from ..db_utilities.utils import create_connection
 from ..embeddings_model.CLIPEmbeddings import ClipEmbeddings
 
@@ -23,17 +36,52 @@ db.using_database(DEFAULT_DATABASE_NAME)
 # Create dependency objects
 dataset_collection_name_getter = DatasetCollectionNameGetter(datasets)
 clusters_collection_name_getter = ClustersCollectionNameGetter(datasets)
-image_to_tile_collection_name_getter = ImageToTileCollectionNameGetter(datasets)
 dataset_collection_info_getter = DatasetCollectionInfoGetter(datasets)
+search_params_getter = SearchParamsGetter(datasets)
 updater = Updater(
     dataset_collection_name_getter,
-    clusters_collection_name_getter,
-    image_to_tile_collection_name_getter
+    clusters_collection_name_getter
+)
+# Manage loaded collections. The collections of the datasets in datasets.json are loaded at startup, in order, until the
+# memory budget is reached.
+residency_manager = CollectionResidencyManager(
+    [dataset_collection_name_getter, clusters_collection_name_getter],
+    prewarm=[dataset["name"] + suffix for dataset in datasets for suffix in ("_zoom_levels_clusters", "")]
 )
 
-embeddings = Embedder(ClipEmbeddings(DEVICE))
+embeddings = Embedder(ClipEmbeddings(DEVICE, quantize=QUANTIZE_CLIP))
 umap_getter = UMAPCollectionGetter()
 
+# Create cache for text search results, keyed by (collection name, normalized text). Entries of a collection are
+# removed when the collection is rebuilt.
+text_search_cache = LRUCache(TEXT_SEARCH_CACHE_SIZE, TEXT_SEARCH_CACHE_TTL)
+updater.add_listener(lambda name: text_search_cache.invalidate(lambda key: key[0] == name))
+updater.add_listener(dataset_collection_info_getter.invalidate)
+updater.add_listener(search_params_getter.invalidate)
+# Get the search backend of each dataset, after the search parameters, since Milvus backends use them. Backends are
+# resolved in the jobs of the Milvus executor, never on the event loop, since creating a local backend reads and
+# normalizes the whole matrix of embeddings, and reads or exports the attributes of the images.
+search_backend_getter = SearchBackendGetter(datasets, search_params_getter)
+updater.add_listener(search_backend_getter.invalidate)
+# Create cache for tiles, keyed by (clusters collection name, tile index). Clusters collections do not change after they
+# are created, so entries are only removed when the collection is rebuilt.
+tile_cache = ShardedLRUCache(TILE_CACHE_SHARDS, TILE_CACHE_SIZE_BYTES, get_json_size)
+updater.add_listener(lambda name: tile_cache.invalidate(lambda key: key[0] == name))
+# Create lookup of the tiles of the images, which reads them from memory-mapped files
+image_to_tile_lookup = ImageToTileLookup()
+# Create engine for neighbor queries, which reads the embeddings of the query images from memory-mapped files
+neighbor_engine = NeighborEngine()
+updater.add_listener(neighbor_engine.invalidate)
+# Build the compressed responses of /api/first-tiles in the background
+first_tiles_payloads = FirstTilesPayloads(clusters_collection_name_getter)
+updater.add_listener(first_tiles_payloads.invalidate)
+threading.Thread(target=first_tiles_payloads.build_all, daemon=True).start()
+
+# Create executors. CLIP image inference and Milvus calls run in separate pools, so that neither blocks the event loop
+# and slow inference does not delay database requests. Text embeddings are computed by the thread of the batcher.
+inference_executor = BoundedExecutor("inference", INFERENCE_POOL_SIZE)
+milvus_executor = BoundedExecutor("milvus", MILVUS_POOL_SIZE)
+
 # Create app
 app = FastAPI()
 
@@ -64,15 +112,23 @@ def get_collection_info(collection: {} = Depends(dataset_collection_info_getter)
 
 
 @app.get("/api/image-text")
-def get_image_from_text(collection: Collection = Depends(dataset_collection_name_getter),
-                        text_embedding: torch.Tensor = Depends(embeddings)):
+async def get_image_from_text(text: str = Query(...),
+                              collection: Collection = Depends(dataset_collection_name_getter.use)):
     if collection is None:
         # Collection not found, return 404
         raise HTTPException(status_code=404, detail="Collection not found")
     else:
+        # Check if the result is in the cache. The text is only embedded on a miss.
+        key = (collection.name, normalize_text(text))
+        data = text_search_cache.get(key)
+        if data is not None:
+            return data
         try:
             # Collection found, return image path
-            data = gets.get_image_info_from_text_embedding(collection, text_embedding)
+            text_embedding = await embeddings.embed(text)
+            data = await milvus_executor.run(lambda: gets.get_image_info_from_text_embedding(
+                collection, text_embedding, search_backend_getter(collection)))
+            text_search_cache.put(key, data)
             return data
         except MilvusException:
             # Milvus error, return code 505
@@ -80,44 +136,71 @@ def get_image_from_text(collection: Collection = Depends(dataset_collection_name
 
 
 @app.get("/api/tiles")
-def get_tiles(indexes: List[int] = Depends(parse_comma_separated),
-              collection: Collection = Depends(clusters_collection_name_getter)):
+async def get_tiles(request: Request, indexes: List[int] = Depends(parse_comma_separated),
+                    collection: Collection = Depends(clusters_collection_name_getter.use),
+                    tile_format: str = Query("json", alias="format")):
     if collection is None:
         # Collection not found, return 404
         raise HTTPException(status_code=404, detail="Collection not found")
+    elif tile_format not in ("json", "binary"):
+        raise HTTPException(status_code=400, detail="Format must be json or binary")
     else:
-        # Collection found, return tile data
+        # Collection found, return tile data. Only the tiles that are not in the cache are queried.
         try:
-            tile_data = gets.get_tiles(indexes, collection)
-            # Return tile data
-            return tile_data
+            tiles = {key[1]: tile for key, tile in
+                     tile_cache.get_many([(collection.name, index) for index in indexes]).items()}
+            missing = [index for index in indexes if index not in tiles]
+            if len(missing) > 0:
+                for tile in await milvus_executor.run(gets.get_tiles, missing, collection):
+                    tile_cache.put((collection.name, tile["index"]), tile)
+                    tiles[tile["index"]] = tile
+            tile_data = [tiles[index] for index in dict.fromkeys(indexes) if index in tiles]
+            # Return tile data, in the binary format if it is requested with the format parameter or the Accept header.
+            # Otherwise, the tiles are serialized directly to JSON bytes with orjson.
+            if tile_format == "binary" or BINARY_TILES_MEDIA_TYPE in request.headers.get("accept", ""):
+                return Response(content=encode_tiles(tile_data), media_type=BINARY_TILES_MEDIA_TYPE)
+            return ORJSONResponse(tile_data)
         except MilvusException:
             # Milvus error, return code 505
             raise HTTPException(status_code=404, detail="Tile data not found")
 
 
+def get_image_to_tile_dataset(collection: str = Query(...)) -> str | None:
+    # Clients used to pass the name of the collection with the mapping from images to tiles, <dataset>_image_to_tile
+    name = collection.removesuffix("_image_to_tile")
+    # Only the files of known datasets are read
+    return name if name in dataset_collection_name_getter.collections.keys() else None
+
+
 @app.get("/api/image-to-tile")
-def get_tile_from_image(index: int,
-                        collection: Collection = Depends(image_to_tile_collection_name_getter)):
-    if collection is None:
+async def get_tile_from_image(index: int, dataset: str = Depends(get_image_to_tile_dataset)):
+    tiles = image_to_tile_lookup.get_tiles([index], dataset) if dataset is not None else None
+    if tiles is None:
         # Collection not found, return 404
         raise HTTPException(status_code=404, detail="Collection not found")
+    elif tiles[0] is None:
+        raise HTTPException(status_code=404, detail="Tile data not found")
     else:
-        # Collection found, return tile data
-        try:
-            tile_data = gets.get_tile_from_image(index, collection)
-            if len(tile_data) == 0:
-                # In the required image is present in the database, the distance should be 0
-                raise HTTPException(status_code=404, detail="Tile data not found")
-            else:
-                return tile_data
-        except MilvusException:
-            # Milvus error, return code 505
-            raise HTTPException(status_code=404, detail="Tile data not found")
+        return {"index": index, ZOOM_LEVEL_VECTOR_FIELD_NAME: tiles[0]}
+
+
+@app.get("/api/images-to-tiles")
+async def get_tiles_from_images(indexes: List[int] = Depends(parse_comma_separated),
+                                dataset: str = Depends(get_image_to_tile_dataset)):
+    if len(indexes) > IMAGE_TO_TILE_MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {IMAGE_TO_TILE_MAX_BATCH_SIZE} indexes are allowed")
+    tiles = image_to_tile_lookup.get_tiles(indexes, dataset) if dataset is not None else None
+    if tiles is None:
+        # Collection not found, return 404
+        raise HTTPException(status_code=404, detail="Collection not found")
+    # Return the tiles in the order of the indexes. The tile of an image that is not in the dataset is None.
+    return ORJSONResponse([{"index": index, ZOOM_LEVEL_VECTOR_FIELD_NAME: tile}
+                           for index, tile in zip(indexes, tiles)])
 
 
 @app.get("/api/images")
-def get_images(indexes: List[int] = Query(...), collection: Collection = Depends(dataset_collection_name_getter)):
+async def get_images(indexes: List[int] = Query(...),
+                     collection: Collection = Depends(dataset_collection_name_getter.use)):
     # Both indexes and collection are query parameters
     if collection is None:
         # Collection not found, return 404
@@ -125,7 +208,7 @@ def get_images(indexes: List[int] = Query(...), collection: Collection = Depends
     else:
         # Collection found, return images
         try:
-            images = gets.get_paths_from_indexes(indexes, collection)
+            images = await milvus_executor.run(gets.get_paths_from_indexes, indexes, collection)
             return images
         except MilvusException:
             # Milvus error, return code 505
@@ -133,58 +216,99 @@ def get_images(indexes: List[int] = Query(...), collection: Collection = Depends
 
 
 @app.get("/api/neighbors")
-def get_neighbours(index: int, k: int, collection: Collection = Depends(dataset_collection_name_getter)):
+async def get_neighbours(index: int, k: int, collection: Collection = Depends(dataset_collection_name_getter.use)):
     # Both index and collection are query parameters
     if collection is None:
         # Collection not found, return 404
         raise HTTPException(status_code=404, detail="Collection not found")
     else:
-        # Collection found, return neighbours
+        # Collection found, return the image and its neighbours
         try:
-            neighbours = gets.get_neighbors(index, collection, k)
-            return neighbours
+            neighbours = await milvus_executor.run(lambda: neighbor_engine.get_neighbors(
+                [index], collection, k, search_backend_getter(collection)))
+            return ORJSONResponse(neighbours[0])
         except MilvusException:
             # Milvus error, return code 505
             raise HTTPException(status_code=505, detail="Milvus error")
 
 
-@app.get("/api/first-tiles")
-def get_first_tiles(collection: Collection = Depends(clusters_collection_name_getter)):
+@app.get("/api/neighbors-batch")
+async def get_neighbours_batch(k: int, indexes: List[int] = Depends(parse_comma_separated),
+                               collection: Collection = Depends(dataset_collection_name_getter.use)):
     if collection is None:
         # Collection not found, return 404
         raise HTTPException(status_code=404, detail="Collection not found")
+    elif len(indexes) > NEIGHBORS_MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {NEIGHBORS_MAX_BATCH_SIZE} indexes are allowed")
+    else:
+        # Collection found, return the images and their neighbours, in the order of the indexes
+        try:
+            neighbours = await milvus_executor.run(lambda: neighbor_engine.get_neighbors(
+                indexes, collection, k, search_backend_getter(collection)))
+            return ORJSONResponse(neighbours)
+        except MilvusException:
+            # Milvus error, return code 505
+            raise HTTPException(status_code=505, detail="Milvus error")
+
+
+@app.get("/api/first-tiles")
+async def get_first_tiles(request: Request, collection: str = Query(...)):
+    if collection not in clusters_collection_name_getter.collections:
+        # Collection not found, return 404
+        raise HTTPException(status_code=404, detail="Collection not found")
     else:
         # Collection found, return tile data
         try:
-            tile_data = gets.get_first_tiles(collection)
-            return tile_data
+            payload = await milvus_executor.run(first_tiles_payloads.get, collection)
         except MilvusException:
             # Milvus error, return code 505
             raise HTTPException(status_code=404, detail="Tile data not found")
+        if payload is None:
+            raise HTTPException(status_code=404, detail="Collection not found")
+        # Clients revalidate the data with the ETag, which changes when the collection is rebuilt
+        headers = {"ETag": payload.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if etag_matches(request.headers.get("if-none-match"), payload.etag):
+            return Response(status_code=304, headers=headers)
+        if "gzip" in request.headers.get("accept-encoding", ""):
+            return Response(content=payload.body, media_type="application/json",
+                            headers={**headers, "Content-Encoding": "gzip"})
+        return Response(content=gzip.decompress(payload.body), media_type="application/json", headers=headers)
+
+
+@app.get("/api/metrics")
+def get_metrics():
+    # Return metrics of the text embedding queue, of the caches, of the executors and of the loaded collections
+    return {"text_embeddings": embeddings.batcher.get_metrics(),
+            "text_embedding_cache": embeddings.cache.get_metrics(),
+            "text_search_cache": text_search_cache.get_metrics(),
+            "tile_cache": tile_cache.get_metrics(),
+            "first_tiles": first_tiles_payloads.get_metrics(),
+            "executors": {executor.name: executor.get_metrics() for executor in (inference_executor, milvus_executor)},
+            "residency": residency_manager.get_metrics()}
 
 
 @app.get("/api/umap")
-def get_umap_data(n_neighbors: int, min_dist: float):
+async def get_umap_data(n_neighbors: int, min_dist: float):
     # Get UMAP data
     try:
-        return gets.get_umap_data(umap_getter(), n_neighbors, min_dist)
+        return ORJSONResponse(await milvus_executor.run(gets.get_umap_data, umap_getter(), n_neighbors, min_dist))
     except Exception:
         # Error in fetching UMAP data
         raise HTTPException(status_code=404, detail="UMAP data not found")
 
 
 @app.get("/api/random-image")
-def get_random_image(num: float, collection: Collection = Depends(dataset_collection_name_getter)):
+async def get_random_image(num: float, collection: Collection = Depends(dataset_collection_name_getter.use)):
     # Get random image
     try:
-        return gets.get_random_image(num, collection)
+        return await milvus_executor.run(gets.get_random_image, num, collection)
     except MilvusException:
         # Milvus error, return code 505
         raise HTTPException(status_code=505, detail="Milvus error")
 
 
 @app.post("/api/image-image")
-async def get_image_from_image(collection: Collection = Depends(dataset_collection_name_getter),
+async def get_image_from_image(collection: Collection = Depends(dataset_collection_name_getter.use),
                                file: UploadFile = File(...)):
     if collection is None:
         # Collection not found, return 404
@@ -194,9 +318,12 @@ async def get_image_from_image(collection: Collection = Depends(dataset_collecti
             # Get image
             image_data = await file.read()
             # Get image embedding
-            image_embedding = embeddings.embeddings.getImageEmbeddings(Image.open(BytesIO(image_data)))
+            image_embedding = await inference_executor.run(
+                lambda: embeddings.embeddings.getImageEmbeddings(Image.open(BytesIO(image_data)))
+            )
             # Collection found, return image path
-            data = gets.get_image_info_from_image_embedding(collection, image_embedding)
+            data = await milvus_executor.run(lambda: gets.get_image_info_from_image_embedding(
+                collection, image_embedding, search_backend_getter(collection)))
             return data
         except MilvusException:
             # Milvus error, return code 505
@@ -0,0 +1,119 @@
+import os
+import threading
+from typing import List
+
+import numpy as np
+from pymilvus import Collection
+
+from . import gets
+from .search import SearchBackend
+from .CONSTANTS import *
+from ..CONSTANTS import EMBEDDINGS_FILE_NAME, KNN_INDEXES_FILE_NAME
+
+
+class NeighborEngine:
+    """
+    Find the nearest neighbors of images of a collection. If the nearest neighbors of the images have been computed by
+    create_knn_graph, they are read from the memory-mapped matrix of neighbors, and only the attributes of the images
+    are queried from Milvus. Otherwise, the embeddings of the images are read from the float32 matrix written by
+    create_and_populate_embeddings_collection, where row i contains the embedding of image i, so that they are not
+    fetched from Milvus, and the neighbors are searched with the search backend of the dataset. The attributes of the
+    images are also got from the search backend. Images whose embedding is missing or empty, because they were skipped
+    or the file does not exist, are fetched from Milvus. All the images of a request are searched together.
+    """
+
+    def __init__(self, data_dir: str = DATA_DIR_PATH):
+        self.data_dir = data_dir
+        # Map the name of a collection to its memory-mapped matrices, or to None if a matrix does not exist
+        self.matrices = {}
+        self.graphs = {}
+        self.lock = threading.Lock()
+
+    def _open(self, files: dict, name: str, file_name: str) -> np.ndarray | None:
+        if name not in files:
+            with self.lock:
+                if name not in files:
+                    path = os.path.join(self.data_dir, name, file_name)
+                    files[name] = np.load(path, mmap_mode="r") if os.path.exists(path) else None
+        return files[name]
+
+    def get_matrix(self, name: str) -> np.ndarray | None:
+        return self._open(self.matrices, name, EMBEDDINGS_FILE_NAME)
+
+    def get_graph(self, name: str) -> np.ndarray | None:
+        return self._open(self.graphs, name, KNN_INDEXES_FILE_NAME)
+
+    def invalidate(self, name: str):
+        # The matrices are opened again the next time they are needed, since the collection has been rebuilt
+        with self.lock:
+            self.matrices.pop(name, None)
+            self.graphs.pop(name, None)
+
+    def get_embeddings(self, indexes: List[int], collection: Collection) -> List:
+        """
+        Get the embeddings of images.
+        @param indexes: indexes of the images.
+        @param collection: the collection.
+        @return: for each image, its embedding, or None if the image is not in the collection.
+        """
+        matrix = self.get_matrix(collection.name)
+        embeddings = [None] * len(indexes)
+        if matrix is not None:
+            for i, index in enumerate(indexes):
+                # Indexing a row of the memory-mapped matrix does not copy it
+                if 0 <= index < matrix.shape[0] and matrix[index].any():
+                    embeddings[i] = matrix[index]
+        missing = [index for index, embedding in zip(indexes, embeddings) if embedding is None]
+        if len(missing) > 0:
+            found = gets.get_embeddings(missing, collection)
+            embeddings = [found.get(index) if embedding is None else embedding
+                          for index, embedding in zip(indexes, embeddings)]
+        return embeddings
+
+    def get_neighbors(self, indexes: List[int], collection: Collection, top_k: int,
+                      backend: SearchBackend | None = None) -> List[dict]:
+        """
+        Get the neighbors of several images.
+        @param indexes: indexes of the images.
+        @param collection: the collection.
+        @param top_k: number of neighbors of each image.
+        @param backend: search backend of the dataset, used when the neighbors are not in the graph. If None, the
+        collection is searched in Milvus.
+        @return: for each image, a dictionary with the attributes of the image in "image", and the attributes of its
+        top_k neighbors in "neighbors". If an image is not in the collection, "image" is None and "neighbors" is empty.
+        """
+        results = [None] * len(indexes)
+        # Look up the neighbors of the images in the graph, if it contains enough neighbors
+        graph = self.get_graph(collection.name)
+        if graph is not None and top_k <= graph.shape[1]:
+            neighbors = {i: [int(neighbor) for neighbor in graph[index, :top_k] if neighbor >= 0]
+                         for i, index in enumerate(indexes) if 0 <= index < graph.shape[0] and graph[index, 0] >= 0}
+            if len(neighbors) > 0:
+                images = gets.get_images(sorted({indexes[i] for i in neighbors.keys()} |
+                                                {neighbor for values in neighbors.values() for neighbor in values}),
+                                         collection, backend)
+                for i, values in neighbors.items():
+                    results[i] = {"image": images.get(indexes[i]),
+                                  "neighbors": [images[neighbor] for neighbor in values if neighbor in images]}
+
+        # Search the neighbors of the other images
+        remaining = [i for i, result in enumerate(results) if result is None]
+        if len(remaining) > 0:
+            neighbors = self.search_neighbors([indexes[i] for i in remaining], collection, top_k, backend)
+            for i, result in zip(remaining, neighbors):
+                results[i] = result
+        return results
+
+    def search_neighbors(self, indexes: List[int], collection: Collection, top_k: int,
+                         backend: SearchBackend | None = None) -> List[dict]:
+        # Same as get_neighbors, but the neighbors are always searched in Milvus
+        embeddings = self.get_embeddings(indexes, collection)
+        results = [{"image": None, "neighbors": []} for _ in indexes]
+        found = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+        if len(found) > 0:
+            neighbors = gets.get_neighbors([indexes[i] for i in found],
+                                           [np.asarray(embeddings[i], dtype=np.float32).tolist() for i in found],
+                                           collection, top_k, backend)
+            for i, result in zip(found, neighbors):
+                results[i] = result
+        return results
@@ -0,0 +1,97 @@
+import gzip
+import hashlib
+import threading
+import time
+from typing import Dict
+
+import orjson
+
+from . import gets
+from .dependencies import ClustersCollectionNameGetter
+
+
+class Payload:
+    def __init__(self, data, collection_id: int, build_time: float):
+        body = orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+        # Store the JSON body compressed with gzip, and the ETag computed from the uncompressed body
+        self.body = gzip.compress(body)
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self.size = len(body)
+        # Store the id of the collection the payload was built from
+        self.collection_id = collection_id
+        self.build_time = build_time
+
+
+class FirstTilesPayloads:
+    """
+    Responses of /api/first-tiles, serialized and compressed once per clusters collection. A payload is built when the
+    app starts, when the collection is rebuilt, or when it is requested and it is missing or was built from a previous
+    version of the collection.
+    """
+
+    def __init__(self, collection_name_getter: ClustersCollectionNameGetter):
+        self.collection_name_getter = collection_name_getter
+        self.payloads: Dict[str, Payload] = {}
+        # Lock taken while building a payload, so that the same payload is not built by several requests
+        self.lock = threading.Lock()
+
+    def _is_valid(self, name: str, payload: Payload | None) -> bool:
+        helper = self.collection_name_getter.collections.get(name)
+        return payload is not None and helper is not None and payload.collection_id == helper.collection_id
+
+    def get(self, name: str) -> Payload | None:
+        """
+        Get the payload of a clusters collection, building it if necessary.
+        @param name: name of the clusters collection.
+        @return: the payload, or None if the collection does not exist.
+        """
+        payload = self.payloads.get(name)
+        if self._is_valid(name, payload):
+            return payload
+        with self.lock:
+            payload = self.payloads.get(name)
+            if self._is_valid(name, payload):
+                return payload
+            helper = self.collection_name_getter.collections.get(name)
+            if helper is None:
+                return None
+            start = time.monotonic()
+            # Hold the collection while the tiles are queried, so that it is loaded if necessary and not released
+            with self.collection_name_getter.using(name) as collection:
+                tiles = gets.get_first_tiles(collection)
+            payload = Payload(tiles, helper.collection_id, time.monotonic() - start)
+            self.payloads[name] = payload
+            return payload
+
+    def build_all(self):
+        # Build the payloads of all clusters collections
+        for name in list(self.collection_name_getter.collections.keys()):
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"Could not build first tiles of {name}: {e}")
+
+    def invalidate(self, name: str):
+        # Remove the payload of a collection that has been dropped or rebuilt, and build the new payload in the
+        # background
+        self.payloads.pop(name, None)
+        if name in self.collection_name_getter.collections:
+            threading.Thread(target=self.build_all, daemon=True).start()
+
+    def get_metrics(self) -> dict:
+        return {name: {"size_bytes": payload.size, "compressed_bytes": len(payload.body), "etag": payload.etag,
+                       "build_ms": 1000 * payload.build_time}
+                for name, payload in list(self.payloads.items())}
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Check whether the value of an If-None-Match header matches an ETag.
+    @param if_none_match: value of the header, or None if the header is missing.
+    @param etag: the ETag.
+    @return: True if the client has the current version of the resource, False otherwise.
+    """
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import deque
+from typing import List
+
+from .CONSTANTS import *
+
+
+class CollectionResidencyManager:
+    """
+    Background thread that decides which collections stay loaded in Milvus. Requests only record the time at which
+    they used a collection, and load it if it is not loaded. At startup, the thread loads the given collections until
+    the memory budget is reached. Then, every interval seconds, or as soon as a request has loaded a collection, it
+    releases the collections that have not been used for more than idle_timeout seconds, and evicts collections
+    according to the policy until the loaded collections fit in the memory budget. With the "lru" policy, the least
+    recently used collection is evicted first. With the "lfu" policy, the collection with the fewest requests is evicted
+    first. The number of requests is halved at every check, so that old requests count less than recent ones.
+    """
+
+    def __init__(self, getters: List, memory_budget: int = COLLECTION_MEMORY_BUDGET, policy: str = RESIDENCY_POLICY,
+                 idle_timeout: float = COLLECTION_IDLE_TIMEOUT, interval: float = RESIDENCY_CHECK_INTERVAL,
+                 prewarm: List[str] | None = None):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown residency policy {policy}.")
+        # The getters are objects with a dictionary of HelperCollection objects in the attribute collections
+        self.getters = getters
+        self.memory_budget = memory_budget
+        self.policy = policy
+        self.idle_timeout = idle_timeout
+        self.interval = interval
+        # Define metrics
+        self.lock = threading.Lock()
+        self.checks = 0
+        self.loads = {}
+        self.releases = {}
+        self.stalls = 0
+        self.total_stall_time = 0.0
+        self.max_stall_time = 0.0
+        self.events = deque(maxlen=RESIDENCY_EVENTS_SIZE)
+        # Requests that load a collection wake up the thread, since the budget could be exceeded
+        self.wake = threading.Event()
+        for getter in getters:
+            getter.add_listener(self._on_request_load)
+        # Start background thread. The thread is a daemon, so that it does not prevent the application from exiting.
+        self.thread = threading.Thread(target=self._run, args=(prewarm or [],), daemon=True)
+        self.thread.start()
+
+    def _run(self, prewarm: List[str]):
+        try:
+            self.prewarm(prewarm)
+        except Exception as e:
+            print(f"Pre-warming of collections failed: {e}")
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Residency check failed: {e}")
+
+    def _get_helpers(self) -> List:
+        # The dictionaries are replaced, never modified, when collections are added or removed, so they can be iterated
+        # while requests are served
+        return [helper for getter in self.getters for helper in getter.collections.values()]
+
+    def _record(self, event: str, helper, reason: str, duration: float):
+        counts = self.loads if event == "load" else self.releases
+        with self.lock:
+            counts[reason] = counts.get(reason, 0) + 1
+            self.events.append({"time": time.time(), "event": event, "collection": helper.name, "reason": reason,
+                                "duration_ms": 1000 * duration, "size_bytes": helper.size})
+
+    def _on_request_load(self, helper, duration: float):
+        # The request waited for the collection to be loaded
+        self._record("load", helper, "request", duration)
+        with self.lock:
+            self.stalls += 1
+            self.total_stall_time += duration
+            self.max_stall_time = max(self.max_stall_time, duration)
+        self.wake.set()
+
+    def get_loaded_size(self) -> int:
+        return sum(helper.size for helper in self._get_helpers() if helper.loaded)
+
+    def prewarm(self, names: List[str]):
+        """
+        Load collections in the given order, until the memory budget is reached.
+        @param names: names of the collections.
+        """
+        helpers = {helper.name: helper for helper in self._get_helpers()}
+        for name in names:
+            if name not in helpers:
+                continue
+            if self.get_loaded_size() >= self.memory_budget:
+                break
+            duration = helpers[name].load()
+            if duration is not None:
+                self._record("load", helpers[name], "prewarm", duration)
+
+    def _release(self, helper, idle_timeout: float, reason: str) -> bool:
+        start = time.monotonic()
+        if helper.release_if_idle(idle_timeout):
+            self._record("release", helper, reason, time.monotonic() - start)
+            return True
+        return False
+
+    def _get_priority(self, helper):
+        # Collections with lower priority are evicted first
+        if self.policy == "lfu":
+            return helper.accesses, helper.last_access
+        return helper.last_access
+
+    def check(self):
+        """
+        Release idle collections, and evict collections until the loaded collections fit in the memory budget.
+        Collections that are in use by a request, or that have been used in the last COLLECTION_EVICTION_MIN_IDLE
+        seconds, are not evicted.
+        """
+        helpers = self._get_helpers()
+        for helper in helpers:
+            self._release(helper, self.idle_timeout, "idle")
+
+        loaded = sorted([helper for helper in helpers if helper.loaded], key=self._get_priority)
+        size = sum(helper.size for helper in loaded)
+        for helper in loaded:
+            if size <= self.memory_budget:
+                break
+            if self._release(helper, COLLECTION_EVICTION_MIN_IDLE, "budget"):
+                size -= helper.size
+
+        for helper in helpers:
+            helper.accesses //= 2
+        with self.lock:
+            self.checks += 1
+
+    def get_metrics(self) -> dict:
+        now = time.monotonic()
+        collections = {}
+        for helper in self._get_helpers():
+            collections[helper.name] = {"loaded": helper.loaded, "loads": helper.loads, "size_bytes": helper.size,
+                                        "idle_s": now - helper.last_access, "accesses": helper.accesses,
+                                        "in_use": helper.in_use}
+        with self.lock:
+            return {
+                "policy": self.policy,
+                "memory_budget_bytes": self.memory_budget,
+                "loaded_bytes": sum(value["size_bytes"] for value in collections.values() if value["loaded"]),
+                "idle_timeout_s": self.idle_timeout,
+                "checks": self.checks,
+                "loads": dict(self.loads),
+                "releases": dict(self.releases),
+                "stalls": self.stalls,
+                "mean_stall_ms": 1000 * self.total_stall_time / self.stalls if self.stalls > 0 else 0.0,
+                "max_stall_ms": 1000 * self.max_stall_time,
+                "collections": collections,
+                "events": list(self.events)
+            }
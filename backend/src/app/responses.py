@@ -0,0 +1,13 @@
+import orjson
+from fastapi import Response
+
+
+class ORJSONResponse(Response):
+    """
+    JSON response serialized directly to bytes with orjson, without jsonable_encoder. The content must only contain
+    types supported by orjson, including NumPy arrays.
+    """
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
@@ -0,0 +1,194 @@
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, List
+
+import numpy as np
+from pymilvus import Collection
+
+from .CONSTANTS import *
+from ..CONSTANTS import ATTRIBUTES_FILE_NAME, COSINE_METRIC, EMBEDDINGS_FILE_NAME
+from ..db_utilities.collections import EMBEDDING_VECTOR_FIELD_NAME
+from ..db_utilities.export import columns_to_rows, export_collection
+
+# Attributes of the images returned by the searches
+OUTPUT_FIELDS = ["index", "author", "path", "width", "height", "genre", "date", "title", "caption", "x", "y"]
+
+
+def get_search_params(params: dict | None, limit: int) -> dict:
+    """
+    Get the parameters of a search in the embeddings collection.
+    @param params: search parameters of the index of the collection, e.g. ef for HNSW or nprobe for IVF indexes.
+    @param limit: number of results of the search.
+    @return: the search parameters.
+    """
+    params = dict(params) if params is not None else {}
+    # HNSW requires ef to be at least the number of results
+    if "ef" in params:
+        params["ef"] = max(params["ef"], limit)
+    return {"metric_type": COSINE_METRIC, "offset": 0, "params": params}
+
+
+class SearchBackend(ABC):
+    """
+    Backend for the similarity searches in the embeddings collection of a dataset.
+    """
+
+    @abstractmethod
+    def search(self, collection: Collection, data: List[List[float]], limit: int) -> List[List[dict]]:
+        """
+        Find the images most similar to the given embeddings, by cosine similarity.
+        @param collection: the embeddings collection of the dataset.
+        @param data: embeddings of the queries.
+        @param limit: number of results of each query.
+        @return: for each query, the attributes of the images found, from the most similar to the least similar.
+        """
+        pass
+
+    def get_images(self, collection: Collection, indexes: List[int]) -> dict:
+        """
+        Get the attributes of images from their indexes.
+        @param collection: the embeddings collection of the dataset.
+        @param indexes: indexes of the images.
+        @return: dictionary with the indexes of the images found in the collection and their attributes.
+        """
+        return {entity["index"]: entity for entity in collection.query(
+            expr=f"index in {list(indexes)}",
+            output_fields=OUTPUT_FIELDS
+        )}
+
+
+class MilvusSearchBackend(SearchBackend):
+    """
+    Search with the index of the embeddings collection in Milvus.
+    """
+
+    def __init__(self, search_params: dict | None = None):
+        self.search_params = search_params
+
+    def search(self, collection: Collection, data: List[List[float]], limit: int) -> List[List[dict]]:
+        results = collection.search(
+            data=data,
+            anns_field=EMBEDDING_VECTOR_FIELD_NAME,
+            param=get_search_params(self.search_params, limit),
+            limit=limit,
+            output_fields=OUTPUT_FIELDS
+        )
+        return [[hit.to_dict()["entity"] for hit in hits] for hits in results]
+
+
+class LocalSearchBackend(SearchBackend):
+    """
+    Search in memory, with the normalized matrix of the embeddings of the images. The similarities of the queries with
+    all the images are computed with a single matrix product, and the best results are selected with argpartition. If
+    the attributes of the images are given, searches do not use Milvus at all. Otherwise, the attributes of the results
+    are queried from Milvus. This is faster than a search in Milvus for small datasets, whose matrix of embeddings fits
+    in memory.
+    """
+
+    def __init__(self, embeddings: np.ndarray, attributes: dict | None = None):
+        """
+        @param embeddings: matrix of embeddings, where row i is the embedding of image i, and empty rows are images
+        without an embedding.
+        @param attributes: dictionary from the index of each image to its attributes, or None to query them from Milvus.
+        """
+        norms = np.linalg.norm(embeddings, axis=1)
+        # Keep only the images with an embedding
+        self.indexes = np.flatnonzero(norms > 0)
+        self.embeddings = (embeddings[self.indexes] / norms[self.indexes, None]).astype(np.float32)
+        self.attributes = attributes
+
+    def search_indexes(self, data: List[List[float]], limit: int) -> tuple:
+        """
+        Find the indexes of the images most similar to the given embeddings.
+        @param data: embeddings of the queries.
+        @param limit: number of results of each query.
+        @return: indexes and similarities of the results of each query, sorted by decreasing similarity.
+        """
+        queries = np.asarray(data, dtype=np.float32).reshape(-1, self.embeddings.shape[1])
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), np.finfo(np.float32).tiny)
+        scores = queries @ self.embeddings.T
+        limit = min(limit, len(self.indexes))
+        if limit < len(self.indexes):
+            best = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+        else:
+            best = np.broadcast_to(np.arange(len(self.indexes)), (len(queries), limit))
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        return self.indexes[np.take_along_axis(best, order, axis=1)], np.take_along_axis(best_scores, order, axis=1)
+
+    def search(self, collection: Collection, data: List[List[float]], limit: int) -> List[List[dict]]:
+        indexes, _ = self.search_indexes(data, limit)
+        if indexes.size == 0:
+            return [[] for _ in indexes]
+        # Get the attributes of all the results at once
+        entities = self.get_images(collection, np.unique(indexes).tolist())
+        return [[entities[index] for index in row.tolist() if index in entities] for row in indexes]
+
+    def get_images(self, collection: Collection, indexes: List[int]) -> dict:
+        if self.attributes is None:
+            return super().get_images(collection, indexes)
+        return {index: self.attributes[index] for index in indexes if index in self.attributes}
+
+
+class SearchBackendGetter:
+    """
+    Get the search backend of each dataset, chosen with the "search_backend" entry of the dataset in datasets.json,
+    either "milvus" or "local". The local backend needs the matrix of embeddings of the dataset in the data directory.
+    If it does not exist, the dataset is searched in Milvus. The attributes of the images are exported from the
+    collection the first time the local backend of a dataset is created, and saved next to the matrix of embeddings
+    together with the id of the collection, so that they are exported again only when the collection is rebuilt.
+    Backends are created the first time they are needed, and created again when the collection of the dataset is
+    rebuilt.
+    """
+
+    def __init__(self, datasets: List, search_params_getter: Callable[[str], dict], data_dir: str = DATA_DIR_PATH):
+        self.search_params_getter = search_params_getter
+        self.data_dir = data_dir
+        self.settings = {dataset["name"]: dataset.get("search_backend", DEFAULT_SEARCH_BACKEND) for dataset in datasets}
+        self.backends = {}
+        self.lock = threading.Lock()
+
+    def _load_attributes(self, collection: Collection) -> dict:
+        path = os.path.join(self.data_dir, collection.name, ATTRIBUTES_FILE_NAME)
+        collection_id = collection.describe()["collection_id"]
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                attributes = json.load(f)
+            if attributes["collection_id"] == collection_id:
+                return {entity["index"]: entity for entity in attributes["entities"]}
+        entities = []
+        for batch in export_collection(collection, OUTPUT_FIELDS):
+            entities.extend(columns_to_rows(batch))
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump({"collection_id": collection_id, "entities": entities}, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Could not save {path}: {e}")
+        return {entity["index"]: entity for entity in entities}
+
+    def _create(self, collection: Collection) -> SearchBackend:
+        name = collection.name
+        if self.settings.get(name, DEFAULT_SEARCH_BACKEND) == "local":
+            path = os.path.join(self.data_dir, name, EMBEDDINGS_FILE_NAME)
+            if os.path.exists(path):
+                return LocalSearchBackend(np.load(path, mmap_mode="r"), self._load_attributes(collection))
+            print(f"Could not find {path}. The dataset {name} is searched in Milvus.")
+        return MilvusSearchBackend(self.search_params_getter(name))
+
+    def __call__(self, collection: Collection) -> SearchBackend:
+        if collection.name not in self.backends:
+            with self.lock:
+                if collection.name not in self.backends:
+                    self.backends[collection.name] = self._create(collection)
+        return self.backends[collection.name]
+
+    def invalidate(self, collection: str):
+        with open(DATASETS_JSON_PATH, "r") as f:
+            datasets = json.load(f)["datasets"]
+        with self.lock:
+            self.settings.update({dataset["name"]: dataset.get("search_backend", DEFAULT_SEARCH_BACKEND)
+                                  for dataset in datasets if dataset["name"] == collection})
+            self.backends.pop(collection, None)
@@ -0,0 +1,101 @@
+import struct
+from typing import List
+
+import numpy as np
+
+# Media type of the binary encoding of tiles
+BINARY_TILES_MEDIA_TYPE = "application/x-aeye-tiles"
+# Magic bytes and version at the start of every binary response
+MAGIC = b"AETL"
+VERSION = 1
+# Header: magic, version, reserved, number of tiles, number of representatives, number of paths, size of the paths in
+# bytes. All values are little-endian.
+HEADER = struct.Struct("<4sHHIIII")
+
+
+def _pad(size: int) -> bytes:
+    # Padding that aligns the next section to 4 bytes
+    return b"\0" * (-size % 4)
+
+
+def encode_tiles(tiles: List[dict]) -> bytes:
+    """
+    Encode tiles in the binary format read by decodeTiles in frontend/src/Map/utilities.js. After the header, the
+    sections are, in order, each of them aligned to 4 bytes:
+    - tile indexes (int32) and number of representatives of each tile (uint32);
+    - for each representative, in the order of the tiles: index (int32), path id (uint32), width (uint32),
+      height (uint32), x (float32), y (float32) and zoom level (uint8);
+    - offsets of the paths in the path table (uint32, number of paths + 1 values), and the UTF-8 encoded paths. Paths
+      that appear in several tiles are stored once.
+    @param tiles: list of tiles, with keys "index" and "data", as returned by gets.get_tiles.
+    @return: the encoded tiles.
+    """
+    representatives = [representative for tile in tiles for representative in tile["data"]]
+    path_ids = {}
+    for representative in representatives:
+        path_ids.setdefault(representative["path"], len(path_ids))
+    paths = [path.encode() for path in path_ids.keys()]
+    offsets = np.zeros(len(paths) + 1, dtype="<u4")
+    np.cumsum([len(path) for path in paths], out=offsets[1:])
+
+    def column(key, dtype):
+        return np.fromiter((representative[key] for representative in representatives), dtype=dtype,
+                           count=len(representatives)).tobytes()
+
+    sections = [
+        np.array([tile["index"] for tile in tiles], dtype="<i4").tobytes(),
+        np.array([len(tile["data"]) for tile in tiles], dtype="<u4").tobytes(),
+        column("index", "<i4"),
+        np.fromiter((path_ids[representative["path"]] for representative in representatives), dtype="<u4",
+                    count=len(representatives)).tobytes(),
+        column("width", "<u4"),
+        column("height", "<u4"),
+        column("x", "<f4"),
+        column("y", "<f4"),
+        column("zoom", "u1"),
+        offsets.tobytes(),
+        b"".join(paths)
+    ]
+    body = [HEADER.pack(MAGIC, VERSION, 0, len(tiles), len(representatives), len(paths), int(offsets[-1]))]
+    for section in sections:
+        body += [section, _pad(len(section))]
+    return b"".join(body)
+
+
+def decode_tiles(buffer: bytes) -> List[dict]:
+    """
+    Decode tiles encoded with encode_tiles. Coordinates are returned as float32 values converted to float.
+    @param buffer: the encoded tiles.
+    @return: list of tiles, with keys "index" and "data".
+    """
+    magic, version, _, number_of_tiles, number_of_representatives, number_of_paths, paths_size = \
+        HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Unsupported tile encoding.")
+    offset = HEADER.size
+
+    def read(dtype, count):
+        nonlocal offset
+        array = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+        offset += array.nbytes + (-array.nbytes % 4)
+        return array
+
+    tile_indexes = read("<i4", number_of_tiles)
+    counts = read("<u4", number_of_tiles)
+    indexes, path_ids, widths, heights = [read(dtype, number_of_representatives)
+                                          for dtype in ("<i4", "<u4", "<u4", "<u4")]
+    xs, ys = read("<f4", number_of_representatives), read("<f4", number_of_representatives)
+    zooms = read("u1", number_of_representatives)
+    offsets = read("<u4", number_of_paths + 1)
+    paths = [bytes(buffer[offset + offsets[i]:offset + offsets[i + 1]]).decode() for i in range(number_of_paths)]
+
+    tiles = []
+    start = 0
+    for tile_index, count in zip(tile_indexes, counts):
+        tiles.append({"index": int(tile_index), "data": [
+            {"index": int(indexes[i]), "path": paths[path_ids[i]], "x": float(xs[i]), "y": float(ys[i]),
+             "width": int(widths[i]), "height": int(heights[i]), "zoom": int(zooms[i])}
+            for i in range(start, start + int(count))
+        ]})
+        start += int(count)
+    return tiles
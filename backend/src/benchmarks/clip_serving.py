@@ -0,0 +1,153 @@
+import getopt
+import json
+import os
+import sys
+import time
+
+import PIL.Image
+import numpy as np
+import torch
+
+from ..CONSTANTS import *
+from ..db_utilities.datasets import get_dataset_object
+from ..embeddings_model.CLIPEmbeddings import ClipEmbeddings
+
+# Increase pixel limit
+PIL.Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Texts used for measuring the latency of text embeddings and the agreement of the text search results
+BENCHMARK_TEXTS = ["cat", "sunset", "portrait", "a painting of a dog", "a landscape with mountains", "the sea",
+                   "a woman with a hat", "flowers in a vase", "a city at night", "a bird on a branch"]
+
+
+def parsing():
+    # Load dataset options from datasets.json
+    with open(os.path.join(os.getenv(HOME), DATASETS_JSON_NAME), "r") as f:
+        datasets = json.load(f)["datasets"]
+
+    # Remove 1st argument from the list of command line arguments
+    arguments = sys.argv[1:]
+
+    # Options
+    options = "hc:n:r:"
+
+    # Long options
+    long_options = ["help", "collection=", "images=", "repetitions="]
+
+    # Prepare flags
+    flags = {"dataset": datasets[0]["name"], "images": 200, "repetitions": 20}
+
+    # Parsing argument
+    arguments, values = getopt.getopt(arguments, options, long_options)
+
+    if len(arguments) > 0 and arguments[0][0] in ("-h", "--help"):
+        print(f'This script compares the fp32 CLIP model with the int8 dynamically quantized model used for serving. '
+              f'It reports the latency of text and image embeddings, the recall@1 of image search against the fp32 '
+              f'embeddings of the dataset, and the agreement of the top-1 text search results.\n\
+        -c or --collection: dataset (default={flags["dataset"]}).\n\
+        -n or --images: number of images used for the image benchmark (default={flags["images"]}).\n\
+        -r or --repetitions: number of repetitions of each text (default={flags["repetitions"]}).')
+        sys.exit(0)
+
+    # Checking each argument
+    for arg, val in arguments:
+        if arg in ("-c", "--collection"):
+            if val in [d["name"] for d in datasets]:
+                flags["dataset"] = val
+            else:
+                print("Dataset not found.")
+                sys.exit(1)
+        elif arg in ("-n", "--images"):
+            if int(val) >= 1:
+                flags["images"] = int(val)
+            else:
+                print("Number of images must be greater than 0.")
+                sys.exit(1)
+        elif arg in ("-r", "--repetitions"):
+            if int(val) >= 1:
+                flags["repetitions"] = int(val)
+            else:
+                print("Number of repetitions must be greater than 0.")
+                sys.exit(1)
+
+    return flags
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms > 0, norms, 1)
+
+
+def summarize_latencies(latencies: list) -> str:
+    latencies = 1000 * np.array(latencies)
+    return (f"mean {latencies.mean():.1f} ms, p50 {np.percentile(latencies, 50):.1f} ms, "
+            f"p95 {np.percentile(latencies, 95):.1f} ms")
+
+
+def benchmark_model(model: ClipEmbeddings, dataset, indexes: np.ndarray, reference: np.ndarray, repetitions: int):
+    """
+    Measure latency and search results of a model.
+    @param model: the model.
+    @param dataset: the dataset object.
+    @param indexes: indexes of the images used for the benchmark.
+    @param reference: normalized fp32 embeddings of the dataset, with row i containing the embedding of index i. Rows
+    of samples that were not embedded are 0.
+    @param repetitions: number of repetitions of each text.
+    @return: latencies of text and image embeddings, top-1 index of each text, and the recall@1 of image search.
+    """
+    # Warm up
+    model.getTextEmbeddings(BENCHMARK_TEXTS[0])
+
+    text_latencies = []
+    text_results = []
+    for text in BENCHMARK_TEXTS:
+        for _ in range(repetitions):
+            start = time.perf_counter()
+            embedding = model.getTextEmbeddings(text)
+            text_latencies.append(time.perf_counter() - start)
+        text_results.append(int(np.argmax(reference @ normalize(embedding.numpy())[0])))
+
+    image_latencies = []
+    hits = 0
+    for index in indexes:
+        image = dataset[int(index)]["images"]
+        start = time.perf_counter()
+        embedding = model.getImageEmbeddings(image)
+        image_latencies.append(time.perf_counter() - start)
+        hits += int(np.argmax(reference @ normalize(embedding.numpy())[0])) == index
+
+    return text_latencies, text_results, image_latencies, hits / len(indexes)
+
+
+if __name__ == "__main__":
+    # Get arguments
+    flags = parsing()
+
+    # Load fp32 embeddings generated for the dataset
+    embeddings_path = os.path.join(os.getenv(HOME), DATA_DIR_NAME, flags["dataset"], EMBEDDINGS_FILE_NAME)
+    if not os.path.exists(embeddings_path):
+        print(f"Could not find {embeddings_path}. Generate the embeddings of the dataset first.")
+        sys.exit(1)
+    reference = normalize(np.load(embeddings_path))
+    # Sample images among those that have been embedded
+    embedded = np.flatnonzero(np.any(reference != 0, axis=1))
+    indexes = np.random.default_rng(RANDOM_STATE).choice(embedded, size=min(flags["images"], len(embedded)),
+                                                         replace=False)
+
+    dataset = get_dataset_object(flags["dataset"])
+    print(f"Benchmarking on {len(indexes)} images of {flags['dataset']}, {torch.get_num_threads()} threads.")
+
+    baseline = None
+    for name, quantize in [("fp32", False), ("int8 dynamic", True)]:
+        model = ClipEmbeddings("cpu", quantize=quantize)
+        text_latencies, text_results, image_latencies, recall = benchmark_model(model, dataset, indexes, reference,
+                                                                                flags["repetitions"])
+        if baseline is None:
+            baseline = text_results
+        agreement = np.mean(np.array(text_results) == np.array(baseline))
+        print(f"{name}:\n"
+              f"  text embedding latency: {summarize_latencies(text_latencies)}\n"
+              f"  image embedding latency: {summarize_latencies(image_latencies)}\n"
+              f"  image search recall@1: {recall:.3f}\n"
+              f"  text search top-1 agreement with fp32: {agreement:.3f}")
+        del model
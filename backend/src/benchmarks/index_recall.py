@@ -0,0 +1,172 @@
+import getopt
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from pymilvus import CollectionSchema, FieldSchema, DataType, Collection, db, utility
+
+from ..CONSTANTS import *
+from ..db_utilities.collections import get_index_config, EMBEDDING_VECTOR_FIELD_NAME, EMBEDDING_DIM
+from ..db_utilities.utils import create_connection
+
+# Search parameters tried for each index type
+SEARCH_PARAMS_SWEEP = {
+    "FLAT": [{}],
+    "HNSW": [{"ef": ef} for ef in (16, 32, 64, 128, 256)],
+    "IVF_FLAT": [{"nprobe": nprobe} for nprobe in (1, 4, 16, 64)],
+    "IVF_SQ8": [{"nprobe": nprobe} for nprobe in (1, 4, 16, 64)]
+}
+
+
+def parsing():
+    # Load dataset options from datasets.json
+    with open(os.path.join(os.getenv(HOME), DATASETS_JSON_NAME), "r") as f:
+        datasets = json.load(f)["datasets"]
+    # Remove 1st argument from the list of command line arguments
+    arguments = sys.argv[1:]
+
+    # Options
+    options = "hd:c:k:q:i:"
+
+    # Long options
+    long_options = ["help", "database=", "collection=", "neighbors=", "queries=", "index_types="]
+
+    # Prepare flags
+    flags = {"database": DEFAULT_DATABASE_NAME, "dataset": datasets[0]["name"], "k": 10, "queries": 200,
+             "index_types": ["HNSW", "IVF_FLAT", "IVF_SQ8"]}
+
+    # Parsing argument
+    arguments, values = getopt.getopt(arguments, options, long_options)
+
+    if len(arguments) > 0 and arguments[0][0] in ("-h", "--help"):
+        print(f'This script measures the recall@k and the latency of the searches with different index types on the '
+              f'embeddings of a dataset. The embeddings are copied to a temporary collection, so that the collection '
+              f'of the dataset is not modified. The build parameters of an index type are taken from the entry of the '
+              f'dataset in datasets.json if it uses that index type, and are the defaults otherwise.\n\
+        -d or --database: database name (default={flags["database"]}).\n\
+        -c or --collection: dataset (default={flags["dataset"]}).\n\
+        -k or --neighbors: number of results of each search (default={flags["k"]}).\n\
+        -q or --queries: number of queries (default={flags["queries"]}).\n\
+        -i or --index_types: comma separated index types compared with FLAT '
+              f'(default={",".join(flags["index_types"])}).')
+        sys.exit(0)
+
+    # Checking each argument
+    for arg, val in arguments:
+        if arg in ("-d", "--database"):
+            flags["database"] = val
+        elif arg in ("-c", "--collection"):
+            if val in [d["name"] for d in datasets]:
+                flags["dataset"] = val
+            else:
+                print("Dataset not found.")
+                sys.exit(1)
+        elif arg in ("-k", "--neighbors"):
+            if int(val) >= 1:
+                flags["k"] = int(val)
+            else:
+                print("Number of neighbors must be greater than 0.")
+                sys.exit(1)
+        elif arg in ("-q", "--queries"):
+            if int(val) >= 1:
+                flags["queries"] = int(val)
+            else:
+                print("Number of queries must be greater than 0.")
+                sys.exit(1)
+        elif arg in ("-i", "--index_types"):
+            flags["index_types"] = val.split(",")
+            if any(index_type not in INDEX_PARAMS for index_type in flags["index_types"]):
+                print(f"Index types must be among {list(INDEX_PARAMS.keys())}.")
+                sys.exit(1)
+
+    flags["index"] = get_index_config(next(d for d in datasets if d["name"] == flags["dataset"]))
+    return flags
+
+
+def recall_at_k(results: list, ground_truth: np.ndarray) -> float:
+    """
+    Compute the recall of searches.
+    @param results: for each query, the indexes returned by the search.
+    @param ground_truth: for each query, the indexes of the exact k nearest neighbors.
+    @return: average fraction of the exact neighbors returned by the searches.
+    """
+    return float(np.mean([len(set(result) & set(truth.tolist())) / len(truth)
+                          for result, truth in zip(results, ground_truth)]))
+
+
+def create_benchmark_collection(name: str, embeddings: np.ndarray, indexes: np.ndarray) -> Collection:
+    # Create a collection with only the indexes and the embeddings of the images
+    schema = CollectionSchema(
+        fields=[FieldSchema(name="index", dtype=DataType.INT64, is_primary=True),
+                FieldSchema(name=EMBEDDING_VECTOR_FIELD_NAME, dtype=DataType.FLOAT_VECTOR, dim=EMBEDDING_DIM)],
+        description="index benchmark"
+    )
+    collection = Collection(name=name, schema=schema, shards_num=1)  # type: ignore
+    for start in range(0, len(indexes), INSERT_SIZE):
+        batch = indexes[start:start + INSERT_SIZE]
+        collection.insert([batch.tolist(), np.asarray(embeddings[batch], dtype=np.float32).tolist()])
+    collection.flush()
+    return collection
+
+
+if __name__ == "__main__":
+    # Get arguments
+    flags = parsing()
+
+    embeddings_path = os.path.join(os.getenv(HOME), DATA_DIR_NAME, flags["dataset"], EMBEDDINGS_FILE_NAME)
+    if not os.path.exists(embeddings_path):
+        print(f"Could not find {embeddings_path}. Generate the embeddings of the dataset first.")
+        sys.exit(1)
+    embeddings = np.load(embeddings_path, mmap_mode="r")
+    embedded = np.flatnonzero(np.any(embeddings != 0, axis=1))
+    queries = np.random.default_rng(RANDOM_STATE).choice(embedded, size=min(flags["queries"], len(embedded)),
+                                                         replace=False)
+
+    # Exact neighbors of the queries among the embedded images
+    norms = np.linalg.norm(embeddings[embedded], axis=1)
+    similarities = (embeddings[queries] @ embeddings[embedded].T) / norms[None, :]
+    ground_truth = embedded[np.argsort(-similarities, axis=1, kind="stable")[:, :flags["k"]]]
+
+    create_connection(ROOT_USER, ROOT_PASSWD)
+    db.using_database(flags["database"])
+    name = "benchmark_" + flags["dataset"]
+    if utility.has_collection(name):
+        utility.drop_collection(name)
+    collection = create_benchmark_collection(name, embeddings, embedded)
+    print(f"Benchmarking {len(queries)} queries with k={flags['k']} on {len(embedded)} images of {flags['dataset']}.")
+    print(f"{'index':>10} {'build (s)':>10} {'search params':>16} {'recall@k':>10} {'median (ms)':>12} "
+          f"{'p95 (ms)':>10}")
+    try:
+        for index_type in ["FLAT"] + [t for t in flags["index_types"] if t != "FLAT"]:
+            params = flags["index"]["params"] if flags["index"]["type"] == index_type else INDEX_PARAMS[index_type]
+            collection.release()
+            if collection.has_index():
+                collection.drop_index()
+            start = time.perf_counter()
+            collection.create_index(field_name=EMBEDDING_VECTOR_FIELD_NAME,
+                                    index_params={"metric_type": COSINE_METRIC, "index_type": index_type,
+                                                  "params": params})
+            utility.wait_for_index_building_complete(name)
+            build_time = time.perf_counter() - start
+            collection.load()
+            for search_params in SEARCH_PARAMS_SWEEP[index_type]:
+                if search_params.get("ef", flags["k"]) < flags["k"]:
+                    # HNSW requires ef to be at least the number of results
+                    continue
+                results, times = [], []
+                for query in queries:
+                    start = time.perf_counter()
+                    hits = collection.search(data=[np.asarray(embeddings[query], dtype=np.float32).tolist()],
+                                             anns_field=EMBEDDING_VECTOR_FIELD_NAME,
+                                             param={"metric_type": COSINE_METRIC, "params": search_params},
+                                             limit=flags["k"])
+                    times.append(time.perf_counter() - start)
+                    results.append(hits[0].ids)
+                description = ",".join(f"{key}={value}" for key, value in search_params.items()) or "-"
+                print(f"{index_type:>10} {build_time:>10.1f} {description:>16} "
+                      f"{recall_at_k(results, ground_truth):>10.3f} {np.median(times) * 1000:>12.2f} "
+                      f"{np.percentile(times, 95) * 1000:>10.2f}")
+    finally:
+        utility.drop_collection(name)
@@ -0,0 +1,109 @@
+import getopt
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from ..CONSTANTS import *
+from ..db_utilities.create_knn_graph import build_knn_graph
+
+
+def parsing():
+    # Load dataset options from datasets.json
+    with open(os.path.join(os.getenv(HOME), DATASETS_JSON_NAME), "r") as f:
+        datasets = json.load(f)["datasets"]
+    # Remove 1st argument from the list of command line arguments
+    arguments = sys.argv[1:]
+
+    # Options
+    options = "hc:n:k:q:"
+
+    # Long options
+    long_options = ["help", "collection=", "images=", "neighbors=", "queries="]
+
+    # Prepare flags
+    flags = {"dataset": None, "images": 50000, "k": KNN_GRAPH_K, "queries": 100}
+
+    # Parsing argument
+    arguments, values = getopt.getopt(arguments, options, long_options)
+
+    if len(arguments) > 0 and arguments[0][0] in ("-h", "--help"):
+        print(f'This script measures the time needed to build the k-NN graph of a dataset, and compares the latency of '
+              f'a neighbor query answered from the graph with the latency of a flat scan over all the embeddings.\n\
+        -c or --collection: dataset whose embeddings are used. If not given, random embeddings are used.\n\
+        -n or --images: number of random embeddings (default={flags["images"]}).\n\
+        -k or --neighbors: number of neighbors of each image (default={flags["k"]}).\n\
+        -q or --queries: number of queries (default={flags["queries"]}).')
+        sys.exit(0)
+
+    # Checking each argument
+    for arg, val in arguments:
+        if arg in ("-c", "--collection"):
+            if val in [d["name"] for d in datasets]:
+                flags["dataset"] = val
+            else:
+                print("Dataset not found.")
+                sys.exit(1)
+        elif arg in ("-n", "--images"):
+            if int(val) >= 2:
+                flags["images"] = int(val)
+            else:
+                print("Number of images must be greater than 1.")
+                sys.exit(1)
+        elif arg in ("-k", "--neighbors"):
+            if int(val) >= 1:
+                flags["k"] = int(val)
+            else:
+                print("Number of neighbors must be greater than 0.")
+                sys.exit(1)
+        elif arg in ("-q", "--queries"):
+            if int(val) >= 1:
+                flags["queries"] = int(val)
+            else:
+                print("Number of queries must be greater than 0.")
+                sys.exit(1)
+
+    return flags
+
+
+if __name__ == "__main__":
+    # Get arguments
+    flags = parsing()
+
+    if flags["dataset"] is not None:
+        embeddings = np.load(os.path.join(os.getenv(HOME), DATA_DIR_NAME, flags["dataset"], EMBEDDINGS_FILE_NAME),
+                             mmap_mode="r")
+    else:
+        embeddings = np.random.default_rng(RANDOM_STATE).normal(size=(flags["images"], 512)).astype(np.float32)
+    k = min(flags["k"], embeddings.shape[0] - 1)
+
+    indexes = np.zeros((embeddings.shape[0], k), dtype=np.int32)
+    scores = np.zeros((embeddings.shape[0], k), dtype=np.float16)
+    start = time.perf_counter()
+    build_knn_graph(embeddings, indexes, scores)
+    print(f"Built the graph of {embeddings.shape[0]} images with {k} neighbors in "
+          f"{time.perf_counter() - start:.2f} seconds ({indexes.nbytes + scores.nbytes} bytes).")
+
+    queries = np.random.default_rng(RANDOM_STATE).integers(embeddings.shape[0], size=flags["queries"])
+    # Flat scan, as done by Milvus with a FLAT index
+    norms = np.linalg.norm(embeddings, axis=1)
+    normalized = embeddings / np.where(norms > 0, norms, 1)[:, None]
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        similarities = normalized @ normalized[query]
+        best = np.argpartition(-similarities, k)[:k + 1]
+        best = best[np.argsort(-similarities[best])]
+        times.append(time.perf_counter() - start)
+    print(f"Flat scan: median latency {np.median(times) * 1000:.3f} ms.")
+
+    # Graph lookup
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        neighbors = indexes[query, :k]
+        neighbors = neighbors[neighbors >= 0].tolist()
+        times.append(time.perf_counter() - start)
+    print(f"Graph lookup: median latency {np.median(times) * 1000:.3f} ms.")
@@ -0,0 +1,100 @@
+import getopt
+import sys
+import time
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from ..CONSTANTS import *
+from ..app.responses import ORJSONResponse
+
+
+def parsing():
+    # Remove 1st argument from the list of command line arguments
+    arguments = sys.argv[1:]
+
+    # Options
+    options = "ht:r:"
+
+    # Long options
+    long_options = ["help", "tiles=", "repetitions="]
+
+    # Prepare flags
+    flags = {"tiles": [1, 16, 256, 1365, 4096], "repetitions": 20}
+
+    # Parsing argument
+    arguments, values = getopt.getopt(arguments, options, long_options)
+
+    if len(arguments) > 0 and arguments[0][0] in ("-h", "--help"):
+        print(f'This script compares the time needed to serialize tile responses with the default FastAPI path '
+              f'(jsonable_encoder and json) and with orjson, for responses with different numbers of tiles.\n\
+        -t or --tiles: comma separated numbers of tiles per response (default={",".join(map(str, flags["tiles"]))}).\n\
+        -r or --repetitions: number of repetitions for each size (default={flags["repetitions"]}).')
+        sys.exit(0)
+
+    # Checking each argument
+    for arg, val in arguments:
+        if arg in ("-t", "--tiles"):
+            try:
+                flags["tiles"] = [int(value) for value in val.split(",")]
+            except ValueError:
+                print("Numbers of tiles must be integers.")
+                sys.exit(1)
+            if min(flags["tiles"]) < 1:
+                print("Numbers of tiles must be greater than 0.")
+                sys.exit(1)
+        elif arg in ("-r", "--repetitions"):
+            if int(val) >= 1:
+                flags["repetitions"] = int(val)
+            else:
+                print("Number of repetitions must be greater than 0.")
+                sys.exit(1)
+
+    return flags
+
+
+def generate_tiles(number_of_tiles: int, rng: np.random.Generator) -> list:
+    """
+    Generate tiles with the same structure as the entities of a clusters collection.
+    @param number_of_tiles: number of tiles.
+    @param rng: random number generator.
+    @return: list of tiles.
+    """
+    tiles = []
+    for index in range(number_of_tiles):
+        data = [{"index": int(rng.integers(1000000)), "path": f"images/{rng.integers(1000000)}.jpg",
+                 "x": float(rng.normal()), "y": float(rng.normal()), "width": int(rng.integers(100, 4000)),
+                 "height": int(rng.integers(100, 4000)), "zoom": int(rng.integers(10))}
+                for _ in range(WINDOW_SIZE_IN_CELLS_PER_DIM ** 2 // 2)]
+        tiles.append({"index": index, "data": data})
+    return tiles
+
+
+def measure(render, content, repetitions: int) -> tuple:
+    # Return the median time in milliseconds and the size in bytes of the serialized content
+    times = []
+    body = b""
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        body = render(content)
+        times.append(time.perf_counter() - start)
+    return 1000 * float(np.median(times)), len(body)
+
+
+if __name__ == "__main__":
+    # Get arguments
+    flags = parsing()
+
+    rng = np.random.default_rng(RANDOM_STATE)
+    serializers = {
+        "jsonable_encoder + json": lambda content: JSONResponse(jsonable_encoder(content)).body,
+        "orjson": lambda content: ORJSONResponse(content).body
+    }
+    print(f"{'tiles':>8} {'bytes':>12} " + " ".join(f"{name + ' (ms)':>28}" for name in serializers) +
+          f" {'speedup':>8}")
+    for number_of_tiles in flags["tiles"]:
+        tiles = generate_tiles(number_of_tiles, rng)
+        results = [measure(render, tiles, flags["repetitions"]) for render in serializers.values()]
+        print(f"{number_of_tiles:>8} {results[0][1]:>12} " + " ".join(f"{result[0]:>28.2f}" for result in results) +
+              f" {results[0][0] / results[1][0]:>8.1f}")
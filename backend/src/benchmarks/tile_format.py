@@ -0,0 +1,74 @@
+import getopt
+import gzip
+import json
+import sys
+
+import numpy as np
+
+from .serialization import generate_tiles, measure
+from ..CONSTANTS import *
+from ..app.responses import ORJSONResponse
+from ..app.tile_format import decode_tiles, encode_tiles
+
+
+def parsing():
+    # Remove 1st argument from the list of command line arguments
+    arguments = sys.argv[1:]
+
+    # Options
+    options = "ht:r:"
+
+    # Long options
+    long_options = ["help", "tiles=", "repetitions="]
+
+    # Prepare flags
+    flags = {"tiles": [1, 16, 64, 256], "repetitions": 20}
+
+    # Parsing argument
+    arguments, values = getopt.getopt(arguments, options, long_options)
+
+    if len(arguments) > 0 and arguments[0][0] in ("-h", "--help"):
+        print(f'This script compares the JSON and the binary encodings of /api/tiles responses. It reports the size of '
+              f'the responses, with and without gzip, and the time needed to encode and decode them.\n\
+        -t or --tiles: comma separated numbers of tiles per response (default={",".join(map(str, flags["tiles"]))}).\n\
+        -r or --repetitions: number of repetitions for each size (default={flags["repetitions"]}).')
+        sys.exit(0)
+
+    # Checking each argument
+    for arg, val in arguments:
+        if arg in ("-t", "--tiles"):
+            try:
+                flags["tiles"] = [int(value) for value in val.split(",")]
+            except ValueError:
+                print("Numbers of tiles must be integers.")
+                sys.exit(1)
+            if min(flags["tiles"]) < 1:
+                print("Numbers of tiles must be greater than 0.")
+                sys.exit(1)
+        elif arg in ("-r", "--repetitions"):
+            if int(val) >= 1:
+                flags["repetitions"] = int(val)
+            else:
+                print("Number of repetitions must be greater than 0.")
+                sys.exit(1)
+
+    return flags
+
+
+if __name__ == "__main__":
+    # Get arguments
+    flags = parsing()
+
+    rng = np.random.default_rng(RANDOM_STATE)
+    # Encoding and decoding functions. Browsers parse JSON natively, so JSON is decoded with the standard library.
+    encodings = {"json": (lambda tiles: ORJSONResponse(tiles).body, json.loads),
+                 "binary": (encode_tiles, decode_tiles)}
+    print(f"{'tiles':>8} {'encoding':>8} {'bytes':>12} {'gzip bytes':>12} {'encode (ms)':>12} {'decode (ms)':>12}")
+    for number_of_tiles in flags["tiles"]:
+        tiles = generate_tiles(number_of_tiles, rng)
+        for name, (encode, decode) in encodings.items():
+            encode_time, size = measure(encode, tiles, flags["repetitions"])
+            body = encode(tiles)
+            decode_time = measure(decode, body, flags["repetitions"])[0]
+            print(f"{number_of_tiles:>8} {name:>8} {size:>12} {len(gzip.compress(body)):>12} {encode_time:>12.2f} "
+                  f"{decode_time:>12.2f}")
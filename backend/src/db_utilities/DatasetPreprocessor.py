@@ -1,5 +1,5 @@
 import sys
-from typing import Dict
+from typing import Callable, Dict
 
 import numpy as np
 import torch
@@ -21,29 +21,18 @@ class DatasetPreprocessor:
         """
         self.embeddings_model = embeddings_model
         self._embeddings = None
-        self._attributes = {}
         self._low_dim_embeddings = None
 
     def setEmbeddings(self, embeddings):
         self._embeddings = embeddings
 
-    def _generateEmbeddings(self, inputs):
+    def _generateEmbeddings(self, inputs) -> np.ndarray:
         """
-        Generate _embeddings of data using the provided _embeddings embeddings_model. The method requires the inputs
-        to the data encoder.
+        Generate the embeddings of a batch of data using the provided embeddings_model. The method requires the inputs
+        to the data encoder, and returns the embeddings as a float32 matrix with one row per sample.
         """
-        # This code works for dataloader with batch_size == 1
-        if self._embeddings is None:
-            self._embeddings = self.embeddings_model.getEmbeddings(inputs).detach()
-        else:
-            self._embeddings = torch.cat((self._embeddings,
-                                          self.embeddings_model.getEmbeddings(inputs)), dim=0).detach()
-
-    def _storeAttributes(self, data, attribute):
-        if attribute not in self._attributes:
-            self._attributes[attribute] = data[attribute]
-        else:
-            self._attributes[attribute] = self._attributes[attribute] + data[attribute]
+        with torch.no_grad():
+            return self.embeddings_model.getEmbeddings(inputs).detach().cpu().numpy().astype(np.float32)
 
     def _generateLowDimensionalEmbeddings(self, projection_method):
         try:
@@ -62,35 +51,45 @@ class DatasetPreprocessor:
 
         return {"low_dim_embeddings": self._low_dim_embeddings}
 
-    def generateDatabaseEmbeddings(self, dataloader):
+    def generateDatabaseEmbeddings(self, dataloader, embeddings: np.ndarray, insert_batch: Callable[[dict], None],
+                                   save_checkpoint: Callable[[int, list | None], None]):
         """
-        Generate dataset embeddings from the dataloader specified when creating the object. The method saves the
-        indexes of the samples that could not be fetched in a file, with the index of the next sample after the last
-        one that has been correctly fetched and processed.
+        Generate dataset embeddings from the dataloader specified when creating the object, streaming the results.
+        The embeddings of each batch are written in the rows of the preallocated (or memory-mapped) embeddings matrix
+        given by the indexes of the samples, and the batch is passed to insert_batch straight away, so that nothing
+        but the current batch is kept in memory. After each batch, save_checkpoint is called, so that the caller can
+        record the progress and resume from the next batch if the generation is interrupted.
         :param dataloader: dataloader object
+        :param embeddings: float32 matrix with one row per sample of the dataset.
+        :param insert_batch: function called with a dictionary containing the embeddings of the batch, under the key
+        'embeddings', and the other attributes of the batch.
+        :param save_checkpoint: function called with the number of the batch in the dataloader and the list of samples
+        of the batch that have been skipped, or None if the whole batch could not be loaded.
         """
         try:
             for i, data in enumerate(tqdm(dataloader, desc="Processing", ncols=100,
                                           bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]")):
                 if data is not None:
+                    # Get samples that could not be loaded
+                    skipped = data.pop("skipped", [])
                     attributes = list(data.keys())
-                    # Check if "index" is in attribute
-                    if "index" not in attributes:
-                        raise Exception("'index' must be present in each sample. Please modify the collate_fn "
-                                        "function to include the attribute.")
-                    # Generate data embeddings
-                    self._generateEmbeddings(data[attributes[0]])
-                    # Collect other attributes for the data points
-                    if len(attributes) > 1:
-                        for attribute in attributes[1:]:
-                            self._storeAttributes(data, attribute)
+                    if len(attributes) > 0:
+                        # Check if "index" is in attribute
+                        if "index" not in attributes:
+                            raise Exception("'index' must be present in each sample. Please modify the collate_fn "
+                                            "function to include the attribute.")
+                        # Generate data embeddings and write them in the rows given by the indexes
+                        batch_embeddings = self._generateEmbeddings(data[attributes[0]])
+                        embeddings[data["index"]] = batch_embeddings
+                        # Pass embeddings and other attributes for the data points to the caller
+                        insert_batch({"embeddings": batch_embeddings,
+                                      **{attribute: data[attribute] for attribute in attributes[1:]}})
+                    save_checkpoint(i, skipped)
                 else:
                     print("Data is empty...moving on to next batch.")
-
-            # Pack results in dictionary and return it to caller
-            return {'embeddings': self._embeddings, **self._attributes}
+                    save_checkpoint(i, None)
 
         except Exception as e:
-            # Print exception information
+            # Print exception information. The work done up to the last checkpoint is not lost.
             print("Error in generateDatabaseEmbeddings. Error: ", e)
             sys.exit(1)
@@ -7,7 +7,8 @@ import sys
 from dotenv import load_dotenv
 from pymilvus import db, Collection, utility
 
-from .collections import embeddings_collection
+from .collections import embeddings_collection, get_index_config
+from .export import export_collection, columns_to_rows
 from .utils import create_connection
 from ..CONSTANTS import *
 
@@ -48,6 +49,13 @@ def parsing():
                                                                                      for dataset in datasets]))
                 sys.exit(1)
 
+    # The new collection has the same index as the collection of the dataset
+    try:
+        flags["index"] = get_index_config(next(d for d in datasets if d["name"] == flags["collection"]))
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
     return flags
 
 
@@ -93,51 +101,35 @@ if __name__ == "__main__":
     # Load collection
     collection.load()
 
-    # Fetch vectors
-    entities = []
-    try:
-        for i in range(0, collection.num_entities, SEARCH_LIMIT):
-            if collection.num_entities > 0:
-                # Get SEARCH_LIMIT entities
-                query_result = collection.query(
-                    expr=f"index in {list(range(i, i + SEARCH_LIMIT))}",
-                    output_fields=["*"]
-                )
-                # Add entities to the list of entities
-                entities += query_result
-    except Exception as e:
-        print("Error in update_metadata. Update failed. Error message: ", e)
-        sys.exit(1)
-
-    # Unload collection
-    collection.release()
-
-    # Order entities by index
-    entities = sorted(entities, key=lambda x: x["index"])
-    # Assert that the indices are correct, i.e., the range is the same as the number of captions
-    assert len(entities) == len(captions)
-
-    # Add captions to entities
-    # Update vectors
-    for i in range(len(entities)):
-        assert (entities[i]["index"] == i)
-        entities[i]["caption"] = captions[entities[i]["index"]]
-
     # Define new name
     new_name = "temp_" + flags["collection"]
     try:
         # Create cluster collection
-        new_collection = embeddings_collection(new_name)
-        # Do for loop to avoid resource exhaustion
-        for i in range(0, len(entities), INSERT_SIZE):
-            new_collection.insert(data=entities[i:i + INSERT_SIZE])
+        new_collection = embeddings_collection(new_name, flags["index"]["type"], flags["index"]["params"])
+        # Stream the entities of the old collection, add captions and insert them in the new collection batch by batch
+        number_of_entities = 0
+        for batch in export_collection(collection, ["*"]):
+            # Add captions to entities
+            batch["caption"] = [captions[index] for index in batch["index"].tolist()]
+            entities = columns_to_rows(batch)
+            # Do for loop to avoid resource exhaustion
+            for i in range(0, len(entities), INSERT_SIZE):
+                new_collection.insert(data=entities[i:i + INSERT_SIZE])
+            number_of_entities += len(entities)
+        # Assert that every entity received a caption, i.e., the number of entities is the same as the number of
+        # captions
+        assert number_of_entities == len(captions)
         # Flush collection
         new_collection.flush()
     except Exception as e:
         print("Error in update_metadata. Update failed. Error message: ", e)
+        collection.release()
         utility.drop_collection(new_name)
         sys.exit(1)
 
+    # Unload collection
+    collection.release()
+
     # Drop old collection and rename new collection
     try:
         # Drop old collection
@@ -4,10 +4,28 @@ from pymilvus import CollectionSchema, FieldSchema, DataType, Collection
 from ..CONSTANTS import *
 
 EMBEDDING_VECTOR_FIELD_NAME = "embedding"
+EMBEDDING_DIM = 512
 ZOOM_LEVEL_VECTOR_FIELD_NAME = "tile"
 
 
-def embeddings_collection(collection_name: str):
+def get_index_config(dataset: dict) -> dict:
+    """
+    Get the index of the embeddings collection of a dataset from its "index" entry in datasets.json. Parameters that
+    are not given take the default values of the index type. Datasets without an "index" entry use a FLAT index.
+    @param dataset: the entry of the dataset in datasets.json.
+    @return: dictionary with the index type in "type", the build parameters in "params" and the search parameters in
+    "search_params".
+    """
+    index = dataset.get("index", {})
+    index_type = index.get("type", INDEX_TYPE)
+    if index_type not in INDEX_PARAMS:
+        raise ValueError(f"Index type of dataset {dataset['name']} must be one of {list(INDEX_PARAMS.keys())}.")
+    return {"type": index_type,
+            "params": {**INDEX_PARAMS[index_type], **index.get("params", {})},
+            "search_params": {**SEARCH_PARAMS[index_type], **index.get("search_params", {})}}
+
+
+def embeddings_collection(collection_name: str, index_type: str = INDEX_TYPE, index_params: dict | None = None):
     # Create fields for collection
     index = FieldSchema(
         name="index",
@@ -27,7 +45,7 @@ def embeddings_collection(collection_name: str):
     embedding = FieldSchema(
         name=EMBEDDING_VECTOR_FIELD_NAME,
         dtype=DataType.FLOAT_VECTOR,
-        dim=512
+        dim=EMBEDDING_DIM
     )
 
     # Create collection schema
@@ -47,8 +65,8 @@ def embeddings_collection(collection_name: str):
     # Create index for embedding field to make similarity search faster
     index_params = {
         "metric_type": COSINE_METRIC,
-        "index_type": INDEX_TYPE,
-        "params": {}
+        "index_type": index_type,
+        "params": index_params if index_params is not None else INDEX_PARAMS[index_type]
     }
 
     collection.create_index(
@@ -111,47 +129,6 @@ def clusters_collection(collection_name):
     return collection
 
 
-def image_to_tile_collection(collection_name: str):
-    # Create fields for collection
-    index = FieldSchema(
-        name="index",
-        dtype=DataType.INT64,
-        is_primary=True
-    )
-    tile = FieldSchema(
-        name=ZOOM_LEVEL_VECTOR_FIELD_NAME,
-        dtype=DataType.FLOAT_VECTOR,
-        dim=3
-    )
-
-    # Create collection schema
-    schema = CollectionSchema(
-        fields=[index, tile],
-        description="image_to_tile",
-        enable_dynamic_field=True
-    )
-
-    # Create collection
-    collection = Collection(
-        name=collection_name,
-        schema=schema,
-        shards_num=1  # type: ignore
-    )
-
-    index_params = {
-        "metric_type": L2_METRIC,
-        "index_type": INDEX_TYPE,
-        "params": {}
-    }
-
-    collection.create_index(
-        field_name=ZOOM_LEVEL_VECTOR_FIELD_NAME,
-        index_params=index_params
-    )
-
-    return collection
-
-
 def umap_collection(collection_name: str, dim: int):
     # Create fields for collection
     index = FieldSchema(
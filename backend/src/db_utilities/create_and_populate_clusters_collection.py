@@ -1,7 +1,11 @@
 import getopt
 import json
+import multiprocessing
 import os
 import sys
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterable, Iterator
 
 import numpy as np
 from PIL import Image
@@ -9,8 +13,10 @@ from dotenv import load_dotenv
 from pymilvus import db, Collection, utility
 from tqdm import tqdm
 
-from .collections import clusters_collection, image_to_tile_collection, ZOOM_LEVEL_VECTOR_FIELD_NAME
-from .utils import ModifiedKMeans
+from .collections import clusters_collection, ZOOM_LEVEL_VECTOR_FIELD_NAME
+from .entities import EntityTable
+from .export import export_collection
+from .utils import ModifiedKMeans, Tiling, compute_tile_ids, count_pyramid
 from .utils import create_connection
 from ..CONSTANTS import *
 
@@ -23,6 +29,12 @@ NUMBER_OF_CLUSTERS = 30
 LIMIT_FOR_TOTAL = 8000000
 LIMIT_FOR_KEEP = 4000000
 LIMIT_FOR_FETCH = 200000
+# Number of zoom levels added at each attempt when looking for the maximum zoom level
+TILING_ZOOM_STEP = 2
+# Tolerance for the convergence of k-means, relative to the variance of the coordinates in the tile
+KMEANS_TOLERANCE = 1e-4
+# Maximum number of tiles per worker submitted for clustering ahead of the tile whose results are being saved
+CLUSTERING_WINDOW_PER_WORKER = 16
 
 
 def parsing():
@@ -34,14 +46,15 @@ def parsing():
     arguments = sys.argv[1:]
 
     # Options
-    options = "hd:c:r:"
+    options = "hd:c:r:w:"
     # Long options
-    long_options = ["help", "database", "collection", "repopulate"]
+    long_options = ["help", "database", "collection", "repopulate", "workers="]
 
     # Prepare flags
     flags = {"database": DEFAULT_DATABASE_NAME,
              "collection": datasets[0]["name"],
-             "repopulate": False}
+             "repopulate": False,
+             "workers": 1}
 
     # Parsing argument
     arguments, values = getopt.getopt(arguments, options, long_options)
@@ -51,7 +64,9 @@ def parsing():
         -d or --database: database name (default={flags["database"]}).\n\
         -c or --collection: collection name (default={flags["collection"]}).\n\
         -r or --repopulate: repopulate the collection. Options are y/n (default='
-              f'{"y" if flags["repopulate"] == "y" else "n"}).')
+              f'{"y" if flags["repopulate"] == "y" else "n"}).\n\
+        -w or --workers: number of processes used for clustering the tiles of a zoom level (default='
+              f'{flags["workers"]}).')
         sys.exit(0)
 
     # Checking each argument
@@ -73,36 +88,37 @@ def parsing():
             else:
                 print("Repopulate must be either y or n.")
                 sys.exit(1)
+        elif arg in ("-w", "--workers"):
+            if int(val) >= 1:
+                flags["workers"] = int(val)
+            else:
+                print("Number of workers must be greater than 0.")
+                sys.exit(1)
 
     return flags
 
 
-def load_vectors_from_collection(collection: Collection) -> list:
+def load_vectors_from_collection(collection: Collection) -> EntityTable:
     # Load collection in memory
     collection.load()
     # Get attributes
     attributes = (["index", "path", "width", "height", "x", "y"])
 
-    # Get elements from collection
-    entities = []
+    # Get elements from collection. Each batch of results is converted to a columnar table straight away.
+    tables = []
     try:
-        for i in range(0, collection.num_entities, SEARCH_LIMIT):
-            if collection.num_entities > 0:
-                # Get SEARCH_LIMIT entities
-                query_result = collection.query(
-                    expr=f"index in {list(range(i, i + SEARCH_LIMIT))}",
-                    output_fields=attributes
-                )
-                # Add entities to the list of entities
-                entities += query_result
+        for batch in export_collection(collection, attributes):
+            # Add entities to the list of tables
+            tables.append(EntityTable.from_columns(batch))
     except Exception as e:
         print("Error in load_vectors_from_collection. Error message: ", e)
         collection.release()
         sys.exit(1)
 
     collection.release()
-    # Now entities contains all the entities in the collection, with fields 'index' and 'low_dimensional_embedding_*'
-    return entities
+    # Now the table contains all the entities in the collection, with fields 'index', 'path', 'width', 'height', 'x'
+    # and 'y'
+    return EntityTable.concatenate(tables) if len(tables) > 0 else EntityTable.from_entities([])
 
 
 def get_index_from_tile(zoom_level, tile_x, tile_y):
@@ -113,8 +129,9 @@ def get_index_from_tile(zoom_level, tile_x, tile_y):
     return index
 
 
-def insert_vectors_in_clusters_collection(zoom_levels, images_to_tile, collection: Collection, entities_per_zoom_level,
-                                          zoom_level, current_tile_x, current_tile_y, last_call=False) -> bool:
+def insert_vectors_in_clusters_collection(zoom_levels, images_to_tile, entities: EntityTable, collection: Collection,
+                                          entities_per_zoom_level, zoom_level, current_tile_x, current_tile_y,
+                                          last_call=False) -> bool:
     try:
         # Define list of entities to insert in the collection
         entities_to_insert = []
@@ -125,17 +142,11 @@ def insert_vectors_in_clusters_collection(zoom_levels, images_to_tile, collectio
                     # Check if the tile has already been inserted
                     if zoom_levels[zoom][tile_x][tile_y]["already_inserted"]:
                         continue
+                    # Representatives are rows of the table of entities. Build their dictionaries only now.
                     new_representatives = []
-                    for representative in zoom_levels[zoom][tile_x][tile_y]["representatives"]:
-                        new_representative = {
-                            "index": int(representative["representative"]["index"]),
-                            "path": str(representative["representative"]["path"]),
-                            "x": float(representative["representative"]["x"]),
-                            "y": float(representative["representative"]["y"]),
-                            "width": int(representative["representative"]["width"]),
-                            "height": int(representative["representative"]["height"]),
-                            "zoom": int(images_to_tile[representative["representative"]["index"]][0])
-                        }
+                    for row in zoom_levels[zoom][tile_x][tile_y]["representatives"]:
+                        new_representative = entities.to_dict(row)
+                        new_representative["zoom"] = int(images_to_tile[row][0])
                         new_representatives.append(new_representative)
 
                     # Create entity
@@ -228,8 +239,8 @@ def insert_vectors_in_clusters_collection(zoom_levels, images_to_tile, collectio
     return True
 
 
-def get_previously_inserted_tile(collection: Collection, prev_zoom_level: int, prev_tile_x: int, prev_tile_y: int,
-                                 zoom_levels: dict, entities_per_zoom_level: dict) -> bool:
+def get_previously_inserted_tile(collection: Collection, entities: EntityTable, prev_zoom_level: int, prev_tile_x: int,
+                                 prev_tile_y: int, zoom_levels: dict, entities_per_zoom_level: dict) -> bool:
     # Get LIMIT_FOR_FETCH tiles
     # Loop over tiles in the previous zoom level, and add index of tile if the tile is not in zoom_levels
     indexes = []
@@ -245,12 +256,13 @@ def get_previously_inserted_tile(collection: Collection, prev_zoom_level: int, p
     # Get previously inserted tile
     try:
         for i in range(0, len(indexes), SEARCH_LIMIT):
-            entities = collection.query(
+            tiles = collection.query(
                 expr=f"index in {indexes[i:i + SEARCH_LIMIT]}",
                 output_fields=[ZOOM_LEVEL_VECTOR_FIELD_NAME, "data"]
             )
-            # Add entities to zoom_levels. Use original format with representatives
-            for entity in entities:
+            # Add tiles to zoom_levels. Use the same format as for new tiles, with representatives as rows of the
+            # table of entities
+            for entity in tiles:
                 tile = entity[ZOOM_LEVEL_VECTOR_FIELD_NAME]
                 data = entity["data"]
                 if prev_zoom_level not in zoom_levels.keys():
@@ -259,7 +271,7 @@ def get_previously_inserted_tile(collection: Collection, prev_zoom_level: int, p
                     zoom_levels[prev_zoom_level][int(tile[1])] = {}
                 zoom_levels[prev_zoom_level][int(tile[1])][int(tile[2])] = {
                     "already_inserted": True,
-                    "representatives": [{"representative": representative} for representative in data]
+                    "representatives": entities.get_rows([representative["index"] for representative in data])
                 }
                 entities_per_zoom_level[prev_zoom_level] += 1
 
@@ -270,98 +282,130 @@ def get_previously_inserted_tile(collection: Collection, prev_zoom_level: int, p
         return False
 
 
-def create_image_to_tile_collection(images_to_tile: dict, zoom_levels_collection_name: str,
-                                    images_to_tile_collection_name: str):
-    # Create collection and index
-    collection = image_to_tile_collection(images_to_tile_collection_name)
-
-    # Populate collection
-    entities_to_insert = []
-    for index in images_to_tile.keys():
-        assert len(images_to_tile[index]) == 3 and isinstance(index, int)
-        # Create entity
-        entity = {
-            "index": index,
-            ZOOM_LEVEL_VECTOR_FIELD_NAME: images_to_tile[index]
-        }
-        # Insert entity
-        entities_to_insert.append(entity)
-
-    # Insert entities in the collection
-    try:
-        for i in range(0, len(entities_to_insert), INSERT_SIZE):
-            collection.insert(data=entities_to_insert[i:i + INSERT_SIZE])
-        # Flush collection
-        collection.flush()
-    except Exception as e:
-        graceful_application_shutdown(
-            f"Error in create_image_to_tile_collection. Error message: {e}",
-            zoom_levels_collection_name,
-            images_to_tile_collection_name
-        )
-
-
-def create_tiling(entities) -> tuple[list[list[list[dict]]], int]:
-    # Randomly shuffle the entities.
-    np.random.shuffle(entities)
+def create_image_to_tile_file(indexes: np.ndarray, images_to_tile: np.ndarray, path: str):
+    """
+    Save the mapping from images to tiles as a dense int32 matrix, where row i contains (zoom_level, tile_x, tile_y) for
+    the image with index i, or -1 if there is no image with index i. The API memory-maps the file and reads the tile of
+    an image directly from its row. The file replaces the previous one only once it has been written completely.
+    @param indexes: indexes of the images.
+    @param images_to_tile: matrix with one row (zoom_level, tile_x, tile_y) per image.
+    @param path: path of the file.
+    """
+    matrix = np.full((int(indexes.max()) + 1, 3), -1, dtype=np.int32)
+    matrix[indexes] = images_to_tile
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Pass a file object, since np.save appends .npy to the temporary path
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, matrix)
+    os.replace(path + ".tmp", path)
+
+
+def create_tiling(entities: EntityTable) -> tuple[Tiling, int]:
+    # Randomly shuffle the entities. The tiling refers to rows of the table, but the entities in a tile are in the
+    # shuffled order.
+    permutation = np.random.permutation(len(entities))
+
+    # Get coordinates of the entities
+    x = entities.x[permutation]
+    y = entities.y[permutation]
 
     # Find the maximum and minimum values for each dimension
-    max_values = {"x": max([entity["x"] for entity in entities]), "y": max([entity["y"] for entity in entities])}
-    min_values = {"x": min([entity["x"] for entity in entities]), "y": min([entity["y"] for entity in entities])}
+    max_values = {"x": x.max(), "y": y.max()}
+    min_values = {"x": x.min(), "y": y.min()}
+
+    # Find zoom level that allows to have tiles with at most MAX_IMAGES_PER_TILE images. At zoom level z there are
+    # 4 ** z tiles, so no zoom level below lower_bound can work. Count the images per tile at a zoom level above the
+    # lower bound, and get the counts for all the coarser zoom levels by summing blocks of 2x2 tiles.
+    lower_bound = 0
+    while 4 ** lower_bound * MAX_IMAGES_PER_TILE < len(entities):
+        lower_bound += 1
+    top_zoom_level = lower_bound + TILING_ZOOM_STEP
+    while True:
+        tile_x, tile_y = compute_tile_ids(x, y, min_values, max_values, 2 ** top_zoom_level)
+        pyramid = count_pyramid(tile_x, tile_y, top_zoom_level)
+        valid_zoom_levels = [zoom_level for zoom_level in range(lower_bound, top_zoom_level + 1)
+                             if pyramid[zoom_level].max() <= MAX_IMAGES_PER_TILE]
+        if len(valid_zoom_levels) > 0:
+            max_zoom_level = valid_zoom_levels[0]
+            break
+        else:
+            top_zoom_level += TILING_ZOOM_STEP
 
-    # Find zoom level that allows to have tiles with at most MAX_IMAGES_PER_TILE images.
-    max_zoom_level = 0
+    # Associate each entity to a tile at the maximum zoom level.
     while True:
-        # Define grid for entire embeddings space.
-        number_of_tiles = 2 ** max_zoom_level
-        grid = [[[] for _ in range(number_of_tiles)] for _ in range(number_of_tiles)]
-
-        # Associate each entity to a tile.
-        for entity in entities:
-            # Shift the values by the minimum value of both dimensions so that the minimum value is 0
-            x = entity["x"] - min_values["x"]
-            y = entity["y"] - min_values["y"]
-
-            # Find the tile to which the entity belongs.
-            tile_x = min(int((x * number_of_tiles) // (max_values["x"] - min_values["x"])),
-                         number_of_tiles - 1)
-            tile_y = min(int((y * number_of_tiles) // (max_values["y"] - min_values["y"])),
-                         number_of_tiles - 1)
-
-            # Add entity to the tile
-            grid[tile_x][tile_y].append(entity)
-
-        # Check if the number of images in each tile is less than MAX_IMAGES_PER_TILE
-        max_images_per_tile = 0
-        tot_images = 0
-        for row in grid:
-            for tile in row:
-                if len(tile) > max_images_per_tile:
-                    max_images_per_tile = len(tile)
-                tot_images += len(tile)
-
-        assert tot_images == len(entities)
-
-        if max_images_per_tile <= MAX_IMAGES_PER_TILE:
+        tile_x, tile_y = compute_tile_ids(x, y, min_values, max_values, 2 ** max_zoom_level)
+        grid = Tiling(tile_x * 2 ** max_zoom_level + tile_y, 2 ** max_zoom_level)
+        assert grid.offsets[-1] == len(entities)
+        # Guard against rounding differences between zoom levels
+        if grid.counts.max() <= MAX_IMAGES_PER_TILE:
             break
         else:
             max_zoom_level += 1
 
+    # Map positions in the shuffled order back to rows of the table
+    grid.order = permutation[grid.order]
+
     # Return grid
     return grid, max_zoom_level
 
 
-def graceful_application_shutdown(message: str, zoom_levels_collection_name: str, images_to_tile_collection_name: str):
+def graceful_application_shutdown(message: str, zoom_levels_collection_name: str):
     print(message)
-    # Drop collections
+    # Drop collection
     if utility.has_collection(zoom_levels_collection_name):
         utility.drop_collection(zoom_levels_collection_name)
-    if utility.has_collection(images_to_tile_collection_name):
-        utility.drop_collection(images_to_tile_collection_name)
     sys.exit(1)
 
 
-def create_zoom_levels(entities, zoom_levels_collection_name, images_to_tile_collection_name):
+def cluster_tile(job: tuple[np.ndarray, np.ndarray | None]) -> tuple[np.ndarray, np.ndarray, np.ndarray, int, float]:
+    """
+    Cluster the entities of a tile. The function can run in a worker process, so it only receives coordinates.
+    @param job: coordinates of the entities in the tile, and coordinates of the fixed centers (None if there are none).
+    @return: the cluster centers, the number of entities in each cluster, the position of the entity closest to each
+    center, the number of k-means iterations and the inertia.
+    """
+    coordinates, fixed_centers = job
+    kmeans = ModifiedKMeans(n_clusters=NUMBER_OF_CLUSTERS, random_state=0, n_init=1, max_iter=1000,
+                            tol=KMEANS_TOLERANCE)
+    kmeans.fit(coordinates, fixed_centers=fixed_centers)
+    number_of_entities, closest_entities = kmeans.get_representatives(coordinates)
+    return kmeans.cluster_centers_, number_of_entities, closest_entities, kmeans.n_iter_, float(kmeans.inertia_)
+
+
+def cluster_tiles_in_order(tiles: Iterable[tuple], executor: ProcessPoolExecutor | None,
+                           window: int) -> Iterator[tuple]:
+    """
+    Cluster tiles in a pool of workers, keeping the order of the tiles.
+    @param tiles: pairs (tile, job), where job is the argument of cluster_tile, or None if the tile is not clustered.
+    @param executor: pool of workers. If None, each tile is clustered in this process before it is returned.
+    @param window: maximum number of jobs submitted ahead of the tile being returned.
+    @return: pairs (tile, future) in the order of the tiles, where future holds the result of cluster_tile, or is None
+    if the tile is not clustered.
+    """
+    pending = deque()
+    submitted = 0
+    for tile, job in tiles:
+        future = None
+        if job is not None:
+            if executor is None:
+                future = Future()
+                try:
+                    future.set_result(cluster_tile(job))
+                except Exception as e:
+                    future.set_exception(e)
+            else:
+                future = executor.submit(cluster_tile, job)
+            submitted += 1
+        pending.append((tile, future))
+        while pending and (executor is None or submitted >= window):
+            tile, future = pending.popleft()
+            submitted -= future is not None
+            yield tile, future
+    while pending:
+        yield pending.popleft()
+
+
+def create_zoom_levels(entities: EntityTable, zoom_levels_collection_name, image_to_tile_path, workers=1):
     # Take entire embedding space for zoom level 0, then divide each dimension into 2^zoom_levels intervals.
     # Each interval is a tile. For each tile, find clusters and cluster representatives. Keep track of
     # the number of entities in each cluster. For the last zoom level, show all the entities in each tile.
@@ -385,32 +429,111 @@ def create_zoom_levels(entities, zoom_levels_collection_name, images_to_tile_col
     zoom_levels = {}
     # Define dictionary for number of entities in zoom level
     entities_per_zoom_level = {}
-    # Define dictionary for mapping from images to coarser zoom level (and tile)
-    images_to_tile = {}
+    # Define array for mapping from images to coarser zoom level (and tile). Row i contains (zoom_level, tile_x, tile_y)
+    # for the entity at row i of the table of entities, or -1 if the entity has not been assigned to a tile yet.
+    images_to_tile = np.full((len(entities), 3), -1, dtype=np.int64)
 
     # Load the collection of zoom levels
     zoom_levels_collection.load()
 
-    for zoom_level in tqdm(range(0, max_zoom_level + 1), desc="Zoom level", position=0):
-        zoom_levels[zoom_level] = {}
-        entities_per_zoom_level[zoom_level] = 0
-        # First tile goes from 0 to 2 ** (max_zoom_level - zoom_level) - 1, second tile goes from
-        # 2 ** (max_zoom_level - zoom_level) to 2 ** (max_zoom_level - zoom_level) * 2 - 1, and so on.
-        for tile_x in tqdm(range(0, 2 ** max_zoom_level, 2 ** (max_zoom_level - zoom_level)), desc="Tile x",
-                           position=1, leave=False):
-            # Get index of tile along x-axis
-            tile_x_index = int(tile_x // 2 ** (max_zoom_level - zoom_level))
-            zoom_levels[zoom_level][tile_x_index] = {}
-
-            for tile_y in tqdm(range(0, 2 ** max_zoom_level, 2 ** (max_zoom_level - zoom_level)), desc="Tile y",
-                               position=2, leave=False):
-                # Get index of tile along y-axis
-                tile_y_index = int(tile_y // 2 ** (max_zoom_level - zoom_level))
+    # Create pool of workers for clustering the tiles. With a single worker, tiles are clustered in this process.
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    try:
+        for zoom_level in tqdm(range(0, max_zoom_level + 1), desc="Zoom level", position=0):
+            zoom_levels[zoom_level] = {}
+            entities_per_zoom_level[zoom_level] = 0
+            # Define lists for k-means statistics of the tiles in the zoom level
+            iterations_per_tile = []
+            inertia_per_tile = []
+
+            def get_tiles_of_zoom_level():
+                """
+                Get the tiles of the zoom level in order along x and y, with the rows of their entities, the old
+                cluster representatives in the tile and the clustering job of the tile (None if the tile has at most
+                MAX_IMAGES_PER_TILE entities). Workers only receive the coordinates of the entities and of the fixed
+                centers.
+                """
+                # First tile goes from 0 to 2 ** (max_zoom_level - zoom_level) - 1, second tile goes from
+                # 2 ** (max_zoom_level - zoom_level) to 2 ** (max_zoom_level - zoom_level) * 2 - 1, and so on.
+                tile_size = 2 ** (max_zoom_level - zoom_level)
+                for tile_x in range(0, 2 ** max_zoom_level, tile_size):
+                    # Get index of tile along x-axis
+                    tile_x_index = int(tile_x // tile_size)
+                    for tile_y in range(0, 2 ** max_zoom_level, tile_size):
+                        # Get index of tile along y-axis
+                        tile_y_index = int(tile_y // tile_size)
+
+                        # Get all entities in the current tile.
+                        entities_in_tile = tiling.get_entities_in_tile(tile_x, tile_y, tile_size)
+
+                        # Get cluster representatives that where selected in the previous zoom level and are in the
+                        # current tile.
+                        # First, get index of tile from the previous zoom level which contains the current tile
+                        prev_level_x = int(tile_x_index // 2)
+                        prev_level_y = int(tile_y_index // 2)
+
+                        # Get cluster representatives from previous zoom level
+                        old_cluster_representatives_in_current_tile = np.zeros(0, dtype=np.int64)
+                        if zoom_level != 0:
+                            if not (zoom_level - 1 in zoom_levels
+                                    and prev_level_x in zoom_levels[zoom_level - 1].keys()
+                                    and prev_level_y in zoom_levels[zoom_level - 1][prev_level_x].keys()):
+                                # Get cluster representatives from the collection
+                                result = get_previously_inserted_tile(
+                                    zoom_levels_collection, entities, zoom_level - 1, prev_level_x, prev_level_y,
+                                    zoom_levels, entities_per_zoom_level
+                                )
+                                if not result:
+                                    # Shut down application
+                                    graceful_application_shutdown(
+                                        "Could not get previously inserted tile.",
+                                        zoom_levels_collection_name
+                                    )
+
+                            previous_zoom_level_cluster_representatives = \
+                                zoom_levels[zoom_level - 1][prev_level_x][prev_level_y]["representatives"]
+
+                            # Get cluster representatives that are in the current tile, in the order they had in
+                            # the previous zoom level.
+                            old_cluster_representatives_in_current_tile = \
+                                previous_zoom_level_cluster_representatives[
+                                    np.isin(previous_zoom_level_cluster_representatives, entities_in_tile)
+                                ]
+
+                        job = None
+                        if len(entities_in_tile) > MAX_IMAGES_PER_TILE:
+                            coordinates = np.column_stack((entities.x[entities_in_tile], entities.y[entities_in_tile]))
+                            fixed_centers = None
+                            if len(old_cluster_representatives_in_current_tile) > 0:
+                                fixed_centers = np.column_stack((
+                                    entities.x[old_cluster_representatives_in_current_tile],
+                                    entities.y[old_cluster_representatives_in_current_tile]
+                                ))
+                            job = (coordinates, fixed_centers)
+                        yield (tile_x_index, tile_y_index, entities_in_tile,
+                               old_cluster_representatives_in_current_tile), job
+
+            # Tiles are independent once the representatives of the previous zoom level are known, so all the tiles of
+            # the zoom level are clustered in the pool of workers, across columns. The results are saved in order along
+            # x and y, which the insertion in the collection and the freeing of the zoom_levels dictionary rely on.
+            # Tiles are prepared lazily and at most CLUSTERING_WINDOW_PER_WORKER jobs per worker are submitted ahead of
+            # the tile being saved, so the coordinates sent to the workers and the results waiting to be saved do not
+            # grow with the number of tiles of the zoom level.
+            tiles = cluster_tiles_in_order(get_tiles_of_zoom_level(), executor, CLUSTERING_WINDOW_PER_WORKER * workers)
+            for (tile_x_index, tile_y_index, entities_in_tile, old_cluster_representatives_in_current_tile), \
+                    clustering in tqdm(tiles, total=4 ** zoom_level, desc="Tile", position=1, leave=False):
+                if tile_x_index not in zoom_levels[zoom_level].keys():
+                    zoom_levels[zoom_level][tile_x_index] = {}
+
                 # Flush if necessary
-                if sum([entities_per_zoom_level[zoom] for zoom in entities_per_zoom_level.keys()]) >= LIMIT_FOR_TOTAL:
+                if (sum([entities_per_zoom_level[zoom] for zoom in entities_per_zoom_level.keys()])
+                        >= LIMIT_FOR_TOTAL):
                     # Insert data in collection
                     result = insert_vectors_in_clusters_collection(
-                        zoom_levels, images_to_tile, zoom_levels_collection, entities_per_zoom_level,
+                        zoom_levels, images_to_tile, entities, zoom_levels_collection, entities_per_zoom_level,
                         zoom_level, tile_x_index, tile_y_index
                     )
                     if result:
@@ -422,179 +545,67 @@ def create_zoom_levels(entities, zoom_levels_collection_name, images_to_tile_col
                         # Shut down application
                         graceful_application_shutdown(
                             "Could not insert data in collection.",
-                            zoom_levels_collection_name,
-                            images_to_tile_collection_name
+                            zoom_levels_collection_name
                         )
 
-                # Get all entities in the current tile.
-                entities_in_tile = []
-                count = 0
-                for x in range(tile_x, tile_x + 2 ** (max_zoom_level - zoom_level)):
-                    for y in range(tile_y, tile_y + 2 ** (max_zoom_level - zoom_level)):
-                        # Get all entities in the tile
-                        entities_in_tile += tiling[x][y]
-                        count += 1
-
-                assert count == 4 ** (max_zoom_level - zoom_level)
-
-                # Get cluster representatives that where selected in the previous zoom level and are in the current
-                # tile.
-                # First, get index of tile from the previous zoom level which contains the current tile
-                prev_level_x = int(tile_x_index // 2)
-                prev_level_y = int(tile_y_index // 2)
-
-                # Get cluster representatives from previous zoom level
-                old_cluster_representatives_in_current_tile = []
-                if zoom_level != 0:
-                    if not (zoom_level - 1 in zoom_levels and prev_level_x in zoom_levels[zoom_level - 1].keys()
-                            and prev_level_y in zoom_levels[zoom_level - 1][prev_level_x].keys()):
-                        # Get cluster representatives from the collection
-                        result = get_previously_inserted_tile(
-                            zoom_levels_collection, zoom_level - 1, prev_level_x, prev_level_y, zoom_levels,
-                            entities_per_zoom_level
-                        )
-                        if not result:
-                            # Shut down application
-                            graceful_application_shutdown(
-                                "Could not get previously inserted tile.",
-                                zoom_levels_collection_name,
-                                images_to_tile_collection_name
-                            )
-
-                    previous_zoom_level_cluster_representatives = [representative["representative"] for
-                                                                   representative in zoom_levels[zoom_level - 1]
-                                                                   [prev_level_x][prev_level_y]["representatives"]]
-
-                    # Get cluster representatives that are in the current tile.
-                    # old_cluster_representatives_in_current_tile must be cluster representatives in the current tile.
-                    for representative in previous_zoom_level_cluster_representatives:
-                        for entity in entities_in_tile:
-                            if entity["index"] == representative["index"]:
-                                old_cluster_representatives_in_current_tile.append(representative)
-                                break
-
-                # Define vector of representative entities
-                representative_entities = []
                 # Check if there are less than MAX_IMAGES_PER_TILE images in the tile.
                 if len(entities_in_tile) <= MAX_IMAGES_PER_TILE:
-                    for entity in entities_in_tile:
-                        # Check if the entity is in the previous zoom level
-                        in_previous = False
-                        for old_rep in old_cluster_representatives_in_current_tile:
-                            if entity["index"] == old_rep["index"]:
-                                in_previous = True
-                                break
-                        representative_entities.append(
-                            {
-                                "representative": entity,
-                                "number_of_entities": 0,
-                                "in_previous": in_previous
-                            }
-                        )
-
-                    # Check if all the elements in old_cluster_representatives_in_current_tile have in_previous
-                    # set to True.
-                    indexes = [old_rep["index"] for old_rep in old_cluster_representatives_in_current_tile]
-                    count = 0
-                    for rep in representative_entities:
-                        if rep["representative"]["index"] in indexes:
-                            count += 1
-                            assert rep["in_previous"]
-                        else:
-                            assert not rep["in_previous"]
-                    assert count == len(old_cluster_representatives_in_current_tile)
-
-                    assert (sum([cluster["number_of_entities"] + 1 for cluster in representative_entities])
-                            == len(entities_in_tile))
+                    # All the entities are representatives
+                    representative_entities = entities_in_tile
+                    number_of_entities = np.zeros(len(entities_in_tile), dtype=np.int64)
+                    # Check which entities are in the previous zoom level
+                    in_previous = np.isin(entities_in_tile, old_cluster_representatives_in_current_tile)
 
                 else:
-                    # Get the coordinates of the entities in the tile
-                    coordinates = np.array([[entity["x"], entity["y"]] for entity in entities_in_tile])
-
-                    # Perform clustering
-                    kmeans = ModifiedKMeans(n_clusters=NUMBER_OF_CLUSTERS, random_state=0, n_init=1, max_iter=1000)
-
-                    if len(old_cluster_representatives_in_current_tile) > 0:
-                        fixed_centers = np.array([[entity["x"], entity["y"]] for entity in
-                                                  old_cluster_representatives_in_current_tile])
-                    else:
-                        fixed_centers = None
-
+                    # Get the coordinates of the cluster representatives, the number of entities in each cluster
+                    # and the entity closest to the centroid of each cluster
                     try:
-                        kmeans.fit(coordinates, fixed_centers=fixed_centers)
+                        (cluster_representatives, number_of_entities_in_cluster, closest_entities, n_iter,
+                         inertia) = clustering.result()
                     except Exception as e:
                         graceful_application_shutdown(
                             f"Error in kmeans.fit. Error message: {e}",
-                            zoom_levels_collection_name,
-                            images_to_tile_collection_name
+                            zoom_levels_collection_name
                         )
-
-                    # Get the coordinates of the cluster representatives
-                    cluster_representatives = kmeans.cluster_centers_
+                    iterations_per_tile.append(n_iter)
+                    inertia_per_tile.append(inertia)
 
                     # Assert that the number of cluster representatives is equal to NUMBER_OF_CLUSTERS
                     assert len(cluster_representatives) == NUMBER_OF_CLUSTERS
 
-                    # Check that the first len(old_cluster_representatives_in_current_tile) cluster_representatives are
-                    # the same as the old_cluster_representatives_in_current_tile
-                    for i in range(len(old_cluster_representatives_in_current_tile)):
-                        assert (old_cluster_representatives_in_current_tile[i]["x"] == cluster_representatives[i][0])
-                        assert (old_cluster_representatives_in_current_tile[i]["y"] == cluster_representatives[i][1])
-
-                    # Find the entity closest to the centroid of each cluster
-                    temp_cluster_representatives_entities = []
-                    num_entities = 0
-                    for cluster in range(NUMBER_OF_CLUSTERS):
-                        # Get the entities in the cluster
-                        entities_in_cluster = [entity for entity in entities_in_tile
-                                               if kmeans.predict(np.array([[entity["x"], entity["y"]]]))[0] == cluster]
-                        num_entities += len(entities_in_cluster)
-
-                        if cluster < len(old_cluster_representatives_in_current_tile):
-                            # Add old cluster representative to temp_cluster_representatives_entities
-                            temp_cluster_representatives_entities.append(
-                                {
-                                    "representative": old_cluster_representatives_in_current_tile[cluster],
-                                    "number_of_entities": len(entities_in_cluster) - 1,
-                                    "in_previous": True
-                                }
-                            )
-
-                        else:
-                            # Get the entity closest to the centroid of the cluster
-                            def l2(entity):
-                                return ((entity["x"] - cluster_representatives[cluster][0]) ** 2
-                                        + (entity["y"] - cluster_representatives[cluster][1]) ** 2)
-
-                            temp_cluster_representatives_entities.append(
-                                {
-                                    "representative": min(entities_in_cluster, key=l2),
-                                    "number_of_entities": len(entities_in_cluster) - 1,
-                                    "in_previous": False
-                                }
-                            )
-
-                    assert num_entities == len(entities_in_tile)
-
-                    representative_entities = temp_cluster_representatives_entities
-
-                    # Check if the all the element in old_cluster_representatives_in_current_tile have in_previous
-                    # set to True.
-                    indexes = [old_rep["index"] for old_rep in old_cluster_representatives_in_current_tile]
-                    count = 0
-                    for rep in representative_entities:
-                        if rep["representative"]["index"] in indexes:
-                            count += 1
-                            assert rep["in_previous"]
-                        else:
-                            assert not rep["in_previous"]
-
-                    assert count == len(old_cluster_representatives_in_current_tile)
-
-                    assert (sum([cluster["number_of_entities"] + 1 for cluster in representative_entities])
-                            == len(entities_in_tile))
-
-                # Save information for tile in zoom_levels. Cluster representatives are the entities themselves.
+                    # Check that the first len(old_cluster_representatives_in_current_tile) cluster_representatives
+                    # are the same as the old_cluster_representatives_in_current_tile
+                    number_of_old_representatives = len(old_cluster_representatives_in_current_tile)
+                    assert np.array_equal(entities.x[old_cluster_representatives_in_current_tile],
+                                          cluster_representatives[:number_of_old_representatives, 0])
+                    assert np.array_equal(entities.y[old_cluster_representatives_in_current_tile],
+                                          cluster_representatives[:number_of_old_representatives, 1])
+
+                    # Old cluster representatives stay representatives of their clusters. For the other
+                    # clusters, the representative is the entity closest to the centroid.
+                    if np.any(closest_entities[number_of_old_representatives:] < 0):
+                        graceful_application_shutdown(
+                            "Found cluster with no entities.",
+                            zoom_levels_collection_name
+                        )
+                    representative_entities = np.concatenate((
+                        old_cluster_representatives_in_current_tile,
+                        entities_in_tile[closest_entities[number_of_old_representatives:]]
+                    ))
+                    number_of_entities = number_of_entities_in_cluster - 1
+                    in_previous = np.arange(NUMBER_OF_CLUSTERS) < number_of_old_representatives
+
+                    assert number_of_entities_in_cluster.sum() == len(entities_in_tile)
+
+                # Check if all the elements in old_cluster_representatives_in_current_tile have in_previous
+                # set to True.
+                assert np.array_equal(np.isin(representative_entities,
+                                              old_cluster_representatives_in_current_tile), in_previous)
+                assert np.sum(in_previous) == len(old_cluster_representatives_in_current_tile)
+                assert np.sum(number_of_entities + 1) == len(entities_in_tile)
+
+                # Save information for tile in zoom_levels. Cluster representatives are rows of the table of
+                # entities.
                 zoom_levels[zoom_level][tile_x_index][tile_y_index] = {}
                 zoom_levels[zoom_level][tile_x_index][tile_y_index]["representatives"] = representative_entities
                 zoom_levels[zoom_level][tile_x_index][tile_y_index]["already_inserted"] = False
@@ -602,33 +613,45 @@ def create_zoom_levels(entities, zoom_levels_collection_name, images_to_tile_col
 
                 if zoom_level == 0:
                     zoom_levels[zoom_level][tile_x_index][tile_y_index]["range"] = {
-                        "x_min": min([entity["x"] for entity in entities_in_tile]),
-                        "x_max": max([entity["x"] for entity in entities_in_tile]),
-                        "y_min": min([entity["y"] for entity in entities_in_tile]),
-                        "y_max": max([entity["y"] for entity in entities_in_tile])
+                        "x_min": entities.x[entities_in_tile].min(),
+                        "x_max": entities.x[entities_in_tile].max(),
+                        "y_min": entities.y[entities_in_tile].min(),
+                        "y_max": entities.y[entities_in_tile].max()
                     }
 
-                # Save mapping from images to tile
-                for representative in representative_entities:
-                    if representative["representative"]["index"] not in images_to_tile:
-                        images_to_tile[representative["representative"]["index"]] = [
-                            zoom_level, tile_x_index, tile_y_index
-                        ]
+                # Save mapping from images to tile for the representatives that do not have a tile yet
+                new_representatives = representative_entities[images_to_tile[representative_entities, 0] < 0]
+                images_to_tile[new_representatives] = [zoom_level, tile_x_index, tile_y_index]
+
+            # Report k-means statistics for the zoom level
+            if len(iterations_per_tile) > 0:
+                tqdm.write(f"Zoom level {zoom_level}: {len(iterations_per_tile)} tiles clustered. Iterations per "
+                           f"tile: mean {np.mean(iterations_per_tile):.1f}, max {np.max(iterations_per_tile)}. "
+                           f"Mean inertia per tile: {np.mean(inertia_per_tile):.4f}.")
+
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     # Do a final insert in the collection
     result = insert_vectors_in_clusters_collection(
-        zoom_levels, images_to_tile, zoom_levels_collection, entities_per_zoom_level, -1, -1, -1, True
+        zoom_levels, images_to_tile, entities, zoom_levels_collection, entities_per_zoom_level, -1, -1, -1, True
     )
     if not result:
         # Shut down application
         graceful_application_shutdown(
             "Could not insert data in collection.",
-            zoom_levels_collection_name,
-            images_to_tile_collection_name
+            zoom_levels_collection_name
         )
 
     zoom_levels_collection.release()
-    create_image_to_tile_collection(images_to_tile, zoom_levels_collection_name, images_to_tile_collection_name)
+    # Every entity is a representative at the maximum zoom level, so every entity has a tile
+    assert np.all(images_to_tile >= 0)
+    try:
+        create_image_to_tile_file(entities.index, images_to_tile, image_to_tile_path)
+    except Exception as e:
+        graceful_application_shutdown(f"Error in create_image_to_tile_file. Error message: {e}",
+                                      zoom_levels_collection_name)
 
 
 def check_if_collection_exists(collection_name: str, repopulate: bool):
@@ -662,12 +685,14 @@ if __name__ == "__main__":
         print("Error in main. Connection failed. Error: ", e)
         sys.exit(1)
 
-    # Define collection names
+    # Define collection name and path of the mapping from images to tiles
     zoom_levels_collection_name = flags["collection"] + "_zoom_levels_clusters"
-    images_to_tile_collection_name = flags["collection"] + "_image_to_tile"
-    # Check if collections exist
+    image_to_tile_path = os.path.join(os.getenv(HOME), DATA_DIR_NAME, flags["collection"], IMAGE_TO_TILE_FILE_NAME)
+    # Check if collection exists
     check_if_collection_exists(zoom_levels_collection_name, flags["repopulate"])
-    check_if_collection_exists(images_to_tile_collection_name, flags["repopulate"])
+    # The mapping from images to tiles used to be saved in a collection, which is replaced by the file
+    if utility.has_collection(flags["collection"] + "_image_to_tile"):
+        utility.drop_collection(flags["collection"] + "_image_to_tile")
 
     # Check that embeddings collection exists. If the collection does not exist, return.
     if flags["collection"] not in utility.list_collections():
@@ -680,8 +705,8 @@ if __name__ == "__main__":
     entities = load_vectors_from_collection(collection)
 
     # Create zoom levels
-    if entities is not None:
-        create_zoom_levels(entities, zoom_levels_collection_name, images_to_tile_collection_name)
+    if len(entities) > 0:
+        create_zoom_levels(entities, zoom_levels_collection_name, image_to_tile_path, flags["workers"])
     else:
         print(f"No entities found in the collection {flags['collection']}.")
         sys.exit(1)
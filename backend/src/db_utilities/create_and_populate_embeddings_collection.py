@@ -5,13 +5,14 @@ import sys
 import warnings
 
 import PIL.Image
-import torch
+import numpy as np
 from dotenv import load_dotenv
 from pymilvus import utility, db, Collection
 
 from .DatasetPreprocessor import DatasetPreprocessor
-from .collections import embeddings_collection, EMBEDDING_VECTOR_FIELD_NAME
+from .collections import embeddings_collection, get_index_config, EMBEDDING_VECTOR_FIELD_NAME, EMBEDDING_DIM
 from .datasets import get_dataset_object
+from .export import export_collection, columns_to_rows
 from .utils import create_connection
 from ..CONSTANTS import *
 from ..embeddings_model.CLIPEmbeddings import ClipEmbeddings
@@ -28,14 +29,14 @@ def parsing():
     arguments = sys.argv[1:]
 
     # Options
-    options = "hd:c:b:r:"
+    options = "hd:c:b:r:u:w:"
 
     # Long options
-    long_options = ["help", "database", "collection", "batch_size", "repopulate"]
+    long_options = ["help", "database", "collection", "batch_size", "repopulate", "resume=", "workers="]
 
     # Prepare flags
     flags = {"database": DEFAULT_DATABASE_NAME, "dataset": datasets[0]["name"],
-             "batch_size": BATCH_SIZE, "repopulate": False}
+             "batch_size": BATCH_SIZE, "repopulate": False, "resume": False, "workers": NUM_WORKERS}
 
     # Parsing argument
     arguments, values = getopt.getopt(arguments, options, long_options)
@@ -46,7 +47,11 @@ def parsing():
         -c or --collection: dataset (default={flags["dataset"]}).\n\
         -b or --batch_size: batch size used for loading the dataset (default={BATCH_SIZE}).\n\
         -r or --repopulate: whether to empty the database and repopulate. Type y for repopulating the store, '
-              f'n otherwise (default={"n" if not flags["repopulate"] else "y"}).')
+              f'n otherwise (default={"n" if not flags["repopulate"] else "y"}).\n\
+        -u or --resume: whether to resume the generation of the embeddings from the last checkpoint. Type y for '
+              f'resuming, n otherwise (default={"n" if not flags["resume"] else "y"}).\n\
+        -w or --workers: number of worker processes used for loading and preprocessing the images. Use 0 for loading '
+              f'them in the main process (default={flags["workers"]}).')
         sys.exit()
 
     # Checking each argument
@@ -73,10 +78,97 @@ def parsing():
             else:
                 print("Repopulate must be either y or n.")
                 sys.exit(1)
+        elif arg in ("-u", "--resume"):
+            if val.lower() == "y":
+                flags["resume"] = True
+            elif val.lower() == "n":
+                flags["resume"] = False
+            else:
+                print("Resume must be either y or n.")
+                sys.exit(1)
+        elif arg in ("-w", "--workers"):
+            if int(val) >= 0:
+                flags["workers"] = int(val)
+            else:
+                print("Number of workers must be greater than or equal to 0.")
+                sys.exit(1)
+
+    # Get the index of the collection of the dataset
+    try:
+        flags["index"] = get_index_config(next(d for d in datasets if d["name"] == flags["dataset"]))
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
 
     return flags
 
 
+class Checkpoint:
+    """
+    Progress of the generation of the embeddings of a dataset. The checkpoint file contains the index of the first
+    sample that has not been processed yet, and the sidecar file contains the samples that have been skipped because
+    they could not be loaded, with the error message. Samples are processed in order of index.
+    """
+
+    def __init__(self, directory: str, number_of_samples: int, batch_size: int):
+        self.checkpoint_path = os.path.join(directory, CHECKPOINT_FILE_NAME)
+        self.skipped_path = os.path.join(directory, SKIPPED_FILE_NAME)
+        self.number_of_samples = number_of_samples
+        self.batch_size = batch_size
+        # Index of the first sample processed in this run, and index of the first sample not processed yet
+        self.start_index = 0
+        self.next_index = 0
+        self.skipped = []
+
+    @staticmethod
+    def _write_json(path: str, content):
+        # Write to a temporary file and rename it, so that an interruption never leaves a truncated file
+        with open(path + ".tmp", "w") as f:
+            json.dump(content, f)
+        os.replace(path + ".tmp", path)
+
+    def load(self) -> bool:
+        """
+        Load the checkpoint from disk.
+        @return: True if a checkpoint for a dataset with the same number of samples was found, False otherwise.
+        """
+        if not (os.path.exists(self.checkpoint_path) and os.path.exists(self.skipped_path)):
+            return False
+        with open(self.checkpoint_path, "r") as f:
+            checkpoint = json.load(f)
+        if checkpoint["number_of_samples"] != self.number_of_samples:
+            return False
+        with open(self.skipped_path, "r") as f:
+            self.skipped = json.load(f)
+        self.start_index = checkpoint["next_index"]
+        self.next_index = checkpoint["next_index"]
+        return True
+
+    def save(self, batch_number: int = -1, skipped: list | None = None):
+        """
+        Save the checkpoint after a batch has been processed. Without arguments, save the current state.
+        @param batch_number: number of the batch in the dataloader of this run.
+        @param skipped: samples of the batch that have been skipped, or None if the whole batch could not be loaded.
+        """
+        if batch_number >= 0:
+            first_index = self.start_index + batch_number * self.batch_size
+            self.next_index = min(first_index + self.batch_size, self.number_of_samples)
+            if skipped is None:
+                skipped = [{"index": index, "path": None, "error": "Batch could not be loaded."}
+                           for index in range(first_index, self.next_index)]
+        if batch_number < 0 or len(skipped) > 0:
+            self.skipped += skipped if skipped is not None else []
+            self._write_json(self.skipped_path, self.skipped)
+        self._write_json(self.checkpoint_path, {"next_index": self.next_index,
+                                                "number_of_samples": self.number_of_samples})
+
+    def get_embedded_indexes(self) -> np.ndarray:
+        """
+        @return: sorted indexes of the samples that have been embedded so far.
+        """
+        return np.setdiff1d(np.arange(self.next_index), [sample["index"] for sample in self.skipped])
+
+
 def modify_data(data: dict) -> list:
     # Get data keys
     keys = list(data.keys())
@@ -116,33 +208,96 @@ def modify_data(data: dict) -> list:
     return new_data
 
 
-def generate_low_dimensional_embeddings(entities: list, dp: DatasetPreprocessor, collection_name: str):
-    # Process records
-    embeddings = torch.tensor([entities[i][EMBEDDING_VECTOR_FIELD_NAME] for i in range(len(entities))]).detach()
+def create_embeddings_file(directory: str, number_of_samples: int, resume: bool = False) -> np.memmap:
+    """
+    Create the memory-mapped float32 matrix where the embeddings of the dataset are written. Row i contains the
+    embedding of the sample with index i. The API memory-maps the embeddings file, so a new matrix is written to a
+    temporary file, which replaces the embeddings file in finalize_embeddings_file.
+    @param directory: data directory of the dataset.
+    @param number_of_samples: number of samples in the dataset.
+    @param resume: if True, open the matrix of the interrupted run instead of creating a new one. This is the temporary
+    file if it exists, and the embeddings file otherwise.
+    @return: the memory-mapped matrix.
+    """
+    path = os.path.join(directory, EMBEDDINGS_FILE_NAME)
+    if resume:
+        if os.path.exists(path + ".tmp"):
+            path += ".tmp"
+        embeddings = np.lib.format.open_memmap(path, mode="r+")
+        if embeddings.shape != (number_of_samples, EMBEDDING_DIM) or embeddings.dtype != np.float32:
+            print(f"The embeddings file {path} does not match the dataset. Run again without resuming.")
+            sys.exit(1)
+        return embeddings
+    return np.lib.format.open_memmap(path + ".tmp", mode="w+", dtype=np.float32,
+                                     shape=(number_of_samples, EMBEDDING_DIM))
+
+
+def finalize_embeddings_file(embeddings: np.memmap, directory: str):
+    """
+    Replace the embeddings file with the matrix written by this run, once all the embeddings have been generated.
+    Readers that have memory-mapped the previous file keep reading it until they open the file again.
+    @param embeddings: the matrix returned by create_embeddings_file.
+    @param directory: data directory of the dataset.
+    """
+    embeddings.flush()
+    path = os.path.join(directory, EMBEDDINGS_FILE_NAME)
+    if os.path.abspath(embeddings.filename) == os.path.abspath(path):
+        # The embeddings file was updated in place by a resumed run
+        return
+    # Remove the nearest neighbors computed from the previous embeddings
+    for name in (KNN_INDEXES_FILE_NAME, KNN_SCORES_FILE_NAME):
+        if os.path.exists(os.path.join(directory, name)):
+            os.remove(os.path.join(directory, name))
+    os.replace(embeddings.filename, path)
+
+
+def insert_batch_in_collection(collection: Collection, data: dict):
+    """
+    Insert a batch of embeddings in the collection. The low dimensional coordinates are set to 0 and updated once the
+    whole dataset has been embedded.
+    @param collection: the embeddings collection.
+    @param data: dictionary with the embeddings of the batch and the other attributes.
+    """
+    # Get entities
+    entities = modify_data(data)
+    try:
+        # Do for loop to avoid resource exhaustion
+        for i in range(0, len(entities), INSERT_SIZE):
+            collection.insert(data=entities[i:i + INSERT_SIZE])
+    except Exception as e:
+        print("Error in insert_batch_in_collection. Error message: ", e)
+        sys.exit(1)
+
 
-    # Set embeddings
-    dp.setEmbeddings(embeddings)
+def generate_low_dimensional_embeddings(collection: Collection, dp: DatasetPreprocessor, embeddings: np.ndarray,
+                                        indexes: np.ndarray):
+    """
+    Project the embeddings to two dimensions and update the coordinates of the entities in the collection, streaming
+    through the collection.
+    @param collection: the embeddings collection.
+    @param dp: the dataset preprocessor.
+    @param embeddings: matrix with the embeddings of the dataset, with row i containing the embedding of index i.
+    @param indexes: sorted indexes of the samples that have been embedded.
+    """
+    # Set embeddings. Only the rows of samples that have been embedded are projected.
+    dp.setEmbeddings(embeddings[indexes])
     # Get metadata
     with warnings.catch_warnings():
         warnings.filterwarnings("ignore")
-        data = dp.generateRecordsMetadata()
-
-    # Update vectors
-    for i in range(len(entities)):
-        entities[i]["x"] = data["low_dim_embeddings"][i][0]
-        entities[i]["y"] = data["low_dim_embeddings"][i][1]
-
-    # Create collection
-    try:
-        collection = embeddings_collection(collection_name)
-    except Exception as e:
-        print("Error in creation of embeddings collection. Error message: ", e)
-        sys.exit(1)
+        low_dim_embeddings = dp.generateRecordsMetadata()["low_dim_embeddings"]
 
     try:
-        # Do for loop to avoid resource exhaustion
-        for i in range(0, len(entities), INSERT_SIZE):
-            collection.insert(data=entities[i:i + INSERT_SIZE])
+        # Load collection
+        collection.load()
+        # Update coordinates of the entities, one batch at a time
+        for batch in export_collection(collection, ["*"]):
+            positions = np.searchsorted(indexes, batch["index"])
+            batch["x"] = low_dim_embeddings[positions, 0]
+            batch["y"] = low_dim_embeddings[positions, 1]
+            entities = columns_to_rows(batch)
+            # Do for loop to avoid resource exhaustion
+            for i in range(0, len(entities), INSERT_SIZE):
+                collection.upsert(data=entities[i:i + INSERT_SIZE])
         # Flush the collection
         collection.flush()
     except Exception as e:
@@ -178,29 +333,79 @@ if __name__ == "__main__":
 
     with warnings.catch_warnings():
         warnings.filterwarnings("ignore")
-        if utility.has_collection(flags["dataset"]) and (flags["repopulate"]
-                                                         or Collection(flags["dataset"]).num_entities == 0):
-            utility.drop_collection(flags["dataset"])
-        elif utility.has_collection(flags["dataset"]) and not (flags["repopulate"]
-                                                               or Collection(flags["dataset"]).num_entities == 0):
-            print(f"Found collection {flags['dataset']}. It has more than 0 entities."
-                  f" Set repopulate to True to drop it.")
-            sys.exit(0)
-
         # Get dataset object
         dataset = get_dataset_object(flags["dataset"])
+        # Get data directory of the dataset
+        directory = os.path.join(os.getenv(HOME), DATA_DIR_NAME, flags["dataset"])
+        os.makedirs(directory, exist_ok=True)
+        checkpoint = Checkpoint(directory, dataset.get_size(), flags["batch_size"])
+
+        if flags["resume"]:
+            # Resume from the last checkpoint
+            if not utility.has_collection(flags["dataset"]) or not checkpoint.load():
+                print(f"Could not find a checkpoint for {flags['dataset']}. Run again without resuming.")
+                sys.exit(1)
+            collection = Collection(flags["dataset"])
+            try:
+                # Remove the entities of a batch that was inserted after the last checkpoint
+                collection.load()
+                collection.delete(expr=f"index >= {checkpoint.next_index}")
+                collection.flush()
+                collection.release()
+            except Exception as e:
+                print("Error in main. Could not clean up the collection. Error: ", e)
+                sys.exit(1)
+            print(f"Resuming from sample {checkpoint.next_index} of {dataset.get_size()}, "
+                  f"{len(checkpoint.skipped)} samples skipped so far.")
+        else:
+            if utility.has_collection(flags["dataset"]) and (flags["repopulate"]
+                                                             or Collection(flags["dataset"]).num_entities == 0):
+                utility.drop_collection(flags["dataset"])
+            elif utility.has_collection(flags["dataset"]) and not (flags["repopulate"]
+                                                                   or Collection(flags["dataset"]).num_entities == 0):
+                print(f"Found collection {flags['dataset']}. It has more than 0 entities."
+                      f" Set repopulate to True to drop it.")
+                sys.exit(0)
+            # Create collection
+            try:
+                collection = embeddings_collection(flags["dataset"], flags["index"]["type"], flags["index"]["params"])
+            except Exception as e:
+                print("Error in creation of embeddings collection. Error message: ", e)
+                sys.exit(1)
+            # Start from an empty checkpoint
+            checkpoint.save()
+
         # Create an embedding object
         embeddings = ClipEmbeddings(device=DEVICE)
         # Create dataset preprocessor
         dp = DatasetPreprocessor(embeddings)
-        # Get dataloader
-        dataloader = dataset.get_dataloader(flags["batch_size"], NUM_WORKERS, embeddings.processData)
-        # Generate data
-        data = dp.generateDatabaseEmbeddings(dataloader)
-        # Get entities
-        entities = modify_data(data)
+        # Create or open the file for the embeddings
+        embeddings_matrix = create_embeddings_file(directory, dataset.get_size(), flags["resume"])
+
+        def save_checkpoint(batch_number, skipped):
+            # Make sure that the embeddings of the batch are on disk before recording the progress
+            embeddings_matrix.flush()
+            checkpoint.save(batch_number, skipped)
+
+        if checkpoint.next_index < dataset.get_size():
+            # Get dataloader, starting from the first sample that has not been processed yet
+            dataloader = dataset.get_dataloader(flags["batch_size"], flags["workers"], embeddings.getDataProcessor(),
+                                                checkpoint.next_index, pin_memory=DEVICE.startswith("cuda"))
+            # Generate embeddings, writing them in the file and inserting them in the collection batch by batch
+            dp.generateDatabaseEmbeddings(dataloader, embeddings_matrix,
+                                          lambda data: insert_batch_in_collection(collection, data), save_checkpoint)
+            embeddings_matrix.flush()
+            collection.flush()
+        # All the embeddings have been generated, so they replace the embeddings of the previous run
+        finalize_embeddings_file(embeddings_matrix, directory)
+
+        if len(checkpoint.skipped) > 0:
+            print(f"{len(checkpoint.skipped)} samples were skipped. See {checkpoint.skipped_path} for details.")
         # Generate low dimensional embeddings
-        generate_low_dimensional_embeddings(entities, dp, flags["dataset"])
+        generate_low_dimensional_embeddings(collection, dp, embeddings_matrix, checkpoint.get_embedded_indexes())
+        # The coordinates have changed, so the attributes saved by the local search backend are exported again
+        if os.path.exists(os.path.join(directory, ATTRIBUTES_FILE_NAME)):
+            os.remove(os.path.join(directory, ATTRIBUTES_FILE_NAME))
 
         print(f"Embeddings collection created and populated for dataset {flags['dataset']}.")
         sys.exit(0)
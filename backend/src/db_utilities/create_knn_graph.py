@@ -0,0 +1,169 @@
+import getopt
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ..CONSTANTS import *
+
+
+def parsing():
+    # Load dataset options from datasets.json
+    with open(os.path.join(os.getenv(HOME), DATASETS_JSON_NAME), "r") as f:
+        datasets = json.load(f)["datasets"]
+    # Remove 1st argument from the list of command line arguments
+    arguments = sys.argv[1:]
+
+    # Options
+    options = "hc:k:b:w:"
+
+    # Long options
+    long_options = ["help", "collection=", "neighbors=", "block_size=", "workers="]
+
+    # Prepare flags
+    flags = {"dataset": datasets[0]["name"], "k": KNN_GRAPH_K, "block_size": KNN_BLOCK_SIZE, "workers": NUM_WORKERS}
+
+    # Parsing argument
+    arguments, values = getopt.getopt(arguments, options, long_options)
+
+    if len(arguments) > 0 and arguments[0][0] in ("-h", "--help"):
+        print(f'This script computes the nearest neighbors of every image of a dataset from the embeddings generated '
+              f'by create_and_populate_embeddings_collection, and saves them in the data directory of the dataset.\n\
+        -c or --collection: dataset (default={flags["dataset"]}).\n\
+        -k or --neighbors: number of neighbors of each image (default={flags["k"]}).\n\
+        -b or --block_size: number of images multiplied together (default={flags["block_size"]}).\n\
+        -w or --workers: number of blocks processed in parallel (default={flags["workers"]}).')
+        sys.exit(0)
+
+    # Checking each argument
+    for arg, val in arguments:
+        if arg in ("-c", "--collection"):
+            if val in [d["name"] for d in datasets]:
+                flags["dataset"] = val
+            else:
+                print("Dataset not found.")
+                sys.exit(1)
+        elif arg in ("-k", "--neighbors"):
+            if int(val) >= 1:
+                flags["k"] = int(val)
+            else:
+                print("Number of neighbors must be greater than 0.")
+                sys.exit(1)
+        elif arg in ("-b", "--block_size"):
+            if int(val) >= 1:
+                flags["block_size"] = int(val)
+            else:
+                print("Block size must be greater than 0.")
+                sys.exit(1)
+        elif arg in ("-w", "--workers"):
+            if int(val) >= 1:
+                flags["workers"] = int(val)
+            else:
+                print("Number of workers must be greater than 0.")
+                sys.exit(1)
+
+    return flags
+
+
+def search_block(embeddings: np.ndarray, inverse_norms: np.ndarray, start: int, end: int, k: int,
+                 block_size: int) -> tuple:
+    """
+    Find the k nearest neighbors, by cosine similarity, of the embeddings with index in [start, end). The similarities
+    with all the embeddings are computed block by block, and only the best k candidates of each row are kept.
+    @param embeddings: matrix of embeddings.
+    @param inverse_norms: inverse of the norm of each embedding, or 0 if the embedding is empty.
+    @param start: first row of the block.
+    @param end: end of the block.
+    @param k: number of neighbors.
+    @param block_size: number of columns of the similarity matrix computed at once.
+    @return: indexes and similarities of the neighbors, sorted by decreasing similarity. If an embedding is empty, or
+    if it has fewer than k neighbors, the missing neighbors have index -1.
+    """
+    queries = embeddings[start:end] * inverse_norms[start:end, None]
+    rows = np.arange(end - start)
+    best_scores = np.full((end - start, k), -np.inf, dtype=np.float32)
+    best_indexes = np.full((end - start, k), -1, dtype=np.int64)
+    for column in range(0, embeddings.shape[0], block_size):
+        stop = min(column + block_size, embeddings.shape[0])
+        scores = queries @ (embeddings[column:stop] * inverse_norms[column:stop, None]).T
+        # An image is not its own neighbor, and empty embeddings are not neighbors
+        scores[:, inverse_norms[column:stop] == 0] = -np.inf
+        own = rows[(rows + start >= column) & (rows + start < stop)]
+        scores[own, own + start - column] = -np.inf
+        # Keep the best k candidates among the current neighbors and the block
+        scores = np.concatenate([best_scores, scores], axis=1)
+        indexes = np.concatenate([best_indexes, np.broadcast_to(np.arange(column, stop), (end - start, stop - column))],
+                                 axis=1)
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        best_indexes = np.take_along_axis(indexes, best, axis=1)
+
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    best_indexes = np.take_along_axis(best_indexes, order, axis=1)
+    # Rows of empty embeddings have no neighbors
+    best_indexes[(best_scores == -np.inf) | (inverse_norms[start:end, None] == 0)] = -1
+    best_scores[best_indexes == -1] = 0
+    return best_indexes, best_scores
+
+
+def build_knn_graph(embeddings: np.ndarray, indexes: np.ndarray, scores: np.ndarray, block_size: int = KNN_BLOCK_SIZE,
+                    workers: int = NUM_WORKERS):
+    """
+    Compute the nearest neighbors of every embedding. Blocks of rows are processed in parallel, since the matrix
+    multiplications release the GIL.
+    @param embeddings: matrix of embeddings, where empty rows are embeddings that were not generated.
+    @param indexes: int32 matrix with one row per embedding and one column per neighbor, filled with the indexes of the
+    neighbors.
+    @param scores: float16 matrix with the same shape as indexes, filled with the cosine similarities.
+    @param block_size: number of rows and columns of the blocks of the similarity matrix.
+    @param workers: number of blocks processed in parallel.
+    """
+    # Compute the norms block by block, so that the memory-mapped matrix is never copied at once
+    norms = np.concatenate([np.linalg.norm(embeddings[start:start + block_size], axis=1)
+                            for start in range(0, embeddings.shape[0], block_size)])
+    inverse_norms = np.divide(1, norms, out=np.zeros_like(norms), where=norms > 0).astype(np.float32)
+
+    def process(start: int):
+        end = min(start + block_size, embeddings.shape[0])
+        block_indexes, block_scores = search_block(embeddings, inverse_norms, start, end, indexes.shape[1], block_size)
+        indexes[start:end] = block_indexes
+        scores[start:end] = block_scores
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Consume the iterator, so that exceptions raised by the workers are propagated
+        list(executor.map(process, range(0, embeddings.shape[0], block_size)))
+
+
+if __name__ == "__main__":
+    # Get arguments
+    flags = parsing()
+
+    directory = os.path.join(os.getenv(HOME), DATA_DIR_NAME, flags["dataset"])
+    path = os.path.join(directory, EMBEDDINGS_FILE_NAME)
+    if not os.path.exists(path):
+        print(f"Could not find {path}. Generate the embeddings of the dataset first.")
+        sys.exit(1)
+    embeddings = np.load(path, mmap_mode="r")
+    k = min(flags["k"], embeddings.shape[0] - 1)
+    if k < 1:
+        print("The dataset must contain at least two images.")
+        sys.exit(1)
+
+    # Write the graph to temporary files, and replace the previous graph only once it is complete
+    indexes_path = os.path.join(directory, KNN_INDEXES_FILE_NAME)
+    scores_path = os.path.join(directory, KNN_SCORES_FILE_NAME)
+    shape = (embeddings.shape[0], k)
+    indexes = np.lib.format.open_memmap(indexes_path + ".tmp", mode="w+", dtype=np.int32, shape=shape)
+    scores = np.lib.format.open_memmap(scores_path + ".tmp", mode="w+", dtype=np.float16, shape=shape)
+    start = time.perf_counter()
+    build_knn_graph(embeddings, indexes, scores, flags["block_size"], flags["workers"])
+    indexes.flush()
+    scores.flush()
+    del indexes, scores
+    os.replace(indexes_path + ".tmp", indexes_path)
+    os.replace(scores_path + ".tmp", scores_path)
+    print(f"Computed {k} neighbors of {embeddings.shape[0]} images in {time.perf_counter() - start:.1f} seconds.")
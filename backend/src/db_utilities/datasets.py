@@ -15,7 +15,20 @@ from ..CONSTANTS import *
 # COLLATE FUNCTIONS
 
 
+def split_skipped(batch):
+    """
+    Separate the samples that could not be loaded from the other samples of the batch.
+    @param batch: list of samples.
+    @return: the list of valid samples, and the list of skipped samples with their index, path and error message.
+    """
+    return ([x for x in batch if "error" not in x],
+            [{"index": x["index"], "path": x["path"], "error": x["error"]} for x in batch if "error" in x])
+
+
 def wikiart_collate_fn(batch):
+    batch, skipped = split_skipped(batch)
+    if len(batch) == 0:
+        return {"skipped": skipped}
     try:
         return {
             "images": {key: torch.cat([x["images"][key] if isinstance(x["images"][key], torch.Tensor)
@@ -28,7 +41,8 @@ def wikiart_collate_fn(batch):
             "genre": [x["genre"] for x in batch],
             "author": [x["author"] for x in batch],
             "title": [x["title"] for x in batch],
-            "date": [x["date"] for x in batch]
+            "date": [x["date"] for x in batch],
+            "skipped": skipped
         }
     except Exception as e:
         print(e.__str__())
@@ -37,6 +51,9 @@ def wikiart_collate_fn(batch):
 
 
 def best_artworks_collate_fn(batch):
+    batch, skipped = split_skipped(batch)
+    if len(batch) == 0:
+        return {"skipped": skipped}
     try:
         return {
             "images": {key: torch.cat([x["images"][key] if isinstance(x["images"][key], torch.Tensor)
@@ -46,7 +63,8 @@ def best_artworks_collate_fn(batch):
             "author": [x["author"] for x in batch],
             "path": [x["path"] for x in batch],
             "width": [x["width"] for x in batch],
-            "height": [x["height"] for x in batch]
+            "height": [x["height"] for x in batch],
+            "skipped": skipped
         }
     except Exception as e:
         print(e.__str__())
@@ -55,6 +73,9 @@ def best_artworks_collate_fn(batch):
 
 
 def common_collate_fn(batch):
+    batch, skipped = split_skipped(batch)
+    if len(batch) == 0:
+        return {"skipped": skipped}
     try:
         return {
             "images": {key: torch.cat([x["images"][key] if isinstance(x["images"][key], torch.Tensor)
@@ -63,7 +84,8 @@ def common_collate_fn(batch):
             "index": [x["index"] for x in batch],
             "path": [x["path"] for x in batch],
             "width": [x["width"] for x in batch],
-            "height": [x["height"] for x in batch]
+            "height": [x["height"] for x in batch],
+            "skipped": skipped
         }
     except Exception as e:
         print(e.__str__())
@@ -73,7 +95,7 @@ def common_collate_fn(batch):
 
 # SUPPORT DATASET FOR IMAGES
 
-class SupportDatasetForImages(TorchDataset):
+class SupportDatasetForImages(TorchDataset, ABC):
     def __init__(self, root_dir):
         self.root_dir = root_dir
         self.file_list = []
@@ -90,18 +112,32 @@ class SupportDatasetForImages(TorchDataset):
     def __len__(self):
         return len(self.file_list)
 
+    def __getitem__(self, idx):
+        # Images that cannot be opened or processed are returned with an error message, so that they can be skipped
+        # without aborting the whole batch
+        try:
+            item = self._get_item(idx)
+            if item["images"] is None:
+                raise Exception("Image could not be processed.")
+            return item
+        except Exception as e:
+            return {"index": idx, "path": self.file_list[idx], "error": str(e)}
+
+    @abstractmethod
+    def _get_item(self, idx):
+        pass
+
 
 class SupportDatasetForImagesBestArtworks(SupportDatasetForImages):
     def __init__(self, root_dir):
         super().__init__(root_dir)
 
-    def __getitem__(self, idx):
+    def _get_item(self, idx):
         img_name = os.path.join(self.root_dir, self.file_list[idx])
-        # Get image height and width
-        image = Image.open(img_name)
-        width, height = image.size
-        if self.transform:
-            image = self.transform(image)
+        # Get image height and width. Close the file once the image has been processed.
+        with Image.open(img_name) as image:
+            width, height = image.size
+            image = self.transform(image) if self.transform else image.copy()
 
         return {
             'images': image,
@@ -117,13 +153,12 @@ class SupportDatasetForImagesWikiArt(SupportDatasetForImages):
     def __init__(self, root_dir):
         super().__init__(root_dir)
 
-    def __getitem__(self, idx):
+    def _get_item(self, idx):
         img_name = os.path.join(self.root_dir, self.file_list[idx])
-        # Get image height and width
-        image = Image.open(img_name)
-        width, height = image.size
-        if self.transform:
-            image = self.transform(image)
+        # Get image height and width. Close the file once the image has been processed.
+        with Image.open(img_name) as image:
+            width, height = image.size
+            image = self.transform(image) if self.transform else image.copy()
 
         # Create dictionary to return
         return_value = {
@@ -177,13 +212,12 @@ class SupportDatasetForImagesCommon(SupportDatasetForImages):
     def __init__(self, root_dir):
         super().__init__(root_dir)
 
-    def __getitem__(self, idx):
+    def _get_item(self, idx):
         img_name = os.path.join(self.root_dir, self.file_list[idx])
-        # Get image height and width
-        image = Image.open(img_name)
-        width, height = image.size
-        if self.transform:
-            image = self.transform(image)
+        # Get image height and width. Close the file once the image has been processed.
+        with Image.open(img_name) as image:
+            width, height = image.size
+            image = self.transform(image) if self.transform else image.copy()
 
         return {
             'images': image,
@@ -206,7 +240,7 @@ class Dataset(ABC):
         pass
 
     @abstractmethod
-    def get_dataloader(self, batch_size, num_workers, data_processor):
+    def get_dataloader(self, batch_size, num_workers, data_processor, start_index=0, pin_memory=False):
         pass
 
     def __getitem__(self, idx):
@@ -223,15 +257,20 @@ class LocalArtworksDataset(Dataset):
     def get_size(self):
         return len(self.dataset)
 
-    def get_dataloader(self, batch_size, num_workers, data_processor):
-        # Create sampler
-        sampler = SequentialSampler(self.dataset)
+    def get_dataloader(self, batch_size, num_workers, data_processor, start_index=0, pin_memory=False):
+        # Create sampler. Samples are visited in order, starting from start_index.
+        sampler = range(start_index, len(self.dataset)) if start_index > 0 else SequentialSampler(self.dataset)
+        # The data processor runs in the worker processes, so it must be picklable and keep its outputs on the CPU
         self.dataset.append_transform(data_processor)
+        # Workers decode and preprocess the next batches while the model runs. Batches are returned in order.
+        worker_options = {"prefetch_factor": PREFETCH_FACTOR, "persistent_workers": True} if num_workers > 0 else {}
         return DataLoader(self.dataset,
                           batch_size=batch_size,
                           num_workers=num_workers,
                           collate_fn=self.collate_fn,
-                          sampler=sampler)
+                          sampler=sampler,
+                          pin_memory=pin_memory,
+                          **worker_options)
 
 
 # FUNCTION FOR GETTING DATASET OBJECT
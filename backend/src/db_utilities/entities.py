@@ -0,0 +1,116 @@
+import numpy as np
+
+
+class EntityTable:
+    """
+    Columnar table with the entities of an embeddings collection. Numeric fields are stored in NumPy arrays, and paths
+    are stored in a single UTF-8 buffer with offsets, so that the table does not need a Python object per entity. Rows
+    are addressed by their position in the table, which is not necessarily equal to the index of the entity.
+    """
+
+    def __init__(self, index: np.ndarray, x: np.ndarray, y: np.ndarray, width: np.ndarray, height: np.ndarray,
+                 path_buffer: np.ndarray, path_offsets: np.ndarray):
+        self.index = index
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.path_buffer = path_buffer
+        self.path_offsets = path_offsets
+        # Rows sorted by index, used for finding the row of an index
+        self._rows_by_index = np.argsort(self.index, kind="stable")
+
+    @classmethod
+    def from_entities(cls, entities: list[dict]) -> "EntityTable":
+        """
+        Create a table from a list of entities, each with fields 'index', 'path', 'width', 'height', 'x' and 'y'.
+        @param entities: list of entities.
+        @return: the table.
+        """
+        paths = [entity["path"].encode("utf-8") for entity in entities]
+        path_offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+        np.cumsum([len(path) for path in paths], out=path_offsets[1:])
+        return cls(
+            index=np.array([entity["index"] for entity in entities], dtype=np.int64),
+            x=np.array([entity["x"] for entity in entities], dtype=np.float64),
+            y=np.array([entity["y"] for entity in entities], dtype=np.float64),
+            width=np.array([entity["width"] for entity in entities], dtype=np.int32),
+            height=np.array([entity["height"] for entity in entities], dtype=np.int32),
+            path_buffer=np.frombuffer(b"".join(paths), dtype=np.uint8),
+            path_offsets=path_offsets
+        )
+
+    @classmethod
+    def from_columns(cls, columns: dict) -> "EntityTable":
+        """
+        Create a table from a batch of columns, as yielded by export_collection.
+        @param columns: dictionary with columns 'index', 'path', 'width', 'height', 'x' and 'y'.
+        @return: the table.
+        """
+        paths = [path.encode("utf-8") for path in columns["path"]]
+        path_offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+        np.cumsum([len(path) for path in paths], out=path_offsets[1:])
+        return cls(
+            index=np.asarray(columns["index"], dtype=np.int64),
+            x=np.asarray(columns["x"], dtype=np.float64),
+            y=np.asarray(columns["y"], dtype=np.float64),
+            width=np.asarray(columns["width"], dtype=np.int32),
+            height=np.asarray(columns["height"], dtype=np.int32),
+            path_buffer=np.frombuffer(b"".join(paths), dtype=np.uint8),
+            path_offsets=path_offsets
+        )
+
+    @classmethod
+    def concatenate(cls, tables: list["EntityTable"]) -> "EntityTable":
+        """
+        Concatenate tables, keeping the order of the rows.
+        @param tables: list of tables.
+        @return: the concatenated table.
+        """
+        # Shift the path offsets of each table by the size of the buffers before it
+        buffer_sizes = np.cumsum([0] + [len(table.path_buffer) for table in tables])
+        path_offsets = np.concatenate([np.zeros(1, dtype=np.int64)]
+                                      + [table.path_offsets[1:] + shift for table, shift in zip(tables, buffer_sizes)])
+        return cls(
+            index=np.concatenate([table.index for table in tables]),
+            x=np.concatenate([table.x for table in tables]),
+            y=np.concatenate([table.y for table in tables]),
+            width=np.concatenate([table.width for table in tables]),
+            height=np.concatenate([table.height for table in tables]),
+            path_buffer=np.concatenate([table.path_buffer for table in tables]),
+            path_offsets=path_offsets
+        )
+
+    def __len__(self):
+        return len(self.index)
+
+    def get_path(self, row: int) -> str:
+        return self.path_buffer[self.path_offsets[row]:self.path_offsets[row + 1]].tobytes().decode("utf-8")
+
+    def get_rows(self, indexes) -> np.ndarray:
+        """
+        Get the rows of the entities with the given indexes.
+        @param indexes: indexes of the entities.
+        @return: the rows of the entities.
+        """
+        indexes = np.asarray(indexes, dtype=np.int64)
+        positions = np.searchsorted(self.index, indexes, sorter=self._rows_by_index)
+        rows = self._rows_by_index[np.minimum(positions, len(self) - 1)]
+        if not np.array_equal(self.index[rows], indexes):
+            raise KeyError("Some indexes are not in the table.")
+        return rows
+
+    def to_dict(self, row: int) -> dict:
+        """
+        Build the entity at the given row, with Python types.
+        @param row: row of the entity.
+        @return: the entity.
+        """
+        return {
+            "index": int(self.index[row]),
+            "path": self.get_path(row),
+            "x": float(self.x[row]),
+            "y": float(self.y[row]),
+            "width": int(self.width[row]),
+            "height": int(self.height[row])
+        }
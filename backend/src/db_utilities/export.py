@@ -0,0 +1,63 @@
+from typing import Iterator
+
+import numpy as np
+from pymilvus import Collection
+
+from ..CONSTANTS import *
+
+
+def rows_to_columns(rows: list[dict]) -> dict:
+    """
+    Convert a page of query results to columns. Integer, float and boolean fields become one-dimensional NumPy arrays,
+    vector fields become two-dimensional float32 arrays with one row per entity, and all the other fields (strings and
+    JSON) are kept as lists.
+    @param rows: list of entities, all with the same fields.
+    @return: dictionary from field name to column.
+    """
+    columns = {}
+    if len(rows) == 0:
+        return columns
+    for field, first_value in rows[0].items():
+        values = [row[field] for row in rows]
+        if isinstance(first_value, (bool, int, float)):
+            columns[field] = np.asarray(values)
+        elif isinstance(first_value, list) and len(first_value) > 0 and isinstance(first_value[0], (int, float)):
+            columns[field] = np.asarray(values, dtype=np.float32)
+        else:
+            columns[field] = values
+    return columns
+
+
+def columns_to_rows(columns: dict) -> list[dict]:
+    """
+    Convert columns produced by rows_to_columns back to a list of entities with Python types, e.g., for inserting
+    them in a collection.
+    @param columns: dictionary from field name to column.
+    @return: list of entities.
+    """
+    lists = {field: column.tolist() if isinstance(column, np.ndarray) else column for field, column in columns.items()}
+    number_of_rows = len(next(iter(lists.values()))) if len(lists) > 0 else 0
+    return [{field: values[i] for field, values in lists.items()} for i in range(number_of_rows)]
+
+
+def export_collection(collection: Collection, output_fields: list[str], batch_size: int = SEARCH_LIMIT,
+                      expr: str = "") -> Iterator[dict]:
+    """
+    Stream all the entities of a collection in batches of columns. Batches are fetched with a query iterator, which
+    pages through the collection by primary key, so indexes do not need to be dense and only one batch is kept in
+    memory at a time. The collection must be loaded.
+    @param collection: the collection.
+    @param output_fields: fields to export.
+    @param batch_size: maximum number of entities per batch.
+    @param expr: optional filter on the entities.
+    @return: iterator over dictionaries from field name to column, as returned by rows_to_columns.
+    """
+    iterator = collection.query_iterator(batch_size=batch_size, expr=expr, output_fields=output_fields)
+    try:
+        while True:
+            rows = iterator.next()
+            if len(rows) == 0:
+                break
+            yield rows_to_columns(rows)
+    finally:
+        iterator.close()
@@ -0,0 +1,106 @@
+import getopt
+import json
+import os
+import sys
+
+import numpy as np
+from dotenv import load_dotenv
+from pymilvus import db, Collection, utility
+
+from .collections import ZOOM_LEVEL_VECTOR_FIELD_NAME
+from .create_and_populate_clusters_collection import create_image_to_tile_file
+from .export import export_collection
+from .utils import create_connection
+from ..CONSTANTS import *
+
+
+def parsing():
+    with open(os.path.join(os.getenv(HOME), DATASETS_JSON_NAME), "r") as f:
+        datasets = json.load(f)["datasets"]
+
+    # Remove 1st argument from the list of command line arguments
+    arguments = sys.argv[1:]
+
+    # Options
+    options = "hd:c:"
+    # Long options
+    long_options = ["help", "database", "collection"]
+
+    # Prepare flags
+    flags = {"database": DEFAULT_DATABASE_NAME, "collection": datasets[0]["name"]}
+
+    # Parsing argument
+    arguments, values = getopt.getopt(arguments, options, long_options)
+
+    if len(arguments) > 0 and arguments[0][0] in ("-h", "--help"):
+        print(f'This script saves the mapping from images to tiles of a dataset, created by previous versions of '
+              f'create_and_populate_clusters_collection in the collection <dataset>_image_to_tile, to the file read by '
+              f'the API, and drops the collection.\n\
+        -d or --database: database name (default={flags["database"]}).\n\
+        -c or --collection: dataset (default={flags["collection"]}).')
+        sys.exit(0)
+
+    # Checking each argument
+    for arg, val in arguments:
+        if arg in ("-d", "--database"):
+            flags["database"] = val
+        elif arg in ("-c", "--collection"):
+            if val in [dataset["name"] for dataset in datasets]:
+                flags["collection"] = val
+            else:
+                print("The collection must have one of the following names: " + str([dataset["name"]
+                                                                                     for dataset in datasets]))
+                sys.exit(1)
+
+    return flags
+
+
+if __name__ == "__main__":
+    if ENV_FILE_LOCATION not in os.environ:
+        # Try to load /.env file
+        if os.path.exists("/.env"):
+            load_dotenv("/.env")
+        else:
+            print("export .env file location as ENV_FILE_LOCATION.")
+            sys.exit(1)
+    else:
+        # Load environment variables
+        load_dotenv(os.getenv(ENV_FILE_LOCATION))
+
+    flags = parsing()
+
+    # Try creating a connection and selecting a database. If it fails, exit.
+    try:
+        create_connection(ROOT_USER, ROOT_PASSWD, False)
+        db.using_database(flags["database"])
+    except Exception as e:
+        print("Error in main. Connection failed. Error: ", e)
+        sys.exit(1)
+
+    name = flags["collection"] + "_image_to_tile"
+    if not utility.has_collection(name):
+        print(f"The collection {name} does not exist.")
+        sys.exit(1)
+
+    # Read the mapping from the collection
+    collection = Collection(name)
+    collection.load()
+    indexes, tiles = [], []
+    try:
+        for batch in export_collection(collection, ["index", ZOOM_LEVEL_VECTOR_FIELD_NAME]):
+            indexes.append(batch["index"])
+            tiles.append(batch[ZOOM_LEVEL_VECTOR_FIELD_NAME])
+    except Exception as e:
+        print("Error in export of the collection. Error message: ", e)
+        collection.release()
+        sys.exit(1)
+    collection.release()
+    if len(indexes) == 0:
+        print(f"The collection {name} is empty.")
+        sys.exit(1)
+
+    # Save the file, and drop the collection only once the file is complete
+    path = os.path.join(os.getenv(HOME), DATA_DIR_NAME, flags["collection"], IMAGE_TO_TILE_FILE_NAME)
+    create_image_to_tile_file(np.concatenate(indexes), np.rint(np.concatenate(tiles)).astype(np.int32), path)
+    utility.drop_collection(name)
+    print(f"Saved the tiles of {sum(len(batch) for batch in indexes)} images to {path}.")
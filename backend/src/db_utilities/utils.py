@@ -5,7 +5,7 @@ from dotenv import load_dotenv
 import numpy as np
 from pymilvus import connections
 from sklearn.cluster import KMeans
-from sklearn.metrics import euclidean_distances
+from sklearn.utils import check_random_state
 
 from ..CONSTANTS import *
 
@@ -31,44 +31,140 @@ def create_connection(user, passwd, load_vars=True):
     )
 
 
+class Tiling:
+    """
+    Grid of tiles at the maximum zoom level, stored in CSR format. The entities of the tile with id
+    tile_x * number_of_tiles + tile_y are order[offsets[id]:offsets[id + 1]], where order contains positions in the
+    list of entities. Inside a tile, entities keep the order they have in the list of entities.
+    """
+
+    def __init__(self, tile_ids: np.ndarray, number_of_tiles: int):
+        self.number_of_tiles = number_of_tiles
+        # Stable sort, so that entities in the same tile are not reordered
+        self.order = np.argsort(tile_ids, kind="stable")
+        self.counts = np.bincount(tile_ids, minlength=number_of_tiles ** 2)
+        self.offsets = np.zeros(number_of_tiles ** 2 + 1, dtype=np.int64)
+        np.cumsum(self.counts, out=self.offsets[1:])
+
+    def get_entities_in_tile(self, tile_x: int, tile_y: int, span: int = 1) -> np.ndarray:
+        """
+        Get the positions of the entities in the square of span x span tiles starting at (tile_x, tile_y). The tiles
+        are visited along x first and then along y, i.e., in the same order as the rows of a nested list grid.
+        @param tile_x: first tile along the x-axis.
+        @param tile_y: first tile along the y-axis.
+        @param span: number of tiles per side of the square.
+        @return: positions of the entities in the list of entities.
+        """
+        # For a fixed tile_x, the tiles from tile_y to tile_y + span - 1 are contiguous in the CSR arrays
+        rows = np.arange(tile_x, tile_x + span) * self.number_of_tiles
+        starts = self.offsets[rows + tile_y]
+        ends = self.offsets[rows + tile_y + span]
+        return np.concatenate([self.order[start:end] for start, end in zip(starts, ends)])
+
+
+def compute_tile_ids(x: np.ndarray, y: np.ndarray, min_values: dict, max_values: dict,
+                     number_of_tiles: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find the tile to which each point belongs when each dimension is divided into number_of_tiles intervals.
+    @param x: x coordinates of the points.
+    @param y: y coordinates of the points.
+    @param min_values: minimum value for each dimension.
+    @param max_values: maximum value for each dimension.
+    @param number_of_tiles: number of tiles per dimension.
+    @return: tile_x and tile_y for each point.
+    """
+    tile_x = np.floor_divide((x - min_values["x"]) * number_of_tiles, max_values["x"] - min_values["x"])
+    tile_y = np.floor_divide((y - min_values["y"]) * number_of_tiles, max_values["y"] - min_values["y"])
+    # Points on the upper border belong to the last tile
+    return (np.minimum(tile_x, number_of_tiles - 1).astype(np.int64),
+            np.minimum(tile_y, number_of_tiles - 1).astype(np.int64))
+
+
+def count_pyramid(tile_x: np.ndarray, tile_y: np.ndarray, zoom_level: int) -> list[np.ndarray]:
+    """
+    Count the points in each tile for all the zoom levels from 0 to zoom_level. The counts for zoom_level are computed
+    with np.bincount, and the counts for each coarser zoom level are obtained by summing blocks of 2x2 tiles.
+    @param tile_x: tiles along the x-axis of the points at zoom_level.
+    @param tile_y: tiles along the y-axis of the points at zoom_level.
+    @param zoom_level: zoom level of tile_x and tile_y.
+    @return: list with the matrix of counts for every zoom level, indexed by zoom level.
+    """
+    number_of_tiles = 2 ** zoom_level
+    counts = np.bincount(tile_x * number_of_tiles + tile_y,
+                         minlength=number_of_tiles ** 2).reshape(number_of_tiles, number_of_tiles)
+    pyramid = [counts]
+    while counts.shape[0] > 1:
+        half = counts.shape[0] // 2
+        counts = counts.reshape(half, 2, half, 2).sum(axis=(1, 3))
+        pyramid.append(counts)
+    return pyramid[::-1]
+
+
+def assign_to_centers(X, centers):
+    """
+    Find the closest center of each point using squared euclidean distances. The distances from one center are
+    computed at a time, so memory usage is linear in the number of points.
+    @param X: points, with shape (number of points, number of features).
+    @param centers: centers, with shape (number of centers, number of features).
+    @return: the label of each point and its squared distance from the closest center. Ties are broken in favour of
+    the center with the lowest label.
+    """
+    labels = np.zeros(X.shape[0], dtype=np.int64)
+    min_distances = np.full(X.shape[0], np.inf)
+    for label, center in enumerate(centers):
+        distances = np.sum((X - center) ** 2, axis=1)
+        closer = distances < min_distances
+        labels[closer] = label
+        min_distances[closer] = distances[closer]
+    return labels, min_distances
+
+
 class ModifiedKMeans:
-    def __init__(self, n_clusters, random_state, n_init=10, max_iter=300):
+    def __init__(self, n_clusters, random_state, n_init=10, max_iter=300, tol=1e-4):
+        """
+        @param n_clusters: number of clusters.
+        @param random_state: seed for the random number generator.
+        @param n_init: number of runs with different initial centers. The run with the lowest inertia is kept.
+        @param max_iter: maximum number of iterations of each run.
+        @param tol: tolerance for declaring convergence, relative to the mean variance of the features of the data.
+        With fixed centers, a run stops when the sum of the squared shifts of the moving centers is not larger than
+        the tolerance. With tol=0, a run stops when the centers do not change.
+        """
         self.n_clusters = n_clusters
         self.random_state = random_state
         self.n_init = n_init
         self.max_iter = max_iter
-        self.kmeans = KMeans(n_clusters=n_clusters, random_state=random_state, n_init=n_init, max_iter=max_iter)
-        self._inertia = sys.maxsize
+        self.tol = tol
+        self.kmeans = KMeans(n_clusters=n_clusters, random_state=random_state, n_init=n_init, max_iter=max_iter,
+                             tol=tol)
+        # Inertia (sum of squared distances of the points from their closest center) and number of iterations of the
+        # best run
+        self.inertia_ = sys.maxsize
+        self.n_iter_ = 0
         self.cluster_centers_ = None
 
     @staticmethod
-    def _compute_initial_centers(X, fixed_centers, num_remaining_centers, n_init):
+    def _compute_initial_centers(X, fixed_centers, num_remaining_centers, n_init, random_state=None):
+        random_state = check_random_state(random_state)
         centroids = fixed_centers
 
+        # keep the squared distance of each data point from its nearest centroid. Each new centroid only requires
+        # computing the distances from that centroid.
+        dist = np.full(X.shape[0], float(sys.maxsize))
+        for centroid in centroids:
+            np.minimum(dist, np.sum((X - centroid) ** 2, axis=1), out=dist)
+
         # compute remaining centroids
         for _ in range(num_remaining_centers):
-            # initialize a list to store distances of data
-            # points from nearest centroid
-            dist = np.zeros(X.shape[0])
-            for i in range(X.shape[0]):
-                point = X[i, :]
-                d = sys.maxsize
-
-                # compute distance of 'point' from each of the previously
-                # selected centroid and store the minimum distance
-                for j in range(len(centroids)):
-                    temp_dist = np.sum((point - centroids[j]) ** 2)
-                    d = min(d, temp_dist)
-                dist[i] = d
-
             # select data point with maximum distance as our next centroid
             if n_init == 1:
                 next_centroid = X[np.argmax(dist), :]
             else:
                 # Get centroid at random using probability proportional to distance
-                next_centroid = X[np.random.choice(X.shape[0], p=dist / np.sum(dist)), :]
+                next_centroid = X[random_state.choice(X.shape[0], p=dist / np.sum(dist)), :]
 
             centroids = np.vstack([centroids, next_centroid])
+            np.minimum(dist, np.sum((X - next_centroid) ** 2, axis=1), out=dist)
 
         return centroids
 
@@ -83,40 +179,67 @@ class ModifiedKMeans:
         """
         if fixed_centers is None:
             self.kmeans.fit(X)
-            self._inertia = self.kmeans.inertia_
+            self.inertia_ = self.kmeans.inertia_
+            self.n_iter_ = self.kmeans.n_iter_
             self.cluster_centers_ = self.kmeans.cluster_centers_
         else:
+            # Use a generator local to this call, so that the result does not depend on the process running the fit.
+            random_state = check_random_state(self.random_state)
+            number_of_fixed_centers = fixed_centers.shape[0]
+            # Scale tolerance by the variance of the data, as done by scikit-learn
+            tol = self.tol * np.mean(np.var(X, axis=0))
             # Do k-means clustering with fixed centers for self.n_init times. Keep the best result.
             for _ in range(self.n_init):
                 # Generate random centers for the remaining clusters
                 centers = ModifiedKMeans._compute_initial_centers(X, fixed_centers,
-                                                                  self.n_clusters - len(fixed_centers), self.n_init)
+                                                                  self.n_clusters - len(fixed_centers), self.n_init,
+                                                                  random_state)
                 # Now the first len(fixed_centers) centers are fixed and the remaining centers can move
                 # Do k-means clustering with fixed centers
                 it = 0
                 while it < self.max_iter:
+                    it += 1
                     # Assign labels to each datapoint based on centers
-                    labels = np.argmin(euclidean_distances(X, centers), axis=1)
+                    labels, _ = assign_to_centers(X, centers)
                     # Find new centers from means of datapoints
-                    new_moving_centers = np.zeros((centers.shape[0] - fixed_centers.shape[0], X.shape[1]))
-                    for i in range(fixed_centers.shape[0], centers.shape[0]):
-                        if i not in labels:
-                            # If a cluster has no points, then set the center to a random point
-                            new_moving_centers[i - fixed_centers.shape[0]] = X[np.random.choice(X.shape[0]), :]
-                        else:
-                            new_moving_centers[i - fixed_centers.shape[0]] = np.mean(X[labels == i], axis=0)
-                    # If centers have converged, then break
-                    if np.all(centers[fixed_centers.shape[0]:] == new_moving_centers):
+                    counts = np.bincount(labels, minlength=self.n_clusters)[number_of_fixed_centers:]
+                    sums = np.stack([np.bincount(labels, weights=X[:, j], minlength=self.n_clusters)
+                                     for j in range(X.shape[1])], axis=1)[number_of_fixed_centers:]
+                    new_moving_centers = np.zeros_like(sums)
+                    non_empty = counts > 0
+                    new_moving_centers[non_empty] = sums[non_empty] / counts[non_empty, np.newaxis]
+                    for i in np.flatnonzero(~non_empty):
+                        # If a cluster has no points, then set the center to a random point
+                        new_moving_centers[i] = X[random_state.choice(X.shape[0]), :]
+                    # Update centers, and break if they have converged
+                    shift = np.sum((centers[number_of_fixed_centers:] - new_moving_centers) ** 2)
+                    centers[number_of_fixed_centers:] = new_moving_centers
+                    if shift <= tol:
                         break
-                    else:
-                        centers[fixed_centers.shape[0]:] = new_moving_centers
-                    it += 1
 
                 # Compute inertia and select the new result as best if it has lower inertia.
-                inertia = np.sum(np.min(euclidean_distances(X, centers), axis=1))
-                if inertia < self._inertia and inertia != 0:
-                    self._inertia = inertia
+                inertia = np.sum(assign_to_centers(X, centers)[1])
+                if inertia < self.inertia_ and inertia != 0:
+                    self.inertia_ = inertia
+                    self.n_iter_ = it
                     self.cluster_centers_ = centers
 
     def predict(self, X):
-        return np.argmin(euclidean_distances(X, self.cluster_centers_), axis=1)
+        return assign_to_centers(X, self.cluster_centers_)[0]
+
+    def get_representatives(self, X):
+        """
+        Assign all the points to clusters at once, and find the point closest to the center of each cluster.
+        @param X: points, with shape (number of points, number of features).
+        @return: the number of points in each cluster, and the position in X of the point closest to each center (-1
+        if the cluster is empty). Ties are broken in favour of the point that comes first in X.
+        """
+        # Get label of each point and squared distance of the point from the center of its cluster
+        labels, distances = assign_to_centers(X, self.cluster_centers_)
+        counts = np.bincount(labels, minlength=self.n_clusters)
+        # Group points by cluster and sort each group by distance. lexsort is stable, so ties keep the order of X.
+        order = np.lexsort((distances, labels))
+        starts = np.zeros(self.n_clusters, dtype=np.int64)
+        np.cumsum(counts[:-1], out=starts[1:])
+        representatives = np.where(counts > 0, order[np.minimum(starts, len(X) - 1)], -1)
+        return counts, representatives
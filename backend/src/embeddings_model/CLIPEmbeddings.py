@@ -7,11 +7,39 @@ from ..CONSTANTS import *
 from .EmbeddingsModel import EmbeddingsModel
 
 
+class ClipDataProcessor:
+    """
+    Picklable transform returning the inputs to CLIP for an image. The inputs stay on the CPU, so that the transform can
+    run in dataloader worker processes. They are moved to the device by ClipEmbeddings.getEmbeddings.
+    """
+
+    def __init__(self, processor: CLIPProcessor):
+        self.processor = processor
+
+    def __call__(self, data):
+        try:
+            return self.processor(images=data, return_tensors="pt")
+        except Exception as e:
+            print(e.__str__())
+
+
 class ClipEmbeddings(EmbeddingsModel, ABC):
-    def __init__(self, device):
+    def __init__(self, device, quantize=False):
+        """
+        :param device: Device on which the model runs.
+        :param quantize: If True, replace the linear layers of the model with int8 dynamically quantized layers. Only
+        supported on the CPU.
+        """
         self.device = device
-        self.model = CLIPModel.from_pretrained(CLIP_MODEL).to(self.device)
+        # The model is only used for inference, so put it in eval mode
+        self.model = CLIPModel.from_pretrained(CLIP_MODEL).to(self.device).eval()
+        if quantize:
+            if self.device != "cpu":
+                raise ValueError("Dynamic quantization is only supported on the CPU.")
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.quantized = quantize
         self.processor = CLIPProcessor.from_pretrained(CLIP_MODEL, )
+        self.data_processor = ClipDataProcessor(self.processor)
         self.cosine_similarity = torch.nn.CosineSimilarity()
 
     def getSimilarityScore(self, emb1, emb2):
@@ -29,8 +57,9 @@ class ClipEmbeddings(EmbeddingsModel, ABC):
         try:
             # Get text inputs
             inputs = self.processor(text, padding=True, truncation=True, return_tensors="pt").to(self.device)
-            # Return _embeddings
-            return self.model.get_text_features(**inputs)
+            # Return _embeddings. Inference mode disables autograd tracking.
+            with torch.inference_mode():
+                return self.model.get_text_features(**inputs)
         except Exception as e:
             print(e.__str__())
 
@@ -39,17 +68,21 @@ class ClipEmbeddings(EmbeddingsModel, ABC):
             # Get image inputs
             inputs = self.processor(images=image, return_tensors="pt").to(self.device)
             # Return _embeddings
-            return self.model.get_image_features(**inputs)
+            with torch.inference_mode():
+                return self.model.get_image_features(**inputs)
         except Exception as e:
             print(e.__str__())
 
     def processData(self, data):
-        # Return inputs for CLIP embeddings_model
-        try:
-            return self.processor(images=data, return_tensors="pt").to(self.device)
-        except Exception as e:
-            print(e.__str__())
+        # Return inputs for CLIP embeddings_model, on the CPU
+        return self.data_processor(data)
+
+    def getDataProcessor(self):
+        return self.data_processor
 
     def getEmbeddings(self, inputs):
+        # Move inputs to the device. With pinned memory, the copy does not block the host.
+        inputs = {key: value.to(self.device, non_blocking=True) for key, value in inputs.items()}
         # Return _embeddings
-        return self.model.get_image_features(**inputs)
+        with torch.inference_mode():
+            return self.model.get_image_features(**inputs)
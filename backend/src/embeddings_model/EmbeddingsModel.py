@@ -45,6 +45,15 @@ class EmbeddingsModel(ABC):
         """
         pass
 
+    @abstractmethod
+    def getDataProcessor(self) -> typing.Callable:
+        """
+        Return a picklable callable equivalent to processData, which can run in dataloader worker processes. Its
+        outputs must stay on the CPU.
+        :return: Callable returning the inputs to the embeddings_model.
+        """
+        pass
+
     @abstractmethod
     def getEmbeddings(self, inputs) -> torch.Tensor | np.ndarray:
         """
@@ -4,12 +4,14 @@ import os
 import sys
 import warnings
 
+import numpy as np
 from dotenv import load_dotenv
 from pymilvus import db, Collection, utility
 from umap import UMAP
 
 from ..CONSTANTS import *
 from ..db_utilities.collections import EMBEDDING_VECTOR_FIELD_NAME, umap_collection
+from ..db_utilities.export import export_collection
 from ..db_utilities.utils import create_connection
 
 
@@ -48,24 +50,19 @@ def generate_scatter_plots(collection: Collection):
         return
 
     # Fetch vectors
-    entities = []
+    data = []
     try:
-        for i in range(0, collection.num_entities, SEARCH_LIMIT):
-            # Get SEARCH_LIMIT entities
-            query_result = collection.query(
-                expr=f"index in {list(range(i, min(i + SEARCH_LIMIT, collection.num_entities)))}",
-                output_fields=[EMBEDDING_VECTOR_FIELD_NAME]
-            )
-            # Add entities to the list of entities
-            entities += query_result
+        for batch in export_collection(collection, [EMBEDDING_VECTOR_FIELD_NAME]):
+            # Add embeddings to the list of batches
+            data.append(batch[EMBEDDING_VECTOR_FIELD_NAME])
 
     except Exception as e:
         print(e.__str__())
         print("Error in fetching vectors. Scatter plots generation failed!")
         return
 
-    # Create scatter plot
-    data = [entity[EMBEDDING_VECTOR_FIELD_NAME] for entity in entities]
+    # Create matrix of embeddings, with one row per entity
+    data = np.concatenate(data)
 
     # Create UMAP collection
     umap_c = umap_collection(UMAP_COLLECTION_NAME, collection.num_entities)
@@ -3,11 +3,13 @@ import json
 import os
 import sys
 
+import numpy as np
 from dotenv import load_dotenv
 from matplotlib import pyplot as plt
 from pymilvus import db, Collection
 
 from ..CONSTANTS import *
+from ..db_utilities.export import export_collection
 from ..db_utilities.utils import create_connection
 
 
@@ -62,18 +64,13 @@ def generate_scatter_plot(flags: dict):
     # Load collection in memory
     collection.load()
 
-    # Fetch vectors
-    entities = []
+    # Fetch coordinates
+    x = []
+    y = []
     try:
-        for i in range(0, collection.num_entities, SEARCH_LIMIT):
-            if collection.num_entities > 0:
-                # Get SEARCH_LIMIT entities
-                query_result = collection.query(
-                    expr=f"index in {list(range(i, i + SEARCH_LIMIT))}",
-                    output_fields=["x", "y"]
-                )
-                # Add entities to the list of entities
-                entities += query_result
+        for batch in export_collection(collection, ["x", "y"]):
+            x.append(batch["x"])
+            y.append(-batch["y"])
 
     except Exception as e:
         print(e.__str__())
@@ -81,15 +78,15 @@ def generate_scatter_plot(flags: dict):
         return
 
     # Create scatter plot
-    x = [entity["x"] for entity in entities]
-    y = [-entity["y"] for entity in entities]
+    x = np.concatenate(x) if len(x) > 0 else np.zeros(0)
+    y = np.concatenate(y) if len(y) > 0 else np.zeros(0)
 
     # Create figure
     fig, ax = plt.subplots(figsize=(20, 12))
 
     # Set x and y limits to the minimum and maximum values of your data
-    ax.set_xlim(min(x), max(x))
-    ax.set_ylim(min(y), max(y))
+    ax.set_xlim(x.min(), x.max())
+    ax.set_ylim(y.min(), y.max())
 
     # Create scatter plot with blue dots
     ax.scatter(x, y, s=3, c="lightblue")
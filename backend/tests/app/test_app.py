@@ -100,8 +100,18 @@ def test_get_neighbours():
     response = requests.get("http://localhost:32145/api/neighbors",
                             params={"index": 2881, "k": 10, "collection": "best_artworks"})
     assert response.status_code == 200
-    assert len(response.json()) == 11
-    assert response.json()[0].keys() == {"index", "author", "path", "width", "height", "caption"}
+    assert response.json()["image"]["index"] == 2881
+    # The image is not among its neighbours
+    assert len(response.json()["neighbors"]) == 10
+    assert 2881 not in [neighbour["index"] for neighbour in response.json()["neighbors"]]
+    assert response.json()["neighbors"][0].keys() == {"index", "author", "path", "width", "height", "caption"}
+
+    # Get the neighbours of several images at once
+    response = requests.get("http://localhost:32145/api/neighbors-batch",
+                            params={"indexes": "2881,10", "k": 5, "collection": "best_artworks"})
+    assert response.status_code == 200
+    assert [result["image"]["index"] for result in response.json()] == [2881, 10]
+    assert [len(result["neighbors"]) for result in response.json()] == [5, 5]
 
     # Make second request to test that status code is 404 when collection is not found
     response = requests.get("http://localhost:32145/api/neighbours",
@@ -0,0 +1,45 @@
+import threading
+import unittest
+
+import torch
+
+from backend.src.app.batching import TextEmbeddingBatcher
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def getTextEmbeddings(self, texts):
+        self.calls.append(list(texts))
+        return torch.tensor([[float(len(text)), 1.0] for text in texts])
+
+
+class TestTextEmbeddingBatcher(unittest.TestCase):
+
+    def test_concurrent_requests_are_batched(self):
+        fake = FakeEmbeddings()
+        batcher = TextEmbeddingBatcher(fake, max_batch_size=8, max_wait_ms=200)
+        texts = ["a" * i for i in range(1, 9)]
+        results = [None] * len(texts)
+
+        def embed(i):
+            results[i] = batcher.embed(texts[i])
+
+        threads = [threading.Thread(target=embed, args=(i,)) for i in range(len(texts))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Each caller gets its own row
+        for i, result in enumerate(results):
+            self.assertEqual(result.tolist(), [[float(i + 1), 1.0]])
+        # Fewer forward passes than requests, and no batch larger than the maximum
+        self.assertLess(len(fake.calls), len(texts))
+        self.assertTrue(all(len(call) <= 8 for call in fake.calls))
+
+        metrics = batcher.get_metrics()
+        self.assertEqual(metrics["requests"], len(texts))
+        self.assertEqual(metrics["batches"], len(fake.calls))
+        self.assertEqual(sum(size * count for size, count in metrics["batch_size_histogram"].items()), len(texts))
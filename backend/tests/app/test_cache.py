@@ -0,0 +1,53 @@
+import time
+import unittest
+
+from backend.src.app.cache import LRUCache, ShardedLRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_eviction_and_counters(self):
+        cache = LRUCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        # Access "a", so that "b" is the least recently used entry
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        metrics = cache.get_metrics()
+        self.assertEqual((metrics["hits"], metrics["misses"], metrics["size"]), (2, 1, 2))
+
+    def test_ttl_and_invalidate(self):
+        cache = LRUCache(max_size=10, ttl=0.05)
+        cache.put(("first", "cat"), 1)
+        cache.put(("second", "cat"), 2)
+        cache.invalidate(lambda key: key[0] == "first")
+        self.assertIsNone(cache.get(("first", "cat")))
+        self.assertEqual(cache.get(("second", "cat")), 2)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get(("second", "cat")))
+
+    def test_byte_budget(self):
+        cache = LRUCache(max_size=None, max_bytes=10, sizeof=len)
+        cache.put("a", "aaaa")
+        cache.put("b", "bbbb")
+        cache.put("a", "aaaaa")
+        # Replacing "a" updates the size, and adding "c" evicts "b"
+        cache.put("c", "cc")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get_metrics()["bytes"], 7)
+
+
+class TestShardedLRUCache(unittest.TestCase):
+
+    def test_get_many_and_invalidate(self):
+        cache = ShardedLRUCache(num_shards=4, max_bytes=400, sizeof=len)
+        for index in range(10):
+            cache.put(("first", index), "tile")
+            cache.put(("second", index), "tile")
+        self.assertEqual(len(cache.get_many([("first", index) for index in range(5, 15)])), 5)
+        cache.invalidate(lambda key: key[0] == "first")
+        self.assertEqual(cache.get_many([("first", 1), ("second", 1)]), {("second", 1): "tile"})
+        metrics = cache.get_metrics()
+        self.assertEqual((metrics["size"], metrics["bytes"], metrics["max_bytes"]), (10, 40, 400))
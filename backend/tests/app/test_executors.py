@@ -0,0 +1,41 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from backend.src.app.executors import BoundedExecutor
+
+
+class TestBoundedExecutor(unittest.TestCase):
+
+    def test_concurrency_limit_and_metrics(self):
+        executor = BoundedExecutor("test", max_workers=2)
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def work(value):
+            with lock:
+                running[0] += 1
+                running[1] = max(running[1], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            if value < 0:
+                raise ValueError("negative value")
+            return 2 * value
+
+        async def main():
+            return await asyncio.gather(*[executor.run(work, value) for value in [1, 2, 3, 4, -1]],
+                                        return_exceptions=True)
+
+        results = asyncio.run(main())
+        self.assertEqual(results[:4], [2, 4, 6, 8])
+        self.assertIsInstance(results[4], ValueError)
+        # At most two calls ran at the same time
+        self.assertEqual(running[1], 2)
+
+        metrics = executor.get_metrics()
+        self.assertEqual((metrics["submitted"], metrics["completed"], metrics["failed"]), (5, 5, 1))
+        self.assertEqual((metrics["active"], metrics["pending"]), (0, 0))
+        # Calls beyond the limit had to wait
+        self.assertGreater(metrics["max_queue_time_ms"], 0)
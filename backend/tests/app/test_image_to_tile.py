@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from backend.src.CONSTANTS import IMAGE_TO_TILE_FILE_NAME
+from backend.src.app.image_to_tile import ImageToTileLookup
+
+
+class TestImageToTileLookup(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "dataset", IMAGE_TO_TILE_FILE_NAME)
+        os.makedirs(os.path.dirname(self.path))
+        self.lookup = ImageToTileLookup(self.directory.name)
+
+    def test_tiles_of_images(self):
+        np.save(self.path, np.array([[0, 0, 0], [-1, -1, -1], [3, 5, 2]], dtype=np.int32))
+        self.assertEqual(self.lookup.get_tiles([2, 0, 1, 3, -1], "dataset"), [[3, 5, 2], [0, 0, 0], None, None, None])
+        self.assertIsNone(self.lookup.get_tiles([0], "missing"))
+
+    def test_replaced_file_is_opened_again(self):
+        np.save(self.path, np.array([[1, 1, 1]], dtype=np.int32))
+        self.assertEqual(self.lookup.get_tiles([0], "dataset"), [[1, 1, 1]])
+        np.save(self.path, np.array([[2, 2, 2]], dtype=np.int32))
+        # Make sure that the modification time changes
+        os.utime(self.path, ns=(0, os.stat(self.path).st_mtime_ns + 1))
+        self.assertEqual(self.lookup.get_tiles([0], "dataset"), [[2, 2, 2]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from backend.src.CONSTANTS import EMBEDDINGS_FILE_NAME, KNN_INDEXES_FILE_NAME
+from backend.src.app.neighbors import NeighborEngine
+
+
+class Hit:
+    def __init__(self, entity):
+        self.entity = entity
+
+    def to_dict(self):
+        return {"entity": self.entity}
+
+
+class FakeCollection:
+    def __init__(self, name, embeddings):
+        self.name = name
+        self.embeddings = embeddings
+        self.queries = []
+        self.searches = 0
+
+    def query(self, expr, output_fields):
+        indexes = [int(value) for value in expr[len("index in ["):-1].split(",")]
+        self.queries.append(indexes)
+        return [{"index": index, "embedding": self.embeddings[index].tolist(), "path": f"{index}.jpg"}
+                for index in indexes if index < len(self.embeddings)]
+
+    def search(self, data, anns_field, param, limit, output_fields):
+        self.searches += 1
+        data = np.array(data)
+        scores = data @ self.embeddings.T / np.outer(np.linalg.norm(data, axis=1),
+                                                     np.linalg.norm(self.embeddings, axis=1))
+        return [[Hit({"index": int(index), "path": f"{index}.jpg"}) for index in np.argsort(-row)[:limit]]
+                for row in scores]
+
+
+class TestNeighborEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.embeddings = np.random.default_rng(0).normal(size=(20, 8)).astype(np.float32)
+        self.collection = FakeCollection("dataset", self.embeddings)
+        self.engine = NeighborEngine(self.directory.name)
+
+    def test_neighbors_from_memory_mapped_embeddings(self):
+        matrix = self.embeddings.copy()
+        # The embedding of image 3 was not generated, so it is read from the collection
+        matrix[3] = 0
+        os.makedirs(os.path.join(self.directory.name, "dataset"))
+        np.save(os.path.join(self.directory.name, "dataset", EMBEDDINGS_FILE_NAME), matrix)
+
+        results = self.engine.get_neighbors([5, 3, 50], self.collection, 4)
+        self.assertEqual(self.collection.queries, [[3, 50]])
+        self.assertEqual(self.collection.searches, 1)
+        self.assertEqual([result["image"]["index"] for result in results[:2]], [5, 3])
+        self.assertEqual([len(result["neighbors"]) for result in results], [4, 4, 0])
+        self.assertNotIn(5, [neighbor["index"] for neighbor in results[0]["neighbors"]])
+        self.assertIsNone(results[2]["image"])
+
+    def test_embeddings_from_collection_without_file(self):
+        results = self.engine.get_neighbors([1, 2], self.collection, 3)
+        self.assertEqual(self.collection.queries, [[1, 2]])
+        self.assertEqual([result["image"]["index"] for result in results], [1, 2])
+
+    def test_neighbors_from_graph(self):
+        graph = np.argsort(-self.embeddings @ self.embeddings.T, axis=1)[:, 1:6].astype(np.int32)
+        # Image 4 has no neighbors in the graph, so its neighbors are searched
+        graph[4] = -1
+        os.makedirs(os.path.join(self.directory.name, "dataset"))
+        np.save(os.path.join(self.directory.name, "dataset", KNN_INDEXES_FILE_NAME), graph)
+
+        results = self.engine.get_neighbors([2, 4, 7], self.collection, 3)
+        self.assertEqual(self.collection.searches, 1)
+        self.assertEqual(results[0]["image"]["index"], 2)
+        self.assertEqual([neighbor["index"] for neighbor in results[0]["neighbors"]], graph[2, :3].tolist())
+        self.assertEqual([neighbor["index"] for neighbor in results[2]["neighbors"]], graph[7, :3].tolist())
+        self.assertEqual(results[1]["image"]["index"], 4)
+
+        # The graph contains only 5 neighbors, so larger requests are searched
+        self.engine.get_neighbors([2], self.collection, 6)
+        self.assertEqual(self.collection.searches, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+import gzip
+import json
+import unittest
+
+from backend.src.app.payloads import Payload, etag_matches
+
+
+class TestPayload(unittest.TestCase):
+
+    def test_payload_and_etag(self):
+        tiles = [{"index": 0, "data": [{"index": 3, "path": "a.jpg"}], "range": {"x_min": 0.0}}]
+        payload = Payload(tiles, collection_id=1, build_time=0.0)
+        self.assertEqual(json.loads(gzip.decompress(payload.body)), tiles)
+        # The ETag only depends on the data
+        self.assertEqual(payload.etag, Payload(tiles, collection_id=2, build_time=1.0).etag)
+
+        self.assertTrue(etag_matches(payload.etag, payload.etag))
+        self.assertTrue(etag_matches(f'"other", W/{payload.etag}', payload.etag))
+        self.assertTrue(etag_matches("*", payload.etag))
+        self.assertFalse(etag_matches('"other"', payload.etag))
+        self.assertFalse(etag_matches(None, payload.etag))
+
+
+if __name__ == "__main__":
+    unittest.main()
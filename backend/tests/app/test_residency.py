@@ -0,0 +1,155 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from backend.src.app import dependencies, residency
+from backend.src.app.residency import CollectionResidencyManager
+
+
+class FakeCollection:
+    def __init__(self, name):
+        self.name = name
+        self.loads = 0
+        self.releases = 0
+
+    def describe(self):
+        return {"collection_id": 1}
+
+    def load(self):
+        self.loads += 1
+
+    def release(self):
+        self.releases += 1
+
+
+class FakeSegment:
+    def __init__(self, mem_size):
+        self.mem_size = mem_size
+
+
+class TestCollectionResidencyManager(unittest.TestCase):
+
+    def setUp(self):
+        patches = [mock.patch.object(dependencies, "Collection", FakeCollection),
+                   mock.patch.object(dependencies.utility, "list_collections", return_value=["a", "b"]),
+                   mock.patch.object(dependencies.utility, "get_query_segment_info",
+                                     return_value=[FakeSegment(60), FakeSegment(40)]),
+                   mock.patch.object(residency, "COLLECTION_EVICTION_MIN_IDLE", 0.0)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.getter = dependencies.DatasetCollectionNameGetter([{"name": "a"}, {"name": "b"}, {"name": "c"}])
+        # Use a long interval, so that only explicit checks release collections
+        self.manager = CollectionResidencyManager([self.getter], memory_budget=1000, idle_timeout=0.05, interval=3600)
+
+    def test_collections_are_loaded_on_access(self):
+        self.assertIsNone(self.getter("c"))
+        collection = self.getter("a")
+        self.getter("a")
+        self.assertEqual(collection.loads, 1)
+        self.assertTrue(self.getter.collections["a"].loaded)
+        self.assertFalse(self.getter.collections["b"].loaded)
+
+    def test_idle_collections_are_released(self):
+        first = self.getter("a")
+        second = self.getter("b")
+        time.sleep(0.1)
+        self.getter("b")
+        self.manager.check()
+        self.assertEqual(first.releases, 1)
+        self.assertEqual(second.releases, 0)
+        self.assertFalse(self.getter.collections["a"].loaded)
+
+        # A released collection is loaded again by the next request
+        self.getter("a")
+        self.assertEqual(first.loads, 2)
+        metrics = self.manager.get_metrics()
+        self.assertEqual(metrics["releases"], {"idle": 1})
+        self.assertEqual(metrics["loads"], {"request": 3})
+        self.assertEqual(metrics["stalls"], 3)
+        self.assertEqual(metrics["collections"]["a"]["loads"], 2)
+        self.assertEqual(metrics["loaded_bytes"], 200)
+
+    def test_collections_are_evicted_to_fit_in_budget(self):
+        self.manager.memory_budget = 150
+        self.manager.idle_timeout = 3600
+        first = self.getter("a")
+        time.sleep(0.01)
+        second = self.getter("b")
+        self.manager.check()
+        # The least recently used collection is evicted
+        self.assertEqual(first.releases, 1)
+        self.assertEqual(second.releases, 0)
+        self.assertEqual(self.manager.get_loaded_size(), 100)
+        self.assertEqual(self.manager.get_metrics()["events"][-1]["reason"], "budget")
+
+    def test_collections_in_use_are_not_released(self):
+        self.manager.memory_budget = 0
+        with self.getter.using("a") as collection:
+            time.sleep(0.1)
+            # The request is still using the collection, e.g. waiting for an executor
+            self.manager.check()
+            self.assertEqual(collection.releases, 0)
+            self.assertEqual(self.manager.get_metrics()["collections"]["a"]["in_use"], 1)
+        self.assertEqual(self.getter.collections["a"].in_use, 0)
+        time.sleep(0.1)
+        self.manager.check()
+        self.assertEqual(collection.releases, 1)
+
+    def test_use_dependency_holds_collection(self):
+        dependency = self.getter.use("a")
+        collection = next(dependency)
+        self.assertEqual(self.getter.collections["a"].in_use, 1)
+        dependency.close()
+        self.assertEqual(self.getter.collections["a"].in_use, 0)
+        self.assertEqual(collection.loads, 1)
+
+    def test_loaded_collections_are_used_without_lock(self):
+        self.getter("a")
+        helper = self.getter.collections["a"]
+        with helper.lock:
+            thread = threading.Thread(target=self.getter, args=("a",))
+            thread.start()
+            thread.join(1)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(helper.in_use, 0)
+
+    def test_release_checks_requests_again(self):
+        collection = self.getter("a")
+        helper = self.getter.collections["a"]
+        released = helper.released
+        reads = []
+
+        class Released:
+            def __next__(self):
+                reads.append(None)
+                if len(reads) == 2:
+                    # A request gets the loaded collection after the first check
+                    next(helper.acquired)
+                return next(released)
+
+        helper.released = Released()
+        time.sleep(0.1)
+        self.assertFalse(helper.release_if_idle(0.05))
+        self.assertTrue(helper.loaded)
+        self.assertEqual(collection.releases, 0)
+        self.assertEqual(helper.in_use, 1)
+
+    def test_prewarm_stops_at_budget(self):
+        self.manager.memory_budget = 100
+        self.manager.prewarm(["b", "c", "a"])
+        self.assertTrue(self.getter.collections["b"].loaded)
+        self.assertFalse(self.getter.collections["a"].loaded)
+        self.assertEqual(self.manager.get_metrics()["loads"], {"prewarm": 1})
+
+    def test_added_collection_replaces_dictionary(self):
+        collections = self.getter.collections
+        self.getter.add(dependencies.HelperCollection("c"))
+        self.getter.remove("b")
+        self.assertEqual(sorted(collections), ["a", "b"])
+        self.assertEqual(sorted(self.getter.collections), ["a", "c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
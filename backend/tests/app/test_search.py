@@ -0,0 +1,184 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from backend.src.CONSTANTS import ATTRIBUTES_FILE_NAME, EMBEDDINGS_FILE_NAME, KNN_INDEXES_FILE_NAME
+from backend.src.app import gets
+from backend.src.app.neighbors import NeighborEngine
+from backend.src.app.search import LocalSearchBackend, MilvusSearchBackend, SearchBackendGetter
+
+
+class Hit:
+    def __init__(self, entity):
+        self.entity = entity
+
+    def to_dict(self):
+        return {"entity": self.entity}
+
+
+class QueryIterator:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def next(self):
+        return self.pages.pop(0) if len(self.pages) > 0 else []
+
+    def close(self):
+        pass
+
+
+class FakeCollection:
+    def __init__(self, embeddings, name="small", collection_id=1):
+        self.embeddings = embeddings
+        self.name = name
+        self.collection_id = collection_id
+        self.params = []
+        self.exports = 0
+
+    def describe(self):
+        return {"collection_id": self.collection_id}
+
+    def query_iterator(self, batch_size, expr, output_fields):
+        self.exports += 1
+        entities = [{"index": index, "path": f"{index}.jpg"} for index in range(len(self.embeddings))]
+        return QueryIterator([entities[:150], entities[150:]])
+
+    def query(self, expr, output_fields):
+        indexes = [int(value) for value in expr[len("index in ["):-1].split(",")]
+        return [{"index": index, "path": f"{index}.jpg"} for index in indexes]
+
+    def search(self, data, anns_field, param, limit, output_fields):
+        self.params.append(param)
+        data = np.array(data)
+        scores = data @ self.embeddings.T / np.outer(np.linalg.norm(data, axis=1),
+                                                     np.linalg.norm(self.embeddings, axis=1))
+        return [[Hit({"index": int(index), "path": f"{index}.jpg"}) for index in np.argsort(-row)[:limit]]
+                for row in scores]
+
+
+class TestSearchBackends(unittest.TestCase):
+
+    def setUp(self):
+        self.embeddings = np.random.default_rng(0).normal(size=(200, 16)).astype(np.float32)
+        self.collection = FakeCollection(self.embeddings)
+
+    def test_local_backend_matches_milvus_backend(self):
+        queries = np.random.default_rng(1).normal(size=(5, 16)).tolist()
+        local = LocalSearchBackend(self.embeddings).search(self.collection, queries, 7)
+        milvus = MilvusSearchBackend({"ef": 4}).search(self.collection, queries, 7)
+        self.assertEqual([[entity["index"] for entity in row] for row in local],
+                         [[entity["index"] for entity in row] for row in milvus])
+        # ef is raised to the number of results
+        self.assertEqual(self.collection.params[0]["params"], {"ef": 7})
+
+    def test_local_backend_skips_empty_embeddings(self):
+        embeddings = self.embeddings[:5].copy()
+        embeddings[2] = 0
+        indexes, scores = LocalSearchBackend(embeddings).search_indexes(embeddings[[0]].tolist(), 10)
+        self.assertEqual(sorted(indexes[0].tolist()), [0, 1, 3, 4])
+        self.assertEqual(indexes[0, 0], 0)
+        self.assertAlmostEqual(scores[0, 0], 1, places=5)
+        self.assertTrue((np.diff(scores[0]) <= 0).all())
+
+    def test_backend_chosen_per_dataset(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, "small"))
+            np.save(os.path.join(directory, "small", EMBEDDINGS_FILE_NAME), self.embeddings)
+            datasets = [{"name": "small", "search_backend": "local"}, {"name": "large"},
+                        {"name": "missing", "search_backend": "local"}]
+            getter = SearchBackendGetter(datasets, lambda name: {"nprobe": 8}, directory)
+            large = FakeCollection(self.embeddings, "large")
+            self.assertIsInstance(getter(self.collection), LocalSearchBackend)
+            self.assertIs(getter(self.collection), getter(self.collection))
+            self.assertIsInstance(getter(large), MilvusSearchBackend)
+            self.assertEqual(getter(large).search_params, {"nprobe": 8})
+            # Without the matrix of embeddings, the dataset is searched in Milvus
+            self.assertIsInstance(getter(FakeCollection(self.embeddings, "missing")), MilvusSearchBackend)
+
+            # The setting is read again when the collection is rebuilt
+            path = os.path.join(directory, "datasets.json")
+            with open(path, "w") as f:
+                json.dump({"datasets": [{"name": "small", "search_backend": "milvus"}]}, f)
+            with mock.patch("backend.src.app.search.DATASETS_JSON_PATH", path):
+                getter.invalidate("small")
+            self.assertIsInstance(getter(self.collection), MilvusSearchBackend)
+
+    def test_attributes_are_exported_once_per_collection(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, "small"))
+            np.save(os.path.join(directory, "small", EMBEDDINGS_FILE_NAME), self.embeddings)
+            datasets = [{"name": "small", "search_backend": "local"}]
+            backend = SearchBackendGetter(datasets, lambda name: {}, directory)(self.collection)
+            self.assertEqual(self.collection.exports, 1)
+            self.assertEqual(backend.get_images(self.collection, [3, 199, 500]),
+                             {3: {"index": 3, "path": "3.jpg"}, 199: {"index": 199, "path": "199.jpg"}})
+            self.assertTrue(os.path.exists(os.path.join(directory, "small", ATTRIBUTES_FILE_NAME)))
+
+            # The saved attributes are used while the collection is the same
+            SearchBackendGetter(datasets, lambda name: {}, directory)(self.collection)
+            self.assertEqual(self.collection.exports, 1)
+            # The attributes are exported again when the collection has been rebuilt
+            rebuilt = FakeCollection(self.embeddings, collection_id=2)
+            SearchBackendGetter(datasets, lambda name: {}, directory)(rebuilt)
+            self.assertEqual(rebuilt.exports, 1)
+
+
+class OfflineCollection:
+    # Collection of a dataset whose Milvus server is not available
+    def __init__(self, name):
+        self.name = name
+
+    def describe(self):
+        return {"collection_id": 1}
+
+    def __getattr__(self, name):
+        raise AssertionError(f"Milvus was used: {name}")
+
+
+class TestLocalSearchWithoutMilvus(unittest.TestCase):
+    """
+    The searches of the image-text, image-image, neighbors and neighbors-batch endpoints, with the local backend.
+    """
+
+    def setUp(self):
+        self.embeddings = np.random.default_rng(0).normal(size=(50, 8)).astype(np.float32)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        os.makedirs(os.path.join(self.directory, "small"))
+        np.save(os.path.join(self.directory, "small", EMBEDDINGS_FILE_NAME), self.embeddings)
+        with open(os.path.join(self.directory, "small", ATTRIBUTES_FILE_NAME), "w") as f:
+            json.dump({"collection_id": 1, "entities": [{"index": index, "path": f"{index}.jpg"}
+                                                         for index in range(len(self.embeddings))]}, f)
+        self.collection = OfflineCollection("small")
+        self.backend = SearchBackendGetter([{"name": "small", "search_backend": "local"}], lambda name: {},
+                                           self.directory)(self.collection)
+
+    def test_image_from_embedding(self):
+        result = gets.get_image_info_from_text_embedding(self.collection, self.embeddings[[7]], self.backend)
+        self.assertEqual(result, {"index": 7, "path": "7.jpg"})
+        result = gets.get_image_info_from_image_embedding(self.collection, self.embeddings[[9]], self.backend)
+        self.assertEqual(result, {"index": 9, "path": "9.jpg"})
+
+    def test_neighbors(self):
+        engine = NeighborEngine(self.directory)
+        results = engine.get_neighbors([4, 11], self.collection, 5, self.backend)
+        self.assertEqual([result["image"]["index"] for result in results], [4, 11])
+        expected, _ = self.backend.search_indexes(self.embeddings[[4, 11]].tolist(), 6)
+        for result, row in zip(results, expected):
+            self.assertEqual([image["index"] for image in result["neighbors"]], row[1:].tolist())
+
+    def test_neighbors_from_graph(self):
+        graph = np.tile(np.arange(1, 4), (len(self.embeddings), 1))
+        np.save(os.path.join(self.directory, "small", KNN_INDEXES_FILE_NAME), graph)
+        results = NeighborEngine(self.directory).get_neighbors([0], self.collection, 3, self.backend)
+        self.assertEqual(results[0]["image"], {"index": 0, "path": "0.jpg"})
+        self.assertEqual([image["index"] for image in results[0]["neighbors"]], [1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
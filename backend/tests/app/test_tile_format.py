@@ -0,0 +1,31 @@
+import unittest
+
+from backend.src.app.tile_format import decode_tiles, encode_tiles
+
+
+class TestTileFormat(unittest.TestCase):
+
+    def test_round_trip(self):
+        tiles = [
+            {"index": 5, "data": [
+                {"index": 1, "path": "a/é.jpg", "x": 0.5, "y": -1.25, "width": 300, "height": 200, "zoom": 2},
+                {"index": 2, "path": "b.jpg", "x": 1.0, "y": 2.0, "width": 3, "height": 4, "zoom": 0}
+            ]},
+            {"index": 7, "data": []},
+            {"index": 8, "data": [
+                {"index": 1, "path": "a/é.jpg", "x": 0.5, "y": -1.25, "width": 300, "height": 200, "zoom": 2}
+            ]}
+        ]
+        encoded = encode_tiles(tiles)
+        # Sections are aligned to 4 bytes
+        self.assertEqual(len(encoded) % 4, 0)
+        self.assertEqual(decode_tiles(encoded), tiles)
+        self.assertEqual(decode_tiles(encode_tiles([])), [])
+
+    def test_unsupported_encoding(self):
+        with self.assertRaises(ValueError):
+            decode_tiles(b"JSON" + encode_tiles([])[4:])
+
+
+if __name__ == "__main__":
+    unittest.main()
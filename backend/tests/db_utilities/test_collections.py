@@ -0,0 +1,29 @@
+import unittest
+
+from backend.src.CONSTANTS import INDEX_PARAMS, SEARCH_PARAMS
+from backend.src.db_utilities.collections import get_index_config
+
+
+class TestGetIndexConfig(unittest.TestCase):
+
+    def test_default_is_flat(self):
+        self.assertEqual(get_index_config({"name": "dataset"}), {"type": "FLAT", "params": {}, "search_params": {}})
+
+    def test_parameters_override_defaults(self):
+        config = get_index_config({"name": "dataset", "index": {"type": "HNSW", "params": {"M": 32},
+                                                                  "search_params": {"ef": 128}}})
+        self.assertEqual(config["type"], "HNSW")
+        self.assertEqual(config["params"], {**INDEX_PARAMS["HNSW"], "M": 32})
+        self.assertEqual(config["search_params"], {"ef": 128})
+
+        config = get_index_config({"name": "dataset", "index": {"type": "IVF_SQ8"}})
+        self.assertEqual(config["params"], INDEX_PARAMS["IVF_SQ8"])
+        self.assertEqual(config["search_params"], SEARCH_PARAMS["IVF_SQ8"])
+
+    def test_unknown_index_type(self):
+        with self.assertRaises(ValueError):
+            get_index_config({"name": "dataset", "index": {"type": "DISKANN"}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from backend.src.db_utilities.create_and_populate_clusters_collection import create_image_to_tile_file, create_tiling, \
+    get_index_from_tile, get_previously_inserted_tile, MAX_IMAGES_PER_TILE
+from backend.src.db_utilities.entities import EntityTable
+
+
+def generate_entities(n, seed=0):
+    rng = np.random.default_rng(seed)
+    points = np.concatenate([rng.normal(center, 0.5, size=(n // 4 + 1, 2))
+                             for center in rng.uniform(-10, 10, size=(4, 2))])[:n]
+    return EntityTable.from_entities([
+        {"index": i, "path": f"{i}.jpg", "width": 1, "height": 1, "x": float(point[0]), "y": float(point[1])}
+        for i, point in enumerate(points)
+    ])
+
+
+class TestCreateTiling(unittest.TestCase):
+
+    def test_tiles_contain_at_most_max_images(self):
+        entities = generate_entities(5000)
+        tiling, max_zoom_level = create_tiling(entities)
+        self.assertEqual(tiling.number_of_tiles, 2 ** max_zoom_level)
+        self.assertTrue(tiling.counts.max() <= MAX_IMAGES_PER_TILE)
+        self.assertEqual(tiling.offsets[-1], len(entities))
+
+        # The previous zoom level must have at least one tile with too many images
+        previous = tiling.counts.reshape(2 ** (max_zoom_level - 1), 2, 2 ** (max_zoom_level - 1), 2).sum(axis=(1, 3))
+        self.assertTrue(previous.max() > MAX_IMAGES_PER_TILE)
+
+    def test_tiles_match_direct_assignment(self):
+        entities = generate_entities(2000, seed=1)
+        tiling, max_zoom_level = create_tiling(entities)
+        number_of_tiles = 2 ** max_zoom_level
+        x_min, x_max = entities.x.min(), entities.x.max()
+        y_min, y_max = entities.y.min(), entities.y.max()
+
+        # Build the grid as a nested list of rows
+        grid = [[[] for _ in range(number_of_tiles)] for _ in range(number_of_tiles)]
+        for i in range(len(entities)):
+            tile_x = min(int(((entities.x[i] - x_min) * number_of_tiles) // (x_max - x_min)), number_of_tiles - 1)
+            tile_y = min(int(((entities.y[i] - y_min) * number_of_tiles) // (y_max - y_min)), number_of_tiles - 1)
+            grid[tile_x][tile_y].append(i)
+
+        for span in [1, 2, number_of_tiles]:
+            for tile_x in range(0, number_of_tiles, span):
+                for tile_y in range(0, number_of_tiles, span):
+                    # Entities are shuffled before tiling, so only compare the content of each tile
+                    expected = [i for x in range(tile_x, tile_x + span) for y in range(tile_y, tile_y + span)
+                                for i in grid[x][y]]
+                    actual = tiling.get_entities_in_tile(tile_x, tile_y, span).tolist()
+                    self.assertEqual(sorted(expected), sorted(actual))
+
+
+class FakeClustersCollection:
+    def __init__(self, tiles):
+        self.tiles = tiles
+
+    def query(self, expr, output_fields):
+        indexes = [int(value) for value in expr[len("index in ["):-1].split(",")]
+        return [self.tiles[index] for index in indexes if index in self.tiles]
+
+
+class TestGetPreviouslyInsertedTile(unittest.TestCase):
+
+    def test_representatives_are_rows_of_the_entity_table(self):
+        entities = generate_entities(10)
+        # Tiles of zoom level 1 inserted before the last flush
+        tiles = {get_index_from_tile(1, 1, 0): {"tile": [1, 1, 0], "data": [{"index": 7}, {"index": 2}]},
+                 get_index_from_tile(1, 1, 1): {"tile": [1, 1, 1], "data": [{"index": 4}]}}
+        zoom_levels = {1: {0: {0: {"already_inserted": False, "representatives": np.array([0])}}}}
+        entities_per_zoom_level = {1: 1}
+
+        result = get_previously_inserted_tile(FakeClustersCollection(tiles), entities, 1, 1, 0, zoom_levels,
+                                              entities_per_zoom_level)
+        self.assertTrue(result)
+        self.assertEqual(entities_per_zoom_level[1], 3)
+        self.assertTrue(zoom_levels[1][1][0]["already_inserted"])
+        self.assertEqual(zoom_levels[1][1][0]["representatives"].tolist(), entities.get_rows([7, 2]).tolist())
+        self.assertEqual(zoom_levels[1][1][1]["representatives"].tolist(), entities.get_rows([4]).tolist())
+
+
+class TestCreateImageToTileFile(unittest.TestCase):
+
+    def test_rows_are_indexed_by_image_index(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "dataset", "image_to_tile.npy")
+            create_image_to_tile_file(np.array([4, 0, 2]), np.array([[3, 1, 2], [0, 0, 0], [5, 30, 7]]), path)
+            matrix = np.load(path)
+            self.assertEqual(matrix.dtype, np.int32)
+            self.assertEqual(matrix.tolist(), [[0, 0, 0], [-1, -1, -1], [5, 30, 7], [-1, -1, -1], [3, 1, 2]])
+            self.assertEqual(os.listdir(os.path.dirname(path)), ["image_to_tile.npy"])
+
+
+class TestEntityTable(unittest.TestCase):
+
+    def test_rows_and_paths(self):
+        first = EntityTable.from_entities([
+            {"index": 5, "path": "a/b.jpg", "width": 10, "height": 20, "x": 0.5, "y": -1.0},
+            {"index": 2, "path": "è.png", "width": 11, "height": 21, "x": 1.5, "y": 2.0}
+        ])
+        second = EntityTable.from_entities([
+            {"index": 9, "path": "c.jpg", "width": 12, "height": 22, "x": 3.0, "y": 4.0}
+        ])
+        table = EntityTable.concatenate([first, second])
+        self.assertEqual(len(table), 3)
+        self.assertEqual([table.get_path(row) for row in range(3)], ["a/b.jpg", "è.png", "c.jpg"])
+        self.assertEqual(table.get_rows([9, 5, 2]).tolist(), [2, 0, 1])
+        self.assertEqual(table.to_dict(1),
+                         {"index": 2, "path": "è.png", "x": 1.5, "y": 2.0, "width": 11, "height": 21})
+        with self.assertRaises(KeyError):
+            table.get_rows([3])
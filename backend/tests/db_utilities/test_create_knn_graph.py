@@ -0,0 +1,43 @@
+import unittest
+
+import numpy as np
+
+from backend.src.db_utilities.create_knn_graph import build_knn_graph
+
+
+class TestBuildKnnGraph(unittest.TestCase):
+
+    def test_graph_matches_brute_force(self):
+        embeddings = np.random.default_rng(0).normal(size=(300, 16)).astype(np.float32)
+        # The embeddings of images 7 and 100 were not generated
+        embeddings[[7, 100]] = 0
+        indexes = np.zeros((300, 10), dtype=np.int32)
+        scores = np.zeros((300, 10), dtype=np.float16)
+        build_knn_graph(embeddings, indexes, scores, block_size=64, workers=4)
+
+        norms = np.linalg.norm(embeddings, axis=1)
+        normalized = embeddings / np.where(norms > 0, norms, 1)[:, None]
+        similarities = normalized @ normalized.T
+        np.fill_diagonal(similarities, -np.inf)
+        similarities[:, [7, 100]] = -np.inf
+        expected = np.argsort(-similarities, axis=1, kind="stable")[:, :10]
+
+        valid = np.ones(300, dtype=bool)
+        valid[[7, 100]] = False
+        np.testing.assert_array_equal(indexes[valid], expected[valid])
+        np.testing.assert_allclose(scores[valid], np.take_along_axis(similarities, expected, axis=1)[valid],
+                                   atol=1e-2)
+        self.assertTrue((indexes[~valid] == -1).all())
+        self.assertTrue((scores[~valid] == 0).all())
+
+    def test_fewer_images_than_neighbors(self):
+        embeddings = np.eye(4, dtype=np.float32)
+        indexes = np.zeros((4, 5), dtype=np.int32)
+        scores = np.zeros((4, 5), dtype=np.float16)
+        build_knn_graph(embeddings, indexes, scores, block_size=2, workers=2)
+        self.assertTrue((indexes[:, 3:] == -1).all())
+        self.assertEqual(sorted(indexes[0, :3].tolist()), [1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+import numpy as np
+
+from backend.src.db_utilities.export import export_collection, columns_to_rows
+
+
+class FakeQueryIterator:
+    def __init__(self, rows, batch_size):
+        self.pages = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+        self.closed = False
+
+    def next(self):
+        return self.pages.pop(0) if len(self.pages) > 0 else []
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCollection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.iterator = None
+
+    def query_iterator(self, batch_size, expr, output_fields):
+        self.iterator = FakeQueryIterator(self.rows, batch_size)
+        return self.iterator
+
+
+class TestExportCollection(unittest.TestCase):
+
+    def test_batches_are_columns(self):
+        # Indexes are not dense
+        rows = [{"index": 3 * i, "x": i / 2, "path": f"{i}.jpg", "embedding": [float(i), 1.0]} for i in range(10)]
+        collection = FakeCollection(rows)
+        batches = list(export_collection(collection, ["*"], batch_size=4))
+
+        self.assertEqual([len(batch["index"]) for batch in batches], [4, 4, 2])
+        self.assertTrue(collection.iterator.closed)
+        self.assertEqual(np.concatenate([batch["index"] for batch in batches]).tolist(), [3 * i for i in range(10)])
+        self.assertEqual(batches[0]["embedding"].dtype, np.float32)
+        self.assertEqual(batches[0]["embedding"].shape, (4, 2))
+        self.assertEqual(batches[2]["path"], ["8.jpg", "9.jpg"])
+        self.assertEqual([row for batch in batches for row in columns_to_rows(batch)], rows)
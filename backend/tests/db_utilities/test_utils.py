@@ -0,0 +1,51 @@
+import unittest
+
+import numpy as np
+
+from backend.src.db_utilities.utils import ModifiedKMeans
+
+
+class TestModifiedKMeans(unittest.TestCase):
+
+    def test_get_representatives(self):
+        rng = np.random.default_rng(0)
+        X = rng.normal(size=(500, 2))
+        kmeans = ModifiedKMeans(n_clusters=30, random_state=0, n_init=1, max_iter=1000)
+        kmeans.fit(X, fixed_centers=X[:5].copy())
+
+        counts, representatives = kmeans.get_representatives(X)
+        labels = kmeans.predict(X)
+        self.assertEqual(counts.sum(), len(X))
+        for cluster in range(30):
+            in_cluster = np.flatnonzero(labels == cluster)
+            self.assertEqual(len(in_cluster), counts[cluster])
+            if len(in_cluster) == 0:
+                self.assertEqual(representatives[cluster], -1)
+            else:
+                distances = np.sum((X[in_cluster] - kmeans.cluster_centers_[cluster]) ** 2, axis=1)
+                self.assertEqual(in_cluster[np.argmin(distances)], representatives[cluster])
+
+    def test_compute_initial_centers_farthest_point(self):
+        X = np.array([[0.0, 0.0], [1.0, 0.0], [5.0, 0.0], [0.0, 3.0], [2.0, 2.0]])
+        fixed_centers = np.array([[0.0, 0.0]])
+        centers = ModifiedKMeans._compute_initial_centers(X, fixed_centers, 3, n_init=1)
+        # The fixed center is kept, then each new center is the point farthest from all the previous centers
+        np.testing.assert_array_equal(centers, np.array([[0.0, 0.0], [5.0, 0.0], [0.0, 3.0], [2.0, 2.0]]))
+
+    def test_fit_with_fixed_centers(self):
+        rng = np.random.default_rng(1)
+        X = rng.normal(size=(400, 2))
+        fixed_centers = X[:3].copy()
+        kmeans = ModifiedKMeans(n_clusters=10, random_state=0, n_init=1, max_iter=1000, tol=0.0)
+        kmeans.fit(X, fixed_centers=fixed_centers)
+
+        # Fixed centers do not move
+        np.testing.assert_array_equal(kmeans.cluster_centers_[:3], fixed_centers)
+        self.assertTrue(1 <= kmeans.n_iter_ <= 1000)
+        # Inertia is the sum of squared distances from the closest center
+        distances = np.sum((X[:, np.newaxis, :] - kmeans.cluster_centers_[np.newaxis]) ** 2, axis=2)
+        self.assertAlmostEqual(kmeans.inertia_, np.sum(np.min(distances, axis=1)))
+        # With tol=0, moving centers are the means of their clusters
+        labels = kmeans.predict(X)
+        for cluster in range(3, 10):
+            np.testing.assert_allclose(kmeans.cluster_centers_[cluster], X[labels == cluster].mean(axis=0))
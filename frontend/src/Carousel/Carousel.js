@@ -82,6 +82,38 @@ function fetchNeighbors(index, k, host, dataset) {
 }
 
 
+function toCarouselImage(image) {
+    // Keep the attributes of an image returned by the server that are shown in the carousel
+    // noinspection JSUnresolvedVariable
+    const new_image = {
+        path: image.path,
+        index: image.index,
+        author: image.author,
+        width: image.width,
+        height: image.height,
+        x: image.x,
+        y: image.y
+    }
+    // noinspection JSUnresolvedVariable
+    if (image.genre !== undefined)
+        // noinspection JSUnresolvedVariable
+        new_image.genre = image.genre;
+    // noinspection JSUnresolvedVariable
+    if (image.title !== undefined)
+        // noinspection JSUnresolvedVariable
+        new_image.title = image.title;
+    // noinspection JSUnresolvedVariable
+    if (image.date !== undefined)
+        // noinspection JSUnresolvedVariable
+        new_image.date = image.date;
+    // noinspection JSUnresolvedVariable
+    if (image.caption !== undefined)
+        // noinspection JSUnresolvedVariable
+        new_image.caption = image.caption;
+    return new_image;
+}
+
+
 const NeighborsCarousel = (props) => {
     // Define state for images to show. The state consists of pairs (path, text), where path is the path to the image
     // and text is the text associated to the image.
@@ -117,45 +149,10 @@ const NeighborsCarousel = (props) => {
         // Fetch neighbors from server
         fetchNeighbors(props.clickedImageIndex, NUM_OF_NEIGHBORS, props.host, selectedDataset.current)
             .then(data => {
-                // Populate state images with the fetched images
-                let images = [];
-                let first = true;
-                for (const image of data) {
-                    // noinspection JSUnresolvedVariable
-                    const new_image = {
-                        path: image.path,
-                        index: image.index,
-                        author: image.author,
-                        width: image.width,
-                        height: image.height,
-                        x: image.x,
-                        y: image.y
-                    }
-                    // noinspection JSUnresolvedVariable
-                    if (image.genre !== undefined)
-                        // noinspection JSUnresolvedVariable
-                        new_image.genre = image.genre;
-                    // noinspection JSUnresolvedVariable
-                    if (image.title !== undefined)
-                        // noinspection JSUnresolvedVariable
-                        new_image.title = image.title;
-                    // noinspection JSUnresolvedVariable
-                    if (image.date !== undefined)
-                        // noinspection JSUnresolvedVariable
-                        new_image.date = image.date;
-                    // noinspection JSUnresolvedVariable
-                    if (image.caption !== undefined)
-                        // noinspection JSUnresolvedVariable
-                        new_image.caption = image.caption;
-                    // noinspection JSUnresolvedVariable
-                    if (!first)
-                        images.push(new_image);
-                    else {
-                        // noinspection JSUnresolvedVariable
-                        setImage(new_image);
-                        first = false;
-                    }
-                }
+                // Show the clicked image as the main image, and populate state images with its neighbors
+                if (data.image !== null)
+                    setImage(toCarouselImage(data.image));
+                const images = data.neighbors.map(toCarouselImage);
                 setImages(images);
                 return images
             })
@@ -6,6 +6,7 @@ import {LRUCache} from "lru-cache";
 import 'tailwindcss/tailwind.css';
 import {
     convertIndexToTile,
+    decodeTiles,
     getTilesForTranslationTicker,
     getTilesForZoomTicker,
     getTilesFromZoomLevel,
@@ -149,8 +150,8 @@ const ClustersMap = (props) => {
 
     // FETCHING OPERATIONS
     const fetchTiles = (indexes) => {
-        // Create url
-        const url = `${props.host}/api/tiles?indexes=${indexes.join(",")}&collection=${selectedDataset.current}_zoom_levels_clusters`;
+        // Create url. Tiles are requested in the compact binary format.
+        const url = `${props.host}/api/tiles?indexes=${indexes.join(",")}&collection=${selectedDataset.current}_zoom_levels_clusters&format=binary`;
         // Create abort controller for the fetch operation and add it to the map of abort controllers. Generate key
         // using the current time.
         const abortController = new AbortController();
@@ -166,11 +167,11 @@ const ClustersMap = (props) => {
                 if (!response.ok)
                     throw new Error('Tile data could not be retrieved from the server.' +
                         ' Please try again later. Status: ' + response.status + ' ' + response.statusText);
-                return response.json();
+                return response.arrayBuffer();
             })
-            .then(data => {
+            .then(buffer => {
                 // Save data in the cache. Use the triple of zoom level, tile x and tile y as key.
-                for (let tile of data) {
+                for (let tile of decodeTiles(buffer)) {
                     // Get tile from index
                     const zoom_plus_tile = convertIndexToTile(tile["index"]);
                     tilesCache.current.set(zoom_plus_tile.zoom + "-" + zoom_plus_tile.x + "-" + zoom_plus_tile.y, tile["data"]);
@@ -250,4 +250,61 @@ export function getTilesForZoomTicker(tile_x, tile_y, zoom_level, max_zoom_level
         }
     }
     return indexes_of_tiles_to_fetch;
-}
\ No newline at end of file
+}
+
+export function decodeTiles(buffer) {
+    // Decode tiles sent by /api/tiles with format=binary. The encoding is defined in backend/src/app/tile_format.py.
+    // After a header of 24 bytes, the sections are stored one after the other, each of them aligned to 4 bytes. All
+    // values are little-endian.
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3));
+    if (magic !== "AETL" || view.getUint16(4, true) !== 1)
+        throw new Error('Unsupported tile encoding.');
+    const number_of_tiles = view.getUint32(8, true);
+    const number_of_representatives = view.getUint32(12, true);
+    const number_of_paths = view.getUint32(16, true);
+    const paths_size = view.getUint32(20, true);
+    let offset = 24;
+    // Create a typed array over the next section and move the offset to the following section
+    const read = (TypedArray, count) => {
+        const array = new TypedArray(buffer, offset, count);
+        offset += Math.ceil(array.byteLength / 4) * 4;
+        return array;
+    };
+    const tile_indexes = read(Int32Array, number_of_tiles);
+    const counts = read(Uint32Array, number_of_tiles);
+    const indexes = read(Int32Array, number_of_representatives);
+    const path_ids = read(Uint32Array, number_of_representatives);
+    const widths = read(Uint32Array, number_of_representatives);
+    const heights = read(Uint32Array, number_of_representatives);
+    const xs = read(Float32Array, number_of_representatives);
+    const ys = read(Float32Array, number_of_representatives);
+    const zooms = read(Uint8Array, number_of_representatives);
+    const offsets = read(Uint32Array, number_of_paths + 1);
+    const decoder = new TextDecoder();
+    const path_bytes = new Uint8Array(buffer, offset, paths_size);
+    const paths = [];
+    for (let i = 0; i < number_of_paths; i++)
+        paths.push(decoder.decode(path_bytes.subarray(offsets[i], offsets[i + 1])));
+
+    // Build the same objects as the JSON encoding
+    const tiles = [];
+    let start = 0;
+    for (let t = 0; t < number_of_tiles; t++) {
+        const data = [];
+        for (let i = start; i < start + counts[t]; i++) {
+            data.push({
+                index: indexes[i],
+                path: paths[path_ids[i]],
+                x: xs[i],
+                y: ys[i],
+                width: widths[i],
+                height: heights[i],
+                zoom: zooms[i]
+            });
+        }
+        tiles.push({index: tile_indexes[t], data: data});
+        start += counts[t];
+    }
+    return tiles;
+}
@@ -7,7 +7,8 @@ const {
     convertIndexToTile,
     convertTileToIndex,
     getTilesToFetch,
-    getTilesFromZoomLevel
+    getTilesFromZoomLevel,
+    decodeTiles
 } = require('../../Map/utilities');
 
 // Test fetchTileData
@@ -102,3 +103,19 @@ test('getTilesFromZoomLevel', async () => {
     tiles = getTilesFromZoomLevel(1, 1, 1);
     expect(tiles.length).toBe(4);
 });
+
+
+// Test decodeTiles
+// ----------------------------------------------------------------------------
+test('decodeTiles', async () => {
+    // Two tiles encoded by backend/src/app/tile_format.py. The path of the first representative is stored once.
+    const encoded = "QUVUTAEAAAACAAAAAwAAAAIAAAANAAAABQAAAAcAAAACAAAAAQAAAAEAAAACAAAAAQAAAAAAAAABAAAAAAAAACwBAAADAAAALAEAAMgAAAAE" +
+        "AAAAyAAAAAAAAD8AAIA/AAAAPwAAoL8AAABAAACgvwIAAgAAAAAACAAAAA0AAABhL8OpLmpwZ2IuanBnAAAA";
+    const bytes = Uint8Array.from(atob(encoded), c => c.charCodeAt(0));
+    const tiles = decodeTiles(bytes.buffer);
+    expect(tiles.map(tile => tile.index)).toEqual([5, 7]);
+    expect(tiles[0].data.length).toBe(2);
+    expect(tiles[0].data[0]).toEqual({index: 1, path: "a/é.jpg", x: 0.5, y: -1.25, width: 300, height: 200, zoom: 2});
+    expect(tiles[0].data[1].path).toBe("b.jpg");
+    expect(tiles[1].data[0].path).toBe("a/é.jpg");
+});